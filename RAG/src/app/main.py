@@ -1,10 +1,8 @@
-def suggest_privileges_via_llm(roles: list[str], project_code: str) -> list[str]:
+def _llm_suggest_privileges(roles: list[str], project_code: str) -> list[str] | None:
     """Ask local llama.cpp server for privilege keys to grant based on roles and project.
     Expects an OpenAI-compatible /v1/chat/completions endpoint.
-    Returns a list of privilege keys like ["db_read", "repo_access"].
+    Returns a list of privilege keys like ["db_read", "repo_access"], or None on failure.
     """
-    llm_url = os.getenv("LLM_URL", "http://127.0.0.1:8080")
-    endpoint = f"{llm_url.rstrip('/')}/v1/chat/completions"
     system = (
         "You assign least-privilege project-scoped grants for a new project assignment. "
         "Return ONLY a compact JSON list of privilege keys from this allowed set: "
@@ -16,37 +14,28 @@ def suggest_privileges_via_llm(roles: list[str], project_code: str) -> list[str]
         "Decide the minimal privileges required for this user to start contributing."
     )
     try:
-        with httpx.Client(timeout=15.0) as client:
-            resp = client.post(
-                endpoint,
-                json={
-                    "model": os.getenv("LLM_MODEL", "local-llm"),
-                    "messages": [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    "temperature": 0.1,
-                },
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "[]")
-            # Try to parse JSON list
-            import json as _json
-            return list(_json.loads(content))
+        content = LLMGatewaySingleton.get().chat(
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            temperature=0.1,
+            priority="batch",
+            timeout=15.0,
+            name="suggest_privileges",
+        )
+        # Try to parse JSON list
+        import json as _json
+        return list(_json.loads(content))
     except Exception:
-        pass
-    # Fallback minimal set
-    return ["db_read", "repo_access"]
+        return None
 
 
-def suggest_roles_via_llm(roles: list[str], project_code: str) -> list[str]:
+def _llm_suggest_roles(roles: list[str], project_code: str) -> list[str] | None:
     """Ask llama.cpp to return project ROLE labels (not raw privileges).
     Allowed roles: ["project_viewer", "project_editor", "project_admin", "data_reader", "data_writer"].
-    Returns a JSON list of roles.
+    Returns a JSON list of roles, or None on failure.
     """
-    llm_url = os.getenv("LLM_URL", "http://127.0.0.1:8080")
-    endpoint = f"{llm_url.rstrip('/')}/v1/chat/completions"
     system = (
         "You assign least-privilege ROLE SETS for a new project assignment. "
         "Return ONLY a compact JSON list of role labels from this allowed set: "
@@ -58,27 +47,32 @@ def suggest_roles_via_llm(roles: list[str], project_code: str) -> list[str]:
         "Select the minimal roles required for this user to start contributing."
     )
     try:
-        with httpx.Client(timeout=15.0) as client:
-            resp = client.post(
-                endpoint,
-                json={
-                    "model": os.getenv("LLM_MODEL", "local-llm"),
-                    "messages": [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    "temperature": 0.1,
-                },
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "[]")
-            import json as _json
-            return list(_json.loads(content))
+        content = LLMGatewaySingleton.get().chat(
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            temperature=0.1,
+            priority="batch",
+            timeout=15.0,
+            name="suggest_roles",
+        )
+        import json as _json
+        return list(_json.loads(content))
     except Exception:
-        pass
+        return None
+
+
+def suggest_privileges_via_llm(roles: list[str], project_code: str) -> list[str]:
+    keys = _cached_decision("privileges", roles, project_code, lambda: _llm_suggest_privileges(roles, project_code))
+    # Fallback minimal set
+    return keys if keys is not None else ["db_read", "repo_access"]
+
+
+def suggest_roles_via_llm(roles: list[str], project_code: str) -> list[str]:
+    labels = _cached_decision("roles", roles, project_code, lambda: _llm_suggest_roles(roles, project_code))
     # Fallback minimal role
-    return ["project_viewer"]
+    return labels if labels is not None else ["project_viewer"]
 
 
 ROLE_TO_PRIVS = {
@@ -99,25 +93,127 @@ def map_roles_to_privileges(role_labels: list[str]) -> list[str]:
     # Global VPN is not tied to project roles; keep as separate default
     return sorted(privs)
 
+
+def _privilege_keys_for_projects(roles: list[str], project_codes: list[str]) -> dict[str, list[str]]:
+    """Privilege keys per project via the configured assignment strategy.
+    Decisions are memoized; the misses run concurrently (the LLM gateway bounds them).
+    """
+    def _keys(code: str) -> list[str]:
+        if os.getenv("USE_LLM_ROLE_ASSIGN", "true").lower() in ("1", "true", "yes"):
+            return map_roles_to_privileges(suggest_roles_via_llm(roles, code))
+        if os.getenv("USE_LLM_PRIV_ASSIGN", "true").lower() in ("1", "true", "yes"):
+            return suggest_privileges_via_llm(roles, code)
+        return ["db_read", "repo_access"]
+
+    codes = list(dict.fromkeys(project_codes))
+    if len(codes) <= 1:
+        return {c: _keys(c) for c in codes}
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(len(codes), int(os.getenv("LLM_SLOTS", "4")))) as pool:
+        return dict(zip(codes, pool.map(_keys, codes)))
+
 import os
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, Form
+from fastapi import FastAPI, UploadFile, File, BackgroundTasks, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import httpx
 import pg8000
+import time
+import threading
+import numpy as np
 
 from src.ingestion.parser import extract_text_from_file
 from src.utils.acl import infer_acl_from_text
 from src.retrieval.indexers import IndexCoordinator, DEFAULT_SPACES, qdrant_collection_for, opensearch_index_for
 from src.retrieval.retriever import HybridRetriever
+from src.utils.serialization import dumps, encoded_response
+from src.utils.http import http_client, open_clients, close_clients
+from src.utils.llm_gateway import LLMGatewaySingleton
+from src.utils.assignment import requirement_scores, solve as solve_assignment
+from src.retrieval.skill_index import SkillIndex, normalize_skill
 
 load_dotenv()
 
+LLM_DECISION_TTL_S = int(os.getenv("LLM_DECISION_TTL_S", str(7 * 24 * 3600)))
+# bump when the prompts above change so old decisions stop matching
+LLM_DECISION_PROMPT_VERSION = "1"
+
+
+def _decision_key(kind: str, roles: list[str], project_code: str) -> str:
+    import hashlib as _hashlib
+    import json as _json
+    raw = _json.dumps(
+        {
+            "kind": kind,
+            "roles": sorted(set(roles or [])),
+            "project": project_code,
+            "model": os.getenv("LLM_MODEL", "local-llm"),
+            "v": LLM_DECISION_PROMPT_VERSION,
+        },
+        sort_keys=True,
+    )
+    return _hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _cached_decision(kind: str, roles: list[str], project_code: str, compute) -> list[str] | None:
+    """Durable memo for deterministic LLM decisions (llm_decision_cache).
+    Returns the stored decision if present and unexpired; otherwise calls
+    `compute()` and stores its result unless it failed (None).
+    """
+    import json as _json
+    key = _decision_key(kind, roles, project_code)
+    try:
+        with pg_conn() as con:
+            with con.cursor() as cur:
+                cur.execute("SELECT decision_json FROM llm_decision_cache WHERE key=%s AND expires_at > NOW()", (key,))
+                row = cur.fetchone()
+        if row:
+            val = row[0]
+            return list(_json.loads(val) if isinstance(val, str) else val)
+    except Exception:
+        pass
+    decision = compute()
+    if decision is None:
+        return None
+    try:
+        with pg_conn() as con:
+            con.autocommit = True
+            with con.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO llm_decision_cache(key, kind, project_code, roles_json, model, decision_json, expires_at)
+                    VALUES (%s,%s,%s,%s,%s,%s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (key) DO UPDATE SET decision_json=EXCLUDED.decision_json, created_at=NOW(), expires_at=EXCLUDED.expires_at
+                    """,
+                    (key, kind, project_code, _json.dumps(sorted(set(roles or []))), os.getenv("LLM_MODEL", "local-llm"), _json.dumps(decision), LLM_DECISION_TTL_S),
+                )
+    except Exception as e:
+        print(f"[Decisions][WARN] could not store {kind} decision for {project_code}: {e}")
+    return decision
+
+
 app = FastAPI(title="Enterprise RAG", version="0.1.0")
 indexer = IndexCoordinator()
 retriever = HybridRetriever()
+# new skill names this close to an existing one become its alias instead
+SKILL_MERGE_THRESHOLD = float(os.getenv("SKILL_MERGE_THRESHOLD", "0.92"))
+
+
+def _load_skill_taxonomy():
+    with pg_conn() as con:
+        with con.cursor() as cur:
+            cur.execute("SELECT id, name FROM skills ORDER BY id")
+            skills = [(r[0], r[1]) for r in cur.fetchall() or []]
+            try:
+                cur.execute("SELECT alias, skill_id FROM skill_aliases")
+                aliases = [(r[0], r[1]) for r in cur.fetchall() or []]
+            except Exception:
+                aliases = []
+    return skills, aliases
+
+
+skill_index = SkillIndex(retriever.embedder, _load_skill_taxonomy)
 
 # CORS for frontend
 origins = (os.getenv("CORS_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173,http://localhost:8080,http://127.0.0.1:8080").split(","))
@@ -137,6 +233,7 @@ class UploadResponse(BaseModel):
 
 @app.on_event("startup")
 def on_startup():
+    open_clients()
     indexer.ensure_ready()
     # Ensure tables for extended features
     try:
@@ -147,10 +244,18 @@ def on_startup():
                 _ensure_team_tables(cur)
                 _ensure_memory_tables(cur)
                 _ensure_skill_overrides(cur)
+                _ensure_llm_decision_cache(cur)
+                _ensure_skill_aliases(cur)
+                _ensure_skills_recompute_tables(cur)
     except Exception:
         pass
 
 
+@app.on_event("shutdown")
+def on_shutdown():
+    close_clients()
+
+
 @app.post("/upload", response_model=UploadResponse)
 async def upload_document(
     background_tasks: BackgroundTasks,
@@ -207,49 +312,57 @@ def _get_active_projects_for_employee(cur, employee_id: int):
     return [r[0] for r in rows]
 
 
-def _collect_os_evidence_for_employee(employee_name: str, employee_email: str, project_codes: list[str], per_index_k: int = 15) -> list[dict]:
-    """Collect top-k evidence texts per project sub-index using OpenSearch BM25.
-    Search by name/email across sub-dbs: documents, main_progress, employees, key_decisions, memory.
+EVIDENCE_SUBDBS = ["documents", "main_progress", "employees", "key_decisions", "memory"]
+
+
+def _collect_os_evidence_batch(employees: list[tuple], per_index_k: int = 15) -> dict:
+    """Evidence for many employees at once: {employee_id: [evidence]}.
+    `employees` is [(id, name, email, project_codes)]. All per-(project, sub-db)
+    BM25 searches go out as one multi-search.
     """
-    subdbs = ["documents", "main_progress", "employees", "key_decisions", "memory"]
-    collected: list[dict] = []
-    for code in project_codes:
-        for sub in subdbs:
-            idx = indexer.opensearch_index_for_project(code, sub)
-            try:
-                q = {
+    requests, owners = [], []
+    for eid, name, email, codes in employees:
+        for code in codes:
+            for sub in EVIDENCE_SUBDBS:
+                requests.append({
+                    "index": indexer.opensearch_index_for_project(code, sub),
+                    # one OR-match over name and email terms
+                    "text": f"{email} {name}",
+                    "filters": None,
                     "size": per_index_k,
-                    "query": {
-                        "bool": {
-                            "should": [
-                                {"match": {"text": employee_email}},
-                                {"match": {"text": employee_name}},
-                            ],
-                            "minimum_should_match": 1
-                        }
-                    },
-                    "_source": ["text", "filename", "document_id", "chunk_id", "chunk_index"],
-                }
-                res = indexer.os.search(index=idx, body=q)
-                for hit in res.get("hits", {}).get("hits", []):
-                    src = hit.get("_source", {})
-                    collected.append({
-                        "project_code": code,
-                        "subdb": sub,
-                        "text": src.get("text", "")[:2000],
-                        "doc": src,
-                    })
-            except Exception:
-                continue
+                    "fields": ["text", "filename", "document_id", "chunk_id", "chunk_index"],
+                })
+                owners.append((eid, code, sub))
+    collected: dict = {e[0]: [] for e in employees}
+    try:
+        results = indexer.lexical.msearch(requests)
+    except Exception as e:
+        print(f"[Skills][WARN] evidence search failed: {e}")
+        results = [[] for _ in requests]
+    for (eid, code, sub), hits in zip(owners, results):
+        for hit in hits:
+            src = hit.get("_source", {})
+            collected[eid].append({
+                "project_code": code,
+                "subdb": sub,
+                "text": src.get("text", "")[:2000],
+                "doc": src,
+            })
     return collected
 
 
-def _score_employee_via_llm(employee_name: str, employee_email: str, roles_hint: list[str], evidence: list[dict]) -> dict:
+def _collect_os_evidence_for_employee(employee_name: str, employee_email: str, project_codes: list[str], per_index_k: int = 15) -> list[dict]:
+    """Collect top-k evidence texts per project sub-index using BM25.
+    Search by name/email across sub-dbs: documents, main_progress, employees, key_decisions, memory.
+    """
+    return _collect_os_evidence_batch([(0, employee_name, employee_email, project_codes)], per_index_k)[0]
+
+
+def _score_employee_via_llm(employee_name: str, employee_email: str, roles_hint: list[str], evidence: list[dict], fallback: bool = True) -> dict | None:
     """Ask local LLM to produce structured skills profile.
     Returns dict with keys: overall_score:int, roles:list[str], skills:list[{name, proficiency, confidence, evidence_refs}], notes:str
+    On failure returns a neutral fallback profile, or None when fallback=False.
     """
-    llm_url = os.getenv("LLM_URL", "http://127.0.0.1:8080")
-    endpoint = f"{llm_url.rstrip('/')}/v1/chat/completions"
     snippets = []
     for ev in evidence[: 15 * 5]:  # hard cap prompt size
         snippets.append(f"[{ev['project_code']}/{ev['subdb']}] {ev['text']}")
@@ -264,37 +377,114 @@ def _score_employee_via_llm(employee_name: str, employee_email: str, roles_hint:
         f"evidence:\n{context}"
     )
     try:
-        with httpx.Client(timeout=30.0) as client:
-            resp = client.post(
-                endpoint,
-                json={
-                    "model": os.getenv("LLM_MODEL", "local-llm"),
-                    "messages": [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    "temperature": 0.1,
-                },
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-            import json as _json
-            return dict(_json.loads(content))
+        content = LLMGatewaySingleton.get().chat(
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            temperature=0.1,
+            priority="batch",
+            timeout=30.0,
+            name="score_employee",
+        )
+        import json as _json
+        return dict(_json.loads(content))
     except Exception:
+        if not fallback:
+            return None
         return {"overall_score": 50, "roles": roles_hint or ["project_viewer"], "skills": [], "notes": "fallback"}
 
 
+def _add_skill_alias(cur, alias: str, skill_id: int) -> None:
+    cur.execute(
+        "INSERT INTO skill_aliases(alias_norm, alias, skill_id) VALUES (%s,%s,%s) ON CONFLICT (alias_norm) DO NOTHING",
+        (normalize_skill(alias), alias, skill_id),
+    )
+
+
 def _ensure_skill(cur, name: str) -> int:
-    cur.execute("SELECT id FROM skills WHERE name=%s", (name,))
-    r = cur.fetchone()
-    if r:
-        return r[0]
-    cur.execute("INSERT INTO skills(name) VALUES (%s) RETURNING id", (name,))
-    return cur.fetchone()[0]
+    ids, changed = _ensure_skills(cur, [name])
+    if changed:
+        skill_index.invalidate()
+    return ids[name]
 
 
-def _persist_skills_snapshot(cur, employee_id: int, snapshot: dict, evidence: list[dict]):
+def _ensure_skills(cur, names: list[str]) -> tuple[dict, bool]:
+    """Skill ids for many names at once: ({name: skill_id}, taxonomy_changed).
+
+    Names are matched by exact name or alias key in one query (every
+    canonical skill also has its own key in skill_aliases, so this sees
+    skills added earlier in the caller's transaction). The rest are merged
+    into near-duplicates as aliases or inserted in bulk. The caller refreshes
+    `skill_index` after committing when the taxonomy changed.
+    """
+    names = list(dict.fromkeys(n for n in names if n))
+    if not names:
+        return {}, False
+    keys = {n: normalize_skill(n) for n in names}
+    cur.execute(
+        """
+        SELECT name, NULL, id FROM skills WHERE name = ANY(%s::text[])
+        UNION ALL
+        SELECT NULL, alias_norm, skill_id FROM skill_aliases WHERE alias_norm = ANY(%s::text[])
+        """,
+        (names, list(set(keys.values()))),
+    )
+    by_name, by_key = {}, {}
+    for name, key, sid in cur.fetchall() or []:
+        if name is not None:
+            by_name[name] = sid
+        else:
+            by_key[key] = sid
+    out = {n: by_name.get(n, by_key.get(keys[n])) for n in names}
+    merged, new_names, pending = [], [], {}
+    for n in names:
+        if out[n] is not None:
+            continue
+        if keys[n] in pending:
+            # same key as a new skill earlier in this call ("Kubernetes" / "kubernetes")
+            continue
+        try:
+            match = skill_index.resolve(n, threshold=SKILL_MERGE_THRESHOLD)
+        except Exception:
+            match = []
+        if match:
+            out[n] = match[0][0]
+            merged.append(n)
+        else:
+            pending[keys[n]] = n
+            new_names.append(n)
+    if new_names:
+        cur.execute(
+            "INSERT INTO skills(name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING",
+            (new_names,),
+        )
+        # re-read so names inserted concurrently by another writer resolve too
+        cur.execute("SELECT name, id FROM skills WHERE name = ANY(%s::text[])", (new_names,))
+        for name, sid in cur.fetchall() or []:
+            out[name] = sid
+    for n in names:
+        if out[n] is None and keys[n] in pending:
+            out[n] = out.get(pending[keys[n]])
+    # alias rows: merged names plus each new canonical name under its own key
+    alias_names = [n for n in merged + new_names if out.get(n) is not None]
+    if alias_names:
+        cur.execute(
+            """
+            INSERT INTO skill_aliases(alias_norm, alias, skill_id)
+            SELECT * FROM unnest(%s::text[], %s::text[], %s::int[])
+            ON CONFLICT (alias_norm) DO NOTHING
+            """,
+            ([keys[n] for n in alias_names], alias_names, [out[n] for n in alias_names]),
+        )
+    return {n: sid for n, sid in out.items() if sid is not None}, bool(merged or new_names)
+
+
+def _persist_skills_snapshot(cur, employee_id: int, snapshot: dict, evidence: list[dict]) -> bool:
+    """Snapshot, skills and evidence in a fixed handful of statements; the
+    caller owns the transaction (commit or rollback as one unit). Returns
+    whether new skills or aliases were added, i.e. `skill_index` needs an
+    invalidate() once the transaction is committed."""
     import json as _json
     # snapshot
     cur.execute(
@@ -307,31 +497,45 @@ def _persist_skills_snapshot(cur, employee_id: int, snapshot: dict, evidence: li
             snapshot.get("notes", ""),
         ),
     )
-    # upsert skills
-    for sk in snapshot.get("skills", []):
-        name = str(sk.get("name", "")).strip()
-        if not name:
+    # upsert skills; names that resolve to the same skill keep the highest proficiency
+    skills = [(str(sk.get("name", "")).strip(), sk) for sk in snapshot.get("skills", [])]
+    ids, changed = _ensure_skills(cur, [name for name, _ in skills])
+    rows: dict = {}
+    for name, sk in skills:
+        sid = ids.get(name)
+        if sid is None:
             continue
-        prof = int(sk.get("proficiency", 0))
+        prof = min(5, max(0, int(sk.get("proficiency", 0))))
         conf = float(sk.get("confidence", 0.8))
-        sid = _ensure_skill(cur, name)
+        if sid not in rows or prof > rows[sid][0]:
+            rows[sid] = (prof, conf)
+    if rows:
         cur.execute(
-            "INSERT INTO employee_skills(employee_id, skill_id, proficiency, confidence) VALUES (%s,%s,%s,%s) "
-            "ON CONFLICT (employee_id, skill_id) DO UPDATE SET proficiency=EXCLUDED.proficiency, confidence=EXCLUDED.confidence, last_verified_at=NOW()",
-            (employee_id, sid, prof, conf),
+            """
+            INSERT INTO employee_skills(employee_id, skill_id, proficiency, confidence)
+            SELECT %s, u.skill_id, u.proficiency, u.confidence
+            FROM unnest(%s::int[], %s::int[], %s::float8[]) AS u(skill_id, proficiency, confidence)
+            ON CONFLICT (employee_id, skill_id) DO UPDATE SET proficiency=EXCLUDED.proficiency, confidence=EXCLUDED.confidence, last_verified_at=NOW()
+            """,
+            (employee_id, list(rows), [p for p, _ in rows.values()], [c for _, c in rows.values()]),
         )
     # store limited evidence
-    for ev in evidence[:100]:
+    evidence = evidence[:100]
+    if evidence:
         cur.execute(
-            "INSERT INTO employee_skill_evidence(employee_id, project_code, source_type, source_ref, snippet) VALUES (%s,%s,%s,%s,%s)",
+            """
+            INSERT INTO employee_skill_evidence(employee_id, project_code, source_type, source_ref, snippet)
+            SELECT %s, u.project_code, 'rag_os', u.source_ref, u.snippet
+            FROM unnest(%s::text[], %s::text[], %s::text[]) AS u(project_code, source_ref, snippet)
+            """,
             (
                 employee_id,
-                ev.get("project_code"),
-                "rag_os",
-                ev.get("doc", {}).get("document_id") or ev.get("doc", {}).get("chunk_id") or "",
-                ev.get("text", "")[:1000],
+                [ev.get("project_code") for ev in evidence],
+                [ev.get("doc", {}).get("document_id") or ev.get("doc", {}).get("chunk_id") or "" for ev in evidence],
+                [ev.get("text", "")[:1000] for ev in evidence],
             ),
         )
+    return changed
 
 
 class SkillsRecomputeRequest(BaseModel):
@@ -364,13 +568,18 @@ def skills_recompute(payload: SkillsRecomputeRequest):
     snapshot = _score_employee_via_llm(emp_name, emp_email, roles_hint, evidence)
 
     with pg_conn() as con:
-        con.autocommit = True
         with con.cursor() as cur:
-            emp = _get_employee_by_email(cur, payload.employee_email)
-            emp_id = emp[0]
-            _persist_skills_snapshot(cur, emp_id, snapshot, evidence)
+            taxonomy_changed = _persist_skills_snapshot(cur, emp_id, snapshot, evidence)
+        con.commit()
+    if taxonomy_changed:
+        skill_index.invalidate()
 
     # Mirror summary into RAG employees space
+    _mirror_skills_profile(emp_name, emp_email, snapshot)
+    return {"status": "ok", "snapshot": snapshot, "evidence_count": len(evidence)}
+
+
+def _mirror_skills_profile(emp_name: str, emp_email: str, snapshot: dict) -> None:
     summary = f"Skills profile for {emp_name} ({emp_email})\nOverall: {snapshot.get('overall_score')}\nRoles: {snapshot.get('roles')}\nTop skills: {[ (s.get('name'), s.get('proficiency')) for s in snapshot.get('skills', [])[:5] ]}"
     indexer.process_and_index(
         filename=f"skills_{emp_email}.txt",
@@ -380,7 +589,183 @@ def skills_recompute(payload: SkillsRecomputeRequest):
         space="employees",
         tags=["skills", "profile"],
     )
-    return {"status": "ok", "snapshot": snapshot, "evidence_count": len(evidence)}
+
+
+def _record_project_activity(info: dict) -> None:
+    """Ingest listener: note when a project's sub-indices last received evidence."""
+    if info.get("space") != "projects" or not info.get("project_id"):
+        return
+    with pg_conn() as con:
+        con.autocommit = True
+        with con.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO project_activity(project_code, last_indexed_at) VALUES (%s, NOW())
+                ON CONFLICT (project_code) DO UPDATE SET last_indexed_at=EXCLUDED.last_indexed_at
+                """,
+                (info["project_id"],),
+            )
+
+
+indexer.add_listener(_record_project_activity)
+
+SKILLS_BATCH_SIZE = int(os.getenv("SKILLS_BATCH_SIZE", "32"))
+_skills_job_lock = threading.Lock()
+
+
+def _stale_employees(cur, after_id: int, limit: int, force: bool) -> list[tuple]:
+    """Next employees (by id) whose projects received evidence after their
+    latest snapshot, or who have none: [(id, name, email, project_codes)]."""
+    cur.execute(
+        f"""
+        SELECT e.id, e.name, e.email, array_agg(DISTINCT p.code)
+        FROM employees e
+        JOIN project_assignments pa ON pa.employee_id=e.id AND pa.revoked_at IS NULL
+        JOIN projects p ON p.id=pa.project_id
+        LEFT JOIN project_activity a ON a.project_code=p.code
+        LEFT JOIN (
+            SELECT employee_id, MAX(created_at) AS last_snapshot FROM employee_skill_snapshot GROUP BY employee_id
+        ) s ON s.employee_id=e.id
+        WHERE e.id > %s
+        GROUP BY e.id, e.name, e.email, s.last_snapshot
+        {"" if force else "HAVING s.last_snapshot IS NULL OR MAX(a.last_indexed_at) > s.last_snapshot"}
+        ORDER BY e.id
+        LIMIT %s
+        """,
+        (after_id, limit),
+    )
+    return [(r[0], r[1], r[2], list(r[3] or [])) for r in cur.fetchall() or []]
+
+
+def _run_skills_recompute(job_id: int) -> None:
+    """Batch recompute: pages of SKILLS_BATCH_SIZE stale employees; evidence
+    via one multi-search per page, LLM scoring with LLM_BATCH_SLOTS in flight,
+    then the page's snapshots and the job checkpoint in one transaction.
+    A rerun with resume continues after the last committed employee id.
+    The caller acquires `_skills_job_lock` before scheduling; it is released here.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import json as _json
+    try:
+        with pg_conn() as con:
+            with con.cursor() as cur:
+                cur.execute("SELECT params_json, last_employee_id FROM skills_recompute_jobs WHERE id=%s", (job_id,))
+                params, after_id = cur.fetchone()
+        params = params if isinstance(params, dict) else _json.loads(params or "{}")
+        per_index_k = int(params.get("per_index_k", 15))
+        force = bool(params.get("force", False))
+        mirror = bool(params.get("mirror_profiles", True))
+        workers = max(1, int(os.getenv("LLM_BATCH_SLOTS", "3")))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                with pg_conn() as con:
+                    with con.cursor() as cur:
+                        page = _stale_employees(cur, after_id, SKILLS_BATCH_SIZE, force)
+                if not page:
+                    break
+                evidence = _collect_os_evidence_batch(page, per_index_k)
+                snapshots = list(pool.map(
+                    lambda e: _score_employee_via_llm(e[1], e[2], ["employee"], evidence[e[0]], fallback=False),
+                    page,
+                ))
+                done = [(e, snap) for e, snap in zip(page, snapshots) if snap is not None]
+                after_id = page[-1][0]
+                with pg_conn() as con:
+                    with con.cursor() as cur:
+                        taxonomy_changed = False
+                        for (eid, _n, _m, _c), snap in done:
+                            taxonomy_changed |= _persist_skills_snapshot(cur, eid, snap, evidence[eid])
+                        cur.execute(
+                            """
+                            UPDATE skills_recompute_jobs SET last_employee_id=%s, done=done+%s, failed=failed+%s, updated_at=NOW()
+                            WHERE id=%s
+                            """,
+                            (after_id, len(done), len(page) - len(done), job_id),
+                        )
+                    con.commit()
+                # one taxonomy reload per page, after its new skills are visible
+                if taxonomy_changed:
+                    skill_index.invalidate()
+                if mirror:
+                    for (_eid, name, email, _c), snap in done:
+                        _mirror_skills_profile(name, email, snap)
+        status, error = "done", None
+    except Exception as e:
+        print(f"[Skills][ERROR] recompute job {job_id}: {e}")
+        status, error = "failed", str(e)
+    finally:
+        _skills_job_lock.release()
+    with pg_conn() as con:
+        con.autocommit = True
+        with con.cursor() as cur:
+            cur.execute(
+                "UPDATE skills_recompute_jobs SET status=%s, error=%s, finished_at=NOW(), updated_at=NOW() WHERE id=%s",
+                (status, error, job_id),
+            )
+
+
+class SkillsRecomputeAllRequest(BaseModel):
+    requester_roles: list[str] = ["manager"]
+    per_index_k: int = 15
+    force: bool = False  # recompute everyone assigned to a project, not only stale profiles
+    mirror_profiles: bool = True
+    resume: bool = True  # continue the latest unfinished job from its checkpoint
+
+
+@app.post("/skills/recompute_all")
+def skills_recompute_all(payload: SkillsRecomputeAllRequest, background_tasks: BackgroundTasks):
+    if not any(r in {"manager", "hr", "security"} for r in payload.requester_roles):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    # claimed here, not in the task, so two close requests can't both schedule a run
+    if not _skills_job_lock.acquire(blocking=False):
+        return JSONResponse({"error": "job_running"}, status_code=409)
+    import json as _json
+    params = {"per_index_k": payload.per_index_k, "force": payload.force, "mirror_profiles": payload.mirror_profiles}
+    try:
+        with pg_conn() as con:
+            con.autocommit = True
+            with con.cursor() as cur:
+                job_id = None
+                if payload.resume:
+                    cur.execute("SELECT id, params_json FROM skills_recompute_jobs WHERE status <> 'done' ORDER BY id DESC LIMIT 1")
+                    row = cur.fetchone()
+                    if row:
+                        stored = row[1] if isinstance(row[1], dict) else _json.loads(row[1] or "{}")
+                        if stored != params:
+                            # resuming keeps the checkpoint, which only makes sense with the same selection
+                            _skills_job_lock.release()
+                            return JSONResponse(
+                                {"error": "params_mismatch", "job_id": row[0], "params": stored, "detail": "resume with the stored params, or send resume=false to start a new job"},
+                                status_code=409,
+                            )
+                        job_id = row[0]
+                        cur.execute("UPDATE skills_recompute_jobs SET status='running', error=NULL, updated_at=NOW() WHERE id=%s", (job_id,))
+                if job_id is None:
+                    cur.execute(
+                        "INSERT INTO skills_recompute_jobs(status, params_json) VALUES ('running', %s) RETURNING id",
+                        (_json.dumps(params),),
+                    )
+                    job_id = cur.fetchone()[0]
+    except Exception:
+        _skills_job_lock.release()
+        raise
+    background_tasks.add_task(_run_skills_recompute, job_id)
+    return {"job_id": job_id, "status": "scheduled"}
+
+
+@app.get("/skills/recompute_all/{job_id}")
+def skills_recompute_all_status(job_id: int):
+    with pg_conn() as con:
+        with con.cursor() as cur:
+            cur.execute(
+                "SELECT status, done, failed, last_employee_id, error, started_at, updated_at, finished_at FROM skills_recompute_jobs WHERE id=%s",
+                (job_id,),
+            )
+            row = cur.fetchone()
+    if not row:
+        return JSONResponse({"error": "job_not_found"}, status_code=404)
+    keys = ["status", "done", "failed", "last_employee_id", "error", "started_at", "updated_at", "finished_at"]
+    return {"job_id": job_id, **dict(zip(keys, row))}
 
 
 @app.get("/skills/employee")
@@ -413,29 +798,79 @@ def get_employee_skills(email: str, requester_email: str, requester_roles: str =
 
 
 @app.get("/skills/search")
-def search_by_skill(skill: str, min_level: int = 3, requester_roles: str = "manager"):
+def search_by_skill(skill: str, min_level: int = 3, requester_roles: str = "manager", expand: bool = True):
+    """Experts for a free-text skill. The text resolves to a canonical skill
+    through the taxonomy index (aliases, then nearest embedding); with expand,
+    related skills are searched too. Read-only: unknown skills are not created."""
     roles_list = [r.strip() for r in requester_roles.split(",") if r.strip()]
     elevated = any(r in {"manager", "hr", "security"} for r in roles_list)
     if not elevated:
         return JSONResponse({"error": "forbidden"}, status_code=403)
+    matches = skill_index.resolve(skill, k=1)
+    if not matches:
+        return {"results": [], "resolved": None, "expanded": []}
+    sid, sim = matches[0]
+    related = skill_index.related(sid) if expand else []
+    skill_ids = [sid] + [rid for rid, _ in related]
     with pg_conn() as con:
         with con.cursor() as cur:
-            sid = _ensure_skill(cur, skill)
+            # best matching skill row per employee; the resolved skill wins over related ones
             cur.execute(
                 """
-                SELECT e.name, e.email, es.proficiency, es.confidence
-                FROM employee_skills es
-                JOIN employees e ON e.id=es.employee_id
-                WHERE es.skill_id=%s AND es.proficiency >= %s
-                ORDER BY es.proficiency DESC, es.confidence DESC
+                SELECT * FROM (
+                    SELECT DISTINCT ON (e.id) e.name, e.email, es.proficiency, es.confidence, s.name, es.skill_id=%s AS exact
+                    FROM employee_skills es
+                    JOIN employees e ON e.id=es.employee_id
+                    JOIN skills s ON s.id=es.skill_id
+                    WHERE es.skill_id = ANY(%s) AND es.proficiency >= %s
+                    ORDER BY e.id, (es.skill_id=%s) DESC, es.proficiency DESC, es.confidence DESC
+                ) best
+                ORDER BY exact DESC, proficiency DESC, confidence DESC
                 LIMIT 50
                 """,
-                (sid, min_level),
+                (sid, skill_ids, min_level, sid),
             )
             out = []
             for r in cur.fetchall() or []:
-                out.append({"name": r[0], "email": r[1], "proficiency": r[2], "confidence": float(r[3])})
-            return {"results": out}
+                out.append({"name": r[0], "email": r[1], "proficiency": r[2], "confidence": float(r[3]), "skill": r[4]})
+    return {
+        "results": out,
+        "resolved": {"id": sid, "name": skill_index.names.get(sid), "similarity": round(sim, 4)},
+        "expanded": [{"id": rid, "name": skill_index.names.get(rid), "similarity": round(rs, 4)} for rid, rs in related],
+    }
+
+
+class SkillAliasRequest(BaseModel):
+    skill: str  # canonical skill name
+    aliases: list[str]
+    requester_email: str
+    requester_roles: list[str]  # no default: the taxonomy is shared by everyone
+
+
+@app.post("/skills/aliases")
+def skills_add_aliases(payload: SkillAliasRequest):
+    # Aliases change skill resolution for every user: elevated roles only
+    if not any(r in {"manager", "hr", "security"} for r in payload.requester_roles):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    with pg_conn() as con:
+        con.autocommit = True
+        with con.cursor() as cur:
+            cur.execute("SELECT id FROM skills WHERE name=%s", (payload.skill,))
+            row = cur.fetchone()
+            if not row:
+                return JSONResponse({"error": "skill_not_found"}, status_code=404)
+            for alias in payload.aliases:
+                _add_skill_alias(cur, alias, row[0])
+    skill_index.invalidate()
+    return {"ok": True, "skill_id": row[0]}
+
+
+@app.get("/skills/resolve")
+def skills_resolve(text: str, k: int = 5):
+    return {
+        "matches": [{"id": sid, "name": skill_index.names.get(sid), "similarity": round(sim, 4)} for sid, sim in skill_index.resolve(text, k=k)],
+        "index": skill_index.info(),
+    }
 
 
 class QueryRequest(BaseModel):
@@ -444,6 +879,15 @@ class QueryRequest(BaseModel):
     user_roles: list[str] = ["employee"]
     spaces: list[str] | None = None
     tags: list[str] | None = None
+    use_cache: bool = True
+    top_k: int = 20
+    latency_budget_ms: float | None = None
+    quality: str | None = None  # fast | balanced | best
+    snippets: bool = False  # add query-focused `snippet` per result
+    snippet_chars: int | None = None
+    fields: str = "full"  # ids | snippets | full
+    max_chars: int | None = None  # cap on text/snippet length per result
+    query_vector: list[float] | None = None  # normalized embedding of `query` from /embed, skips re-embedding
 
 
 class QueryItem(BaseModel):
@@ -452,42 +896,201 @@ class QueryItem(BaseModel):
     score: float | None = None
     rerank_score: float | None = None
     rrf_score: float | None = None
-    text: str
-    source: dict
+    text: str | None = None
+    snippet: str | None = None
+    source: dict | None = None
     origin: str
 
 
 class QueryResponse(BaseModel):
     results: list[QueryItem]
+    meta: dict | None = None
+
+
+def _query_items(items: list[dict], fields: str = "full", max_chars: int | None = None) -> list[dict]:
+    """Plain dicts shaped like QueryItem, projected to `fields`:
+    ids -> ids, scores and origin; snippets -> plus source and snippet;
+    full -> plus text (and snippet when computed). Text is cut to max_chars.
+    """
+    fields = fields if fields in ("ids", "snippets", "full") else "full"
+    normalized = []
+    for it in items:
+        out = {
+            "id": str(it.get("id")),
+            "document_id": it.get("document_id"),
+            "score": it.get("score"),
+            "rerank_score": it.get("rerank_score"),
+            "rrf_score": it.get("rrf_score"),
+            "origin": it.get("origin", "unknown"),
+        }
+        if fields != "ids":
+            out["source"] = it.get("source", {})
+            if it.get("snippet") is not None:
+                out["snippet"] = it["snippet"][:max_chars] if max_chars else it["snippet"]
+        if fields == "full":
+            text = it.get("text", "")
+            out["text"] = text[:max_chars] if max_chars else text
+        normalized.append(out)
+    return normalized
+
+
+def _with_snippets(payload: QueryRequest, items: list[dict], trace: dict | None = None) -> list[dict]:
+    if not (payload.snippets or payload.fields == "snippets") or not items:
+        return items
+    t0 = time.perf_counter()
+    try:
+        items = retriever.snippets(payload.query, items, max_chars=payload.snippet_chars or payload.max_chars, qvec=payload.query_vector)
+    except Exception as e:
+        print(f"[Query][WARN] snippet extraction failed: {e}")
+    if trace is not None:
+        trace["snippet_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+    return items
+
+
+def _plan_query(payload: QueryRequest):
+    top_k = max(1, min(payload.top_k, 100))
+    spaces = [s.lower() for s in (payload.spaces or ["documents"])]
+    return retriever.planner.plan(top_k, spaces, latency_budget_ms=payload.latency_budget_ms, quality=payload.quality)
+
+
+def _query_vector_error(vec: list[float] | None) -> str | None:
+    """Why a caller-supplied query_vector can't be used (None when it can)."""
+    if vec is None:
+        return None
+    dim = retriever.embedder.get_sentence_embedding_dimension()
+    if len(vec) != dim:
+        return f"query_vector must have {dim} dimensions, got {len(vec)}"
+    norm = float(np.linalg.norm(np.asarray(vec, dtype=np.float32)))
+    if not np.isfinite(norm) or abs(norm - 1.0) > 1e-3:
+        return "query_vector must be L2-normalized (as returned by /embed)"
+    return None
 
 
 @app.post("/query", response_model=QueryResponse)
-def query_rag(payload: QueryRequest):
+def query_rag(payload: QueryRequest, request: Request):
+    err = _query_vector_error(payload.query_vector)
+    if err:
+        return JSONResponse({"error": err}, status_code=422)
+    plan = _plan_query(payload)
+    trace: dict = {}
     items = retriever.retrieve(
         query=payload.query,
         tenant_id=payload.tenant_id,
         user_roles=payload.user_roles,
-        spaces=payload.spaces,
+        spaces=plan.spaces,
         tags=payload.tags,
-        top_k=20,
-        per_source_k=50,
+        top_k=plan.top_k,
+        per_source_k=plan.per_source_k,
+        use_cache=payload.use_cache,
+        rerank_depth=plan.rerank_depth,
+        trace=trace,
+        qvec=payload.query_vector,
     )
-    # Ensure all required fields are present
-    normalized = []
-    for it in items:
-        normalized.append(
-            QueryItem(
-                id=str(it.get("id")),
-                document_id=it.get("document_id"),
-                score=it.get("score"),
-                rerank_score=it.get("rerank_score"),
-                rrf_score=it.get("rrf_score"),
-                text=it.get("text", ""),
-                source=it.get("source", {}),
-                origin=it.get("origin", "unknown"),
-            )
-        )
-    return QueryResponse(results=normalized)
+    items = _with_snippets(payload, items, trace)
+    # serialized directly (no response-model pass), compressed if the client accepts it
+    results = _query_items(items, payload.fields, payload.max_chars)
+    return encoded_response(request, {"results": results, "meta": {"plan": plan.as_dict(), "trace": trace}})
+
+
+@app.post("/query/stream")
+def query_rag_stream(payload: QueryRequest):
+    """NDJSON variant of /query: one line with the provisional fused ranking as soon
+    as vector and BM25 results are in, then one line with the final reranked ranking.
+    """
+    err = _query_vector_error(payload.query_vector)
+    if err:
+        return JSONResponse({"error": err}, status_code=422)
+    plan = _plan_query(payload)
+
+    def _events():
+        t0 = time.perf_counter()
+        trace: dict = {}
+        try:
+            for stage, items in retriever.retrieve_stream(
+                query=payload.query,
+                tenant_id=payload.tenant_id,
+                user_roles=payload.user_roles,
+                spaces=plan.spaces,
+                tags=payload.tags,
+                top_k=plan.top_k,
+                per_source_k=plan.per_source_k,
+                use_cache=payload.use_cache,
+                rerank_depth=plan.rerank_depth,
+                trace=trace,
+                qvec=payload.query_vector,
+            ):
+                if stage == "final":
+                    items = _with_snippets(payload, items, trace)
+                event = {
+                    "event": stage,
+                    "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+                    "results": _query_items(items, payload.fields, payload.max_chars),
+                }
+                if stage == "final":
+                    event["meta"] = {"plan": plan.as_dict(), "trace": trace}
+                yield dumps(event) + b"\n"
+        except Exception as e:
+            yield dumps({"event": "error", "error": str(e)}) + b"\n"
+
+    return StreamingResponse(_events(), media_type="application/x-ndjson")
+
+
+class QueryBatchRequest(BaseModel):
+    queries: list[QueryRequest]
+
+
+class QueryBatchResponse(BaseModel):
+    results: list[QueryResponse]
+
+
+@app.post("/query_batch", response_model=QueryBatchResponse)
+def query_rag_batch(payload: QueryBatchRequest, request: Request):
+    if any(q.query_vector is not None for q in payload.queries):
+        # batch misses are embedded together in one encode; there is nothing to skip
+        return JSONResponse({"error": "query_vector is not supported by /query_batch"}, status_code=422)
+    plans = [_plan_query(q) for q in payload.queries]
+    batch = retriever.retrieve_batch([
+        {
+            "query": q.query,
+            "tenant_id": q.tenant_id,
+            "user_roles": q.user_roles,
+            "spaces": plan.spaces,
+            "tags": q.tags,
+            "top_k": plan.top_k,
+            "per_source_k": plan.per_source_k,
+            "rerank_depth": plan.rerank_depth,
+            "use_cache": q.use_cache,
+        }
+        for q, plan in zip(payload.queries, plans)
+    ])
+    return encoded_response(request, {"results": [
+        {"results": _query_items(_with_snippets(q, items), q.fields, q.max_chars), "meta": {"plan": plan.as_dict()}}
+        for q, items, plan in zip(payload.queries, batch, plans)
+    ]})
+
+
+class EmbedRequest(BaseModel):
+    texts: list[str]
+    spaces: list[str] | None = None
+
+
+class EmbedResponse(BaseModel):
+    vectors: list[list[float]]
+    generations: dict[str, int] = {}
+
+
+@app.post("/embed", response_model=EmbedResponse)
+def embed_texts(payload: EmbedRequest):
+    """Embed texts with the retrieval model (normalized, cosine-ready).
+    When spaces are given, also returns their current index generations so callers
+    can tell whether anything derived from those spaces is still current.
+    """
+    vectors = retriever.embedder.encode(payload.texts, normalize_embeddings=True).tolist() if payload.texts else []
+    gens = {}
+    if payload.spaces is not None:
+        spaces = [s.lower() for s in (payload.spaces or ["documents"])]
+        gens = retriever.cache.generations.snapshot(spaces)
+    return EmbedResponse(vectors=vectors, generations=gens)
 
 
 class UploadSyncResponse(BaseModel):
@@ -511,36 +1114,20 @@ async def upload_document_sync(
     tag_list = [t.strip() for t in tags.split(",") if t.strip()] if tags else []
     indexer.process_and_index(file.filename, content, tenant_id, uploader_id, space, tag_list, project_id, project_subdb)
 
-    # Qdrant: count points for this filename
-    from qdrant_client.http import models as qmodels
-
+    # Vector store: count points for this filename
+    # choose collection based on whether project routing is used
+    from src.retrieval.indexers import IndexCoordinator as _IC
+    use_project = (space == "projects" and project_id and project_subdb)
     try:
-        # choose collection based on whether project routing is used
-        from src.retrieval.indexers import IndexCoordinator as _IC
-        use_project = (space == "projects" and project_id and project_subdb)
         target_collection = _IC.qdrant_collection_for_project(project_id, project_subdb) if use_project else qdrant_collection_for(space)
-        count_res = indexer.qdrant.count(
-            collection_name=target_collection,
-            count_filter=qmodels.Filter(
-                must=[qmodels.FieldCondition(key="filename", match=qmodels.MatchValue(value=file.filename))]
-            ),
-            exact=True,
-        )
-        q_count = int(count_res.count) if hasattr(count_res, "count") else 0
+        q_count = indexer.vectors.count(target_collection, {"filename": file.filename})
     except Exception:
         q_count = 0
 
-    # OpenSearch: count docs for this filename
+    # BM25 store: count docs for this filename
     try:
         target_index = _IC.opensearch_index_for_project(project_id, project_subdb) if use_project else opensearch_index_for(space)
-        os_res = indexer.os.search(
-            index=target_index,
-            body={
-                "query": {"term": {"filename": file.filename}},
-                "size": 0
-            },
-        )
-        os_count = int(os_res.get("hits", {}).get("total", {}).get("value", 0))
+        os_count = indexer.lexical.count(target_index, {"filename": file.filename})
     except Exception:
         os_count = 0
 
@@ -593,56 +1180,68 @@ def projects_create(payload: ProjectCreateRequest):
     return {"ok": True}
 
 
-def _active_projects_for(cur, employee_id: int) -> list[int]:
+def _candidate_pool(cur, available_only: bool) -> list[tuple]:
+    """[(id, name, email, [active project ids], allocated percent)] for every
+    employee in one query; with available_only, only employees without an
+    active assignment."""
     cur.execute(
-        "SELECT project_id FROM project_assignments WHERE employee_id=%s AND revoked_at IS NULL",
-        (employee_id,),
+        f"""
+        SELECT e.id, e.name, e.email,
+               COALESCE(array_agg(pa.project_id) FILTER (WHERE pa.project_id IS NOT NULL), '{{}}'),
+               COALESCE(SUM(pa.allocation_percent), 0)
+        FROM employees e
+        LEFT JOIN project_assignments pa ON pa.employee_id=e.id AND pa.revoked_at IS NULL
+        GROUP BY e.id, e.name, e.email
+        {"HAVING COUNT(pa.project_id)=0" if available_only else ""}
+        ORDER BY e.id
+        """
     )
-    return [r[0] for r in (cur.fetchall() or [])]
+    return [(r[0], r[1], r[2], list(r[3] or []), int(r[4] or 0)) for r in (cur.fetchall() or [])]
 
 
-def _skills_for_employee(cur, employee_id: int) -> dict:
+def _proficiency_matrix(cur, employee_ids: list[int], skill_names: list[str]):
+    """Dense employees x skills proficiency matrix (0 where absent), from one
+    query restricted to the requested skills."""
+    mat = np.zeros((len(employee_ids), len(skill_names)), dtype=np.int16)
+    if not employee_ids or not skill_names:
+        return mat
+    row_of = {eid: i for i, eid in enumerate(employee_ids)}
+    col_of = {name: j for j, name in enumerate(skill_names)}
     cur.execute(
         """
-        SELECT s.name, es.proficiency
+        SELECT es.employee_id, s.name, es.proficiency
         FROM employee_skills es
         JOIN skills s ON s.id=es.skill_id
-        WHERE es.employee_id=%s
+        WHERE s.name = ANY(%s)
         """,
-        (employee_id,),
+        (skill_names,),
     )
-    out = {}
-    for r in cur.fetchall() or []:
-        out[str(r[0])] = int(r[1] or 0)
-    return out
+    for eid, name, prof in cur.fetchall() or []:
+        i = row_of.get(eid)
+        if i is not None:
+            mat[i, col_of[str(name)]] = int(prof or 0)
+    return mat
 
 
 def _llm_rank_candidates(requirements: list[dict], candidates: list[dict]) -> list[dict]:
-    llm_url = os.getenv("LLM_URL", "http://127.0.0.1:8080").rstrip("/")
-    endpoint = f"{llm_url}/v1/chat/completions"
     system = (
         "You are a staffing assistant. Rank candidates per role with brief JSON explanations. "
         "Return ONLY JSON: [{employee_email, role_label, score, explanation}]."
     )
+    import json as _json
     user = {"requirements": requirements, "candidates": candidates}
     try:
-        with httpx.Client(timeout=20.0) as client:
-            resp = client.post(
-                endpoint,
-                json={
-                    "model": os.getenv("LLM_MODEL", "local-llm"),
-                    "messages": [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": str(user)},
-                    ],
-                    "temperature": 0.1,
-                },
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "[]")
-            import json as _json
-            return list(_json.loads(content))
+        content = LLMGatewaySingleton.get().chat(
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": _json.dumps(user, separators=(",", ":"), default=str)},
+            ],
+            temperature=0.1,
+            priority="interactive",
+            timeout=20.0,
+            name="rank_candidates",
+        )
+        return list(_json.loads(content))
     except Exception:
         return []
 
@@ -650,9 +1249,10 @@ def _llm_rank_candidates(requirements: list[dict], candidates: list[dict]) -> li
 class TeamAssembleRequest(BaseModel):
     project_code: str
     title: str = "Team Plan"
-    requirements: list[dict]  # e.g., [{role_label:"FE", count:2, skills:[{name, min_level}]}]
+    requirements: list[dict]  # e.g., [{role_label:"FE", count:2, allocation_percent:50, skills:[{name, min_level}]}]
     available_only: bool = True
-    constraints: dict | None = None
+    constraints: dict | None = None  # max_allocation_percent caps current + new allocation
+    alternatives: int = 3  # ranked runners-up kept per role
 
 
 @app.post("/team/assemble")
@@ -668,60 +1268,92 @@ def team_assemble(payload: TeamAssembleRequest):
                 (pid, payload.title, payload.requirements, payload.constraints),
             )
             team_id = cur.fetchone()[0]
-            # Gather candidates
-            cur.execute("SELECT id, name, email FROM employees")
-            emps = cur.fetchall() or []
-            cand_list = []
-            for (eid, ename, eemail) in emps:
-                skills = _skills_for_employee(cur, eid)
-                active_projs = _active_projects_for(cur, eid)
-                if payload.available_only and active_projs:
-                    continue
-                # quick heuristic score: count how many required skills are met at min_level
-                base_score = 0
-                role_label = None
-                for req in payload.requirements:
-                    needed = 0
-                    have = 0
-                    for s in (req.get("skills") or []):
-                        needed += 1
-                        if skills.get(str(s.get("name")), 0) >= int(s.get("min_level", 0)):
-                            have += 1
-                    score = (have / max(1, needed)) * 100.0
-                    if score > base_score:
-                        base_score = score
-                        role_label = req.get("role_label")
-                cand_list.append({
+            # Gather candidates: two bulk queries, then vectorized requirement matching
+            pool = _candidate_pool(cur, payload.available_only)
+            skill_names = list(dict.fromkeys(str(s.get("name")) for req in payload.requirements for s in (req.get("skills") or [])))
+            prof = _proficiency_matrix(cur, [p[0] for p in pool], skill_names)
+            scores = requirement_scores(prof, skill_names, payload.requirements)
+            # Fill role slots (count, allocation) as a max-weight matching
+            plan = solve_assignment(
+                scores,
+                payload.requirements,
+                np.array([p[4] for p in pool], dtype=np.int64),
+                alternatives=max(0, payload.alternatives),
+                max_allocation=(payload.constraints or {}).get("max_allocation_percent"),
+            )
+
+            def _cand(i: int, r: int, score: float, selected: bool, rank: int) -> dict:
+                eid, ename, eemail, active_projs, allocated = pool[i]
+                return {
                     "employee_id": eid,
                     "name": ename,
                     "email": eemail,
-                    "role_label": role_label or "member",
-                    "score": round(base_score, 2),
+                    "role_label": payload.requirements[r].get("role_label") or "member",
+                    "score": round(score, 2),
                     "active_projects": active_projs,
-                })
-            # Optional LLM ranking overlay
-            llm_rank = _llm_rank_candidates(payload.requirements, cand_list)
+                    "allocated_percent": allocated,
+                    "selected": selected,
+                    "rank": rank,
+                }
+
+            # Shortlist: the assignment plus ranked alternatives per role
+            cand_list = [_cand(a["candidate"], a["requirement"], a["score"], True, a["slot"]) for a in plan["assignments"]]
+            seen = {c["employee_id"] for c in cand_list}
+            for r, alts in plan["alternatives"].items():
+                for rank, alt in enumerate(alts, start=1):
+                    c = _cand(alt["candidate"], r, alt["score"], False, rank)
+                    if c["employee_id"] not in seen:
+                        seen.add(c["employee_id"])
+                        cand_list.append(c)
+            # Optional LLM ranking overlay (explanations) for the shortlist only
+            llm_rank = _llm_rank_candidates(payload.requirements, [
+                {k: c[k] for k in ("email", "name", "role_label", "score", "selected")} for c in cand_list
+            ]) if cand_list else []
             llm_map = {str(it.get("employee_email")).lower(): it for it in llm_rank}
-            # persist candidates
-            out = []
+            # persist candidates in one multi-row insert
+            import json as _json
+            rows = []
             for c in cand_list:
                 conflicts = {}
                 if c["active_projects"]:
                     conflicts["over_allocated"] = True
+                    conflicts["allocated_percent"] = c["allocated_percent"]
                 explanation = llm_map.get(str(c["email"]).lower(), {}).get("explanation")
                 score = c["score"]
                 if str(c["email"]).lower() in llm_map and isinstance(llm_map[str(c["email"]).lower()].get("score"), (int, float)):
                     score = float(llm_map[str(c["email"]).lower()]["score"])  # use llm score if provided
+                rows.append((c, score, conflicts, {"explanation": explanation} if explanation else None))
+            ids = {}
+            if rows:
                 cur.execute(
                     """
                     INSERT INTO team_candidates(team_id, employee_id, role_label, skill_match, score, conflicts_json, selected, explanation_json)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id
+                    SELECT %s, u.employee_id, u.role_label, u.skill_match, u.score, u.conflicts::jsonb, u.selected, u.explanation::jsonb
+                    FROM unnest(%s::int[], %s::text[], %s::float8[], %s::float8[], %s::text[], %s::bool[], %s::text[])
+                        AS u(employee_id, role_label, skill_match, score, conflicts, selected, explanation)
+                    RETURNING id, employee_id
                     """,
-                    (team_id, c["employee_id"], c["role_label"], c["score"], score, conflicts, False, {"explanation": explanation} if explanation else None),
+                    (
+                        team_id,
+                        [c["employee_id"] for c, _, _, _ in rows],
+                        [c["role_label"] for c, _, _, _ in rows],
+                        [c["score"] for c, _, _, _ in rows],
+                        [score for _, score, _, _ in rows],
+                        [_json.dumps(conflicts) for _, _, conflicts, _ in rows],
+                        [c["selected"] for c, _, _, _ in rows],
+                        [_json.dumps(expl) if expl else None for _, _, _, expl in rows],
+                    ),
                 )
-                cid = cur.fetchone()[0]
-                out.append({"id": cid, **c, "score": score, "conflicts": conflicts, "selected": False})
-    return {"team_id": team_id, "candidates": out}
+                ids = {eid: cid for cid, eid in cur.fetchall() or []}
+            out = [
+                {"id": ids.get(c["employee_id"]), **c, "score": score, "conflicts": conflicts}
+                for c, score, conflicts, _ in rows
+            ]
+    unfilled = [
+        {"role_label": payload.requirements[u["requirement"]].get("role_label") or "member", "missing": u["missing"]}
+        for u in plan["unfilled"]
+    ]
+    return {"team_id": team_id, "candidates": out, "unfilled": unfilled, "pool_size": len(pool), "solve_ms": plan["solve_ms"]}
 
 
 class ApproveMember(BaseModel):
@@ -765,11 +1397,11 @@ def team_approve(team_id: int, payload: ApproveTeamRequest):
     # Bridge to Smart Access: update employee project and ensure default grants/groups
     try:
         chat_api = os.getenv("CHAT_API_BASE", "http://127.0.0.1:8002").rstrip("/")
-        with httpx.Client(timeout=10.0) as client:
-            for m in payload.members:
-                # Set project label and keep status active
-                client.patch(f"{chat_api}/smart/employees/by_email", json={"email": m.employee_email, "project": payload.project_code, "status": "active"})
-                client.post(f"{chat_api}/smart/employees/by_email/ensure_defaults", params={"email": m.employee_email})
+        client = http_client("chat")
+        for m in payload.members:
+            # Set project label and keep status active
+            client.patch(f"{chat_api}/smart/employees/by_email", json={"email": m.employee_email, "project": payload.project_code, "status": "active"})
+            client.post(f"{chat_api}/smart/employees/by_email/ensure_defaults", params={"email": m.employee_email})
     except Exception:
         pass
     return {"ok": True}
@@ -787,6 +1419,8 @@ class SkillOverrideRequest(BaseModel):
 
 @app.post("/skills/override")
 def skills_override(payload: SkillOverrideRequest):
+    if not payload.skill_name.strip():
+        return JSONResponse({"error": "skill_name_required"}, status_code=400)
     with pg_conn() as con:
         con.autocommit = True
         with con.cursor() as cur:
@@ -794,7 +1428,7 @@ def skills_override(payload: SkillOverrideRequest):
             if not emp:
                 return JSONResponse({"error": "employee_not_found"}, status_code=404)
             emp_id = emp[0]
-            sid = _ensure_skill(cur, payload.skill_name)
+            sid = _ensure_skill(cur, payload.skill_name.strip())
             cur.execute(
                 """
                 INSERT INTO employee_skill_overrides(employee_id, skill_id, proficiency, confidence, note)
@@ -884,8 +1518,7 @@ def memory_create(payload: MemoryCreateRequest):
 def memory_search(project_code: str, query: str):
     try:
         idx = indexer.opensearch_index_for_project(project_code, "memory")
-        res = indexer.os.search(index=idx, body={"query": {"match": {"text": query}}, "size": 25})
-        hits = res.get("hits", {}).get("hits", [])
+        hits = indexer.lexical.search(idx, query, None, 25)
         out = [{"text": h.get("_source", {}).get("text", ""), "_id": h.get("_id") } for h in hits]
         return {"results": out}
     except Exception:
@@ -1021,6 +1654,73 @@ def _ensure_memory_tables(cur):
     )
 
 
+def _ensure_llm_decision_cache(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS llm_decision_cache (
+            key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            project_code TEXT NULL,
+            roles_json JSONB NOT NULL,
+            model TEXT NOT NULL,
+            decision_json JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            expires_at TIMESTAMPTZ NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_decision_cache_project ON llm_decision_cache(project_code)")
+
+
+def _ensure_skill_aliases(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS skill_aliases (
+            alias_norm TEXT PRIMARY KEY,
+            alias TEXT NOT NULL,
+            skill_id INTEGER NOT NULL REFERENCES skills(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_skill_aliases_skill ON skill_aliases(skill_id)")
+    # every canonical skill is also reachable under its own key (same rule as normalize_skill)
+    cur.execute(
+        """
+        INSERT INTO skill_aliases(alias_norm, alias, skill_id)
+        SELECT regexp_replace(lower(name), '[^0-9a-z+#]+', '', 'g'), name, id FROM skills
+        WHERE regexp_replace(lower(name), '[^0-9a-z+#]+', '', 'g') <> ''
+        ON CONFLICT (alias_norm) DO NOTHING
+        """
+    )
+
+
+def _ensure_skills_recompute_tables(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS project_activity (
+            project_code TEXT PRIMARY KEY,
+            last_indexed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS skills_recompute_jobs (
+            id SERIAL PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'running',
+            params_json JSONB NOT NULL DEFAULT '{}'::jsonb,
+            last_employee_id INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT NULL,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMPTZ NULL
+        )
+        """
+    )
+
+
 def _ensure_skill_overrides(cur):
     cur.execute(
         """
@@ -1132,17 +1832,12 @@ def smart_onboard(payload: OnboardRequest):
             vpn_id = _ensure_privilege(cur, "vpn_access", "global", "Company VPN access")
             _grant_privilege(cur, emp_id, vpn_id, None)
             project_infos = []
+            # Determine privileges via roles->privileges or direct privileges
+            keys_by_project = _privilege_keys_for_projects(payload.roles, payload.projects)
             for code in payload.projects:
                 pid = _ensure_project(cur, code, code)
                 _assign_project(cur, emp_id, pid, allocation=100)
-                # Determine privileges via roles->privileges or direct privileges
-                if os.getenv("USE_LLM_ROLE_ASSIGN", "true").lower() in ("1", "true", "yes"):
-                    role_labels = suggest_roles_via_llm(payload.roles, code)
-                    keys = map_roles_to_privileges(role_labels)
-                elif os.getenv("USE_LLM_PRIV_ASSIGN", "true").lower() in ("1", "true", "yes"):
-                    keys = suggest_privileges_via_llm(payload.roles, code)
-                else:
-                    keys = ["db_read", "repo_access"]
+                keys = keys_by_project[code]
                 for key in keys:
                     scope = "project" if key != "vpn_access" else "global"
                     pvid = _ensure_privilege(cur, key, scope, f"{key} for project")
@@ -1185,13 +1880,7 @@ def smart_assign_project(payload: AssignProjectRequest):
             emp_name = row[1]
             pid = _ensure_project(cur, payload.project_code, payload.project_code)
             _assign_project(cur, emp_id, pid, payload.allocation_percent)
-            if os.getenv("USE_LLM_ROLE_ASSIGN", "true").lower() in ("1", "true", "yes"):
-                role_labels = suggest_roles_via_llm(["employee"], payload.project_code)
-                keys = map_roles_to_privileges(role_labels)
-            elif os.getenv("USE_LLM_PRIV_ASSIGN", "true").lower() in ("1", "true", "yes"):
-                keys = suggest_privileges_via_llm(["employee"], payload.project_code)
-            else:
-                keys = ["db_read", "repo_access"]
+            keys = _privilege_keys_for_projects(["employee"], [payload.project_code])[payload.project_code]
             for key in keys:
                 scope = "project" if key != "vpn_access" else "global"
                 pvid = _ensure_privilege(cur, key, scope, f"{key} for project")
@@ -1247,6 +1936,74 @@ def smart_revoke_project(payload: RevokeProjectRequest):
     return {"status": "ok"}
 
 
+class DecisionInvalidateRequest(BaseModel):
+    project_code: str | None = None
+    kind: str | None = None  # roles | privileges; None = both
+
+
+@app.post("/smart/decisions/invalidate")
+def smart_decisions_invalidate(payload: DecisionInvalidateRequest):
+    """Drop memoized LLM role/privilege decisions (for one project, or all)."""
+    where, params = [], []
+    if payload.project_code:
+        where.append("project_code=%s")
+        params.append(payload.project_code)
+    if payload.kind:
+        where.append("kind=%s")
+        params.append(payload.kind)
+    sql = "DELETE FROM llm_decision_cache" + (" WHERE " + " AND ".join(where) if where else "")
+    with pg_conn() as con:
+        con.autocommit = True
+        with con.cursor() as cur:
+            cur.execute(sql, tuple(params))
+            deleted = cur.rowcount
+    return {"deleted": deleted}
+
+
+class DecisionPrewarmRequest(BaseModel):
+    project_codes: list[str] | None = None  # default: all projects
+    role_sets: list[list[str]] | None = None  # default: role sets held by employees + ["employee"]
+
+
+def _prewarm_decisions(project_codes: list[str] | None, role_sets: list[list[str]] | None) -> None:
+    try:
+        with pg_conn() as con:
+            with con.cursor() as cur:
+                if project_codes is None:
+                    cur.execute("SELECT code FROM projects ORDER BY code")
+                    project_codes = [r[0] for r in cur.fetchall()]
+                if role_sets is None:
+                    cur.execute(
+                        """
+                        SELECT DISTINCT array_agg(r.name ORDER BY r.name)
+                        FROM employee_roles er JOIN roles r ON r.id = er.role_id
+                        GROUP BY er.employee_id
+                        """
+                    )
+                    role_sets = [list(r[0]) for r in cur.fetchall() if r[0]] + [["employee"]]
+    except Exception as e:
+        print(f"[Decisions][WARN] prewarm lookup failed: {e}")
+        return
+    seen, combos = set(), []
+    for roles in role_sets:
+        key = tuple(sorted(set(roles)))
+        if key not in seen:
+            seen.add(key)
+            combos.extend((list(key), code) for code in project_codes)
+    from concurrent.futures import ThreadPoolExecutor
+    t0 = time.time()
+    # batch-priority calls; the gateway keeps slots free for interactive traffic
+    with ThreadPoolExecutor(max_workers=max(1, int(os.getenv("LLM_BATCH_SLOTS", "3")))) as pool:
+        list(pool.map(lambda c: _privilege_keys_for_projects(c[0], [c[1]]), combos))
+    print(f"[Decisions] prewarmed {len(combos)} (roles, project) decisions in {time.time() - t0:.1f}s")
+
+
+@app.post("/smart/decisions/prewarm")
+def smart_decisions_prewarm(payload: DecisionPrewarmRequest, background_tasks: BackgroundTasks):
+    background_tasks.add_task(_prewarm_decisions, payload.project_codes, payload.role_sets)
+    return {"status": "scheduled"}
+
+
 @app.get("/", response_class=RedirectResponse)
 def root_redirect():
     return RedirectResponse(url="/ui")
@@ -1333,7 +2090,7 @@ def simple_ui():
       </div>
 
       <div class='card'>
-        <h3>Inspect OpenSearch Docs (rag_docs)</h3>
+        <h3>Inspect BM25 Docs (rag_docs)</h3>
         <button id='listDocs'>List 10 docs</button>
         <pre id='docsResult'></pre>
       </div>
@@ -1385,40 +2142,41 @@ def simple_ui():
 @app.get("/debug/docs", response_class=JSONResponse)
 def debug_docs():
     try:
-        res = indexer.os.search(
-            index=indexer.os_index,
-            body={
-                "size": 10,
-                "query": {"match_all": {}},
-                "_source": [
-                    "document_id","filename","chunk_id","chunk_index","tenant_id","roles","mime","uploader_id","text"
-                ]
-            },
+        hits = indexer.lexical.search(
+            indexer.os_index,
+            None,
+            None,
+            10,
+            ["document_id","filename","chunk_id","chunk_index","tenant_id","roles","mime","uploader_id","text"],
         )
-        return JSONResponse(res)
+        return JSONResponse({"hits": {"hits": hits}})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
+@app.get("/debug/cache", response_class=JSONResponse)
+def debug_cache():
+    return JSONResponse(retriever.cache.info())
+
+
+@app.get("/debug/llm", response_class=JSONResponse)
+def debug_llm():
+    return JSONResponse(LLMGatewaySingleton.get().metrics())
+
+
+@app.get("/debug/budget", response_class=JSONResponse)
+def debug_budget():
+    return JSONResponse(retriever.budget.info())
+
+
 @app.get("/debug/chunks", response_class=JSONResponse)
 def debug_chunks(filename: str | None = None):
-    from qdrant_client.http import models as qmodels
     try:
-        flt = None
-        if filename:
-            flt = qmodels.Filter(
-                must=[qmodels.FieldCondition(key="filename", match=qmodels.MatchValue(value=filename))]
-            )
-        res = indexer.qdrant.scroll(
-            collection_name=indexer.collection,
-            scroll_filter=flt,
-            limit=10,
-            with_payload=True,
-        )
-        # res: (points, next_page_offset)
+        flt = {"filename": filename} if filename else None
+        res = indexer.vectors.scroll(indexer.collection, flt, limit=10)
         points = []
-        for p in res[0]:
-            points.append({"id": p.id, "payload": p.payload})
+        for pid, payload in res:
+            points.append({"id": pid, "payload": payload})
         return JSONResponse({"points": points})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -0,0 +1,147 @@
+import os
+import math
+import time
+import threading
+from typing import List, Dict, Tuple, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+class SpaceBudgetAllocator:
+    """Splits one candidate budget across spaces instead of pulling
+    per_source_k from every space.
+
+    Each space is weighted by an EWMA of its share of final top-k results and
+    by how many points the caller can see there (tenant + roles count, cached
+    for BUDGET_STATS_TTL_S or until the space is re-ingested). Spaces with
+    nothing visible get k=0 and are not searched. Every other space keeps a
+    floor so a space that has been quiet can still surface a hit; the
+    remainder is split by weight.
+    """
+
+    def __init__(self, count_fn: Callable[[str, Dict], int], generation_fn: Callable[[str], int] | None = None, alpha: float = 0.1) -> None:
+        # count_fn(space, filters) -> number of points visible in that space
+        self.count_fn = count_fn
+        # a changed space generation (ingestion) invalidates cached counts early
+        self.generation_fn = generation_fn
+        self.alpha = alpha
+        self.enabled = _env("BUDGET_ALLOCATION", "true").lower() in ("1", "true", "yes")
+        # 1.0 keeps the total candidate count of the unallocated path and only
+        # redistributes it; lower values trade recall for latency (measure with
+        # src.retrieval.evaluation before changing)
+        self.factor = float(_env("BUDGET_FACTOR", "1.0"))
+        self.min_k = int(_env("BUDGET_MIN_K", "5"))
+        self.prior = float(_env("BUDGET_PRIOR_HIT_RATE", "0.2"))
+        self.ttl_s = float(_env("BUDGET_STATS_TTL_S", "300"))
+        self.hit_rate: Dict[str, float] = {}
+        self._visible: Dict[Tuple[str, str, Tuple[str, ...]], Tuple[float, int, int | None]] = {}
+        self._lock = threading.Lock()
+
+    def visible(self, space: str, tenant_id: str, user_roles: List[str]) -> int | None:
+        """Points in `space` the caller may see; None when unknown (count failed)."""
+        key = (space, tenant_id, tuple(sorted(user_roles or [])))
+        now = time.time()
+        gen = 0
+        if self.generation_fn is not None:
+            try:
+                gen = int(self.generation_fn(space))
+            except Exception:
+                gen = 0
+        with self._lock:
+            hit = self._visible.get(key)
+        if hit is not None and now - hit[0] < self.ttl_s and hit[1] == gen:
+            return hit[2]
+        try:
+            n: int | None = int(self.count_fn(space, {"tenant_id": tenant_id, "roles": list(user_roles or [])}))
+        except Exception:
+            n = None
+        with self._lock:
+            self._visible[key] = (now, gen, n)
+        return n
+
+    def allocate(self, spaces: List[str], per_source_k: int, top_k: int, tenant_id: str, user_roles: List[str]) -> Dict[str, int]:
+        if not self.enabled or len(spaces) <= 1:
+            return {sp: per_source_k for sp in spaces}
+        sizes = {sp: self.visible(sp, tenant_id, user_roles) for sp in spaces}
+        live = [sp for sp in spaces if sizes[sp] != 0]
+        budgets = {sp: 0 for sp in spaces}
+        if not live:
+            return budgets
+        total = max(per_source_k, int(self.factor * per_source_k * len(live)))
+        floor = min(per_source_k, max(self.min_k, math.ceil(top_k / len(live))))
+        weights = {}
+        for sp in live:
+            size = sizes[sp]
+            # unknown size counts as a full-size space
+            cap = per_source_k if size is None else min(per_source_k, size)
+            budgets[sp] = min(floor, cap)
+            with self._lock:
+                rate = self.hit_rate.get(sp, self.prior)
+            weights[sp] = (rate + 0.01) * math.log1p(size if size is not None else per_source_k * 10)
+        spare = total - sum(budgets.values())
+        # hand out the remainder by weight; repeat so capped spaces release their share
+        while spare > 0:
+            open_ = [sp for sp in live if budgets[sp] < (per_source_k if sizes[sp] is None else min(per_source_k, sizes[sp]))]
+            if not open_:
+                break
+            wsum = sum(weights[sp] for sp in open_) or 1.0
+            given = 0
+            for sp in open_:
+                cap = per_source_k if sizes[sp] is None else min(per_source_k, sizes[sp])
+                add = min(cap - budgets[sp], max(1, int(spare * weights[sp] / wsum)))
+                add = min(add, spare - given)
+                budgets[sp] += add
+                given += add
+                if given >= spare:
+                    break
+            if given == 0:
+                break
+            spare -= given
+        return budgets
+
+    def second_round(self, budgets: Dict[str, int], returned: Dict[str, int], per_source_k: int, n_candidates: int, needed: int, tenant_id: str, user_roles: List[str]) -> Dict[str, int]:
+        """Raised k for spaces that filled their budget, only when the first
+        round produced fewer than `needed` candidates. Returns {} otherwise.
+        """
+        if not self.enabled or n_candidates >= needed:
+            return {}
+
+        def has_more(sp: str, k: int) -> bool:
+            size = self.visible(sp, tenant_id, user_roles)
+            return 0 < k < per_source_k and returned.get(sp, 0) >= k and (size is None or k < size)
+
+        saturated = [sp for sp, k in budgets.items() if has_more(sp, k)]
+        if not saturated:
+            return {}
+        spare = sum(budgets.values()) - sum(min(returned.get(sp, 0), k) for sp, k in budgets.items())
+        extra = max(needed - n_candidates, spare)
+        share = max(1, extra // len(saturated))
+        return {sp: min(per_source_k, budgets[sp] + share) for sp in saturated}
+
+    def observe(self, spaces: List[str], results: List[Dict]) -> None:
+        """Update each searched space's share of the final ranking."""
+        if not results:
+            return
+        counts = {sp: 0 for sp in spaces}
+        for it in results:
+            sp = (it.get("origin") or "").split(":", 1)[-1]
+            if sp in counts:
+                counts[sp] += 1
+        with self._lock:
+            for sp, c in counts.items():
+                prev = self.hit_rate.get(sp, self.prior)
+                self.hit_rate[sp] = (1 - self.alpha) * prev + self.alpha * (c / len(results))
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hit_rate": {sp: round(r, 4) for sp, r in self.hit_rate.items()},
+                "visible_cached": len(self._visible),
+            }
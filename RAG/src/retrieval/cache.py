@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+
+from dotenv import load_dotenv
+
+try:
+    import redis
+except Exception:  # redis is optional; the in-process tier works without it
+    redis = None  # type: ignore
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+def _flag(name: str, default: str) -> bool:
+    return _env(name, default).lower() in ("1", "true", "yes")
+
+
+class SpaceGenerations:
+    """Per-space generation counters.
+
+    Ingestion bumps the counter of every space it writes to; cached results
+    remember the generations they were computed under and are discarded as
+    soon as any of them moves. With Redis configured the counters are shared
+    across workers, and reads are served from a short-lived local snapshot so
+    cache hits do not pay a network round trip.
+    """
+
+    def __init__(self, redis_client=None, prefix: str = "rag:gen:", refresh_s: float | None = None) -> None:
+        self.redis = redis_client
+        self.prefix = prefix
+        self.refresh_s = float(_env("RAG_CACHE_GEN_REFRESH_S", "1.0")) if refresh_s is None else refresh_s
+        self._local: Dict[str, int] = {}
+        self._seen_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, space: str) -> int:
+        now = time.monotonic()
+        with self._lock:
+            gen = self._local.get(space)
+            fresh = gen is not None and (self.redis is None or now - self._seen_at.get(space, 0.0) < self.refresh_s)
+        if fresh:
+            return gen  # type: ignore[return-value]
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self.prefix + space)
+                gen = int(raw or 0)
+            except Exception:
+                gen = self._local.get(space, 0)
+        else:
+            gen = 0
+        with self._lock:
+            self._local[space] = max(gen, self._local.get(space, 0))
+            self._seen_at[space] = now
+            return self._local[space]
+
+    def snapshot(self, spaces: List[str]) -> Dict[str, int]:
+        return {sp: self.get(sp) for sp in spaces}
+
+    def bump(self, space: str) -> int:
+        gen = None
+        if self.redis is not None:
+            try:
+                gen = int(self.redis.incr(self.prefix + space))
+            except Exception:
+                gen = None
+        with self._lock:
+            if gen is None:
+                gen = self._local.get(space, 0) + 1
+            self._local[space] = gen
+            self._seen_at[space] = time.monotonic()
+            return gen
+
+
+class QueryResultCache:
+    """Two-tier cache for retrieval results.
+
+    Keys cover everything that changes the answer, including the sorted role
+    set, so results can never be served to a caller with different
+    visibility. Values carry the generation snapshot of the searched spaces
+    and are treated as misses once ingestion has bumped any of them.
+    """
+
+    def __init__(self, redis_client=None, max_entries: int | None = None, ttl_s: float | None = None, generations: SpaceGenerations | None = None) -> None:
+        self.redis = redis_client
+        self.max_entries = int(_env("RAG_CACHE_MAX_ENTRIES", "2048")) if max_entries is None else max_entries
+        self.ttl_s = float(_env("RAG_CACHE_TTL_S", "600")) if ttl_s is None else ttl_s
+        self.generations = generations or SpaceGenerations(redis_client)
+        self.prefix = "rag:q:"
+        self._local: "OrderedDict[str, tuple[float, Dict[str, int], List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "remote_hits": 0}
+
+    @staticmethod
+    def make_key(query: str, tenant_id: str, user_roles: List[str], spaces: List[str], tags: List[str] | None, top_k: int, **extra: Any) -> str:
+        parts = {
+            "q": " ".join(query.lower().split()),
+            "t": tenant_id,
+            "r": sorted(set(user_roles)),
+            "s": sorted(set(spaces)),
+            "g": sorted(set(tags or [])),
+            "k": int(top_k),
+        }
+        if extra:
+            parts["x"] = {k: v for k, v in sorted(extra.items())}
+        raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, spaces: List[str]) -> List[Dict] | None:
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                self._local.move_to_end(key)
+        if entry is None and self.redis is not None:
+            try:
+                raw = self.redis.get(self.prefix + key)
+                if raw:
+                    data = json.loads(raw)
+                    entry = (float(data["exp"]), dict(data["gens"]), list(data["items"]))
+                    self._store_local(key, entry)
+                    self.stats["remote_hits"] += 1
+            except Exception:
+                entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires, gens, items = entry
+        if expires < now or gens != self.generations.snapshot(spaces):
+            self._drop(key)
+            self.stats["stale"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return [dict(it) for it in items]
+
+    def put(self, key: str, spaces: List[str], items: List[Dict], gens: Dict[str, int] | None = None) -> None:
+        # Callers should pass the snapshot taken *before* retrieval started so a
+        # concurrent ingestion makes the entry stale instead of hiding new data.
+        gens = gens if gens is not None else self.generations.snapshot(spaces)
+        expires = time.time() + self.ttl_s
+        stored = [dict(it) for it in items]
+        self._store_local(key, (expires, gens, stored))
+        if self.redis is not None:
+            try:
+                payload = json.dumps({"exp": expires, "gens": gens, "items": stored}, default=str)
+                self.redis.set(self.prefix + key, payload, ex=max(1, int(self.ttl_s)))
+            except Exception:
+                pass
+
+    def _store_local(self, key: str, entry) -> None:
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def _drop(self, key: str) -> None:
+        # Only the local copy is dropped; another worker may already have
+        # replaced the shared entry with a fresh one, and Redis expires the rest.
+        with self._lock:
+            self._local.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._local)
+        return {**self.stats, "entries": size, "shared": self.redis is not None}
+
+
+class ResultCacheSingleton:
+    _cache = None
+
+    @classmethod
+    def get(cls) -> QueryResultCache:
+        if cls._cache is None:
+            client = None
+            if redis is not None and _flag("RAG_CACHE_REDIS", "false"):
+                try:
+                    client = redis.Redis.from_url(_env("REDIS_URL", "redis://localhost:6379/0"), socket_timeout=0.2)
+                    client.ping()
+                except Exception as e:
+                    print(f"[Cache][WARN] Redis unavailable, using in-process tier only: {e}")
+                    client = None
+            cls._cache = QueryResultCache(redis_client=client)
+        return cls._cache
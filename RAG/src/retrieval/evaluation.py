@@ -0,0 +1,168 @@
+"""Offline retrieval evaluation for HybridRetriever.
+
+Runs a golden query set through `HybridRetriever.retrieve` once per config
+variant and reports ranking quality (recall@k, MRR, nDCG@k) next to per-stage
+latency percentiles and candidate counts, so a tuning change can be checked
+for quality regressions before rollout.
+
+Golden set (JSONL), one query per line:
+    {"query": "...", "tenant_id": "default", "user_roles": ["employee"],
+     "spaces": ["documents"], "tags": null,
+     "expected_document_ids": ["..."], "expected_chunk_ids": ["<doc>_3"]}
+
+Variants (JSON list); every key is optional and falls back to the defaults:
+    [{"name": "baseline"},
+     {"name": "k30", "rrf_k": 30, "per_source_k": 25, "rerank_depth": 20},
+     {"name": "no-consolidate", "consolidate": false},
+     {"name": "chunks-500", "spaces": ["documents_c500"]}]
+
+Chunk size is an ingestion-time setting; compare chunkings by ingesting the
+corpus into a separate space and pointing a variant's `spaces` at it.
+
+Usage:
+    python -m src.retrieval.evaluation --golden golden.jsonl --variants variants.json --out report.json
+"""
+import argparse
+import json
+import math
+import time
+from typing import List, Dict, Any
+
+from src.retrieval.retriever import HybridRetriever
+
+
+STAGES = ["embed_ms", "search_ms", "fuse_ms", "rerank_ms", "total_ms"]
+COUNTS = ["vector", "bm25", "fused", "consolidated", "reranked"]
+
+
+def load_jsonl(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def _relevant_keys(item: Dict, golden: Dict) -> set:
+    chunk_ids = set(golden.get("expected_chunk_ids") or [])
+    if chunk_ids:
+        # a merged passage is credited for every expected chunk it contains
+        return ({item.get("id")} | set(item.get("merged_ids") or [])) & chunk_ids
+    doc_ids = set(golden.get("expected_document_ids") or [])
+    return {item.get("document_id")} & doc_ids
+
+
+def _n_relevant(golden: Dict) -> int:
+    return len(golden.get("expected_chunk_ids") or golden.get("expected_document_ids") or [])
+
+
+def score_ranking(items: List[Dict], golden: Dict, k: int) -> Dict[str, float]:
+    """Binary-relevance metrics for one ranked list.
+    With chunk ids in the golden set relevance is chunk-level (a merged passage
+    counts if it contains an expected chunk); otherwise document-level. Each
+    expected id is credited once, so duplicates of a document don't inflate recall.
+    """
+    n_rel = _n_relevant(golden)
+    if n_rel == 0:
+        return {"recall": 0.0, "mrr": 0.0, "ndcg": 0.0}
+    seen: set = set()
+    gains: List[int] = []
+    first_hit = 0
+    for rank, it in enumerate(items[:k], start=1):
+        new = _relevant_keys(it, golden) - seen
+        if new:
+            seen |= new
+            first_hit = first_hit or rank
+        gains.append(1 if new else 0)
+    dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gains))
+    idcg = sum(1.0 / math.log2(i + 2) for i in range(min(n_rel, k)))
+    return {
+        "recall": min(1.0, len(seen) / n_rel),
+        "mrr": (1.0 / first_hit) if first_hit else 0.0,
+        "ndcg": (dcg / idcg) if idcg else 0.0,
+    }
+
+
+def run_variant(retriever: HybridRetriever, golden: List[Dict], variant: Dict[str, Any]) -> Dict[str, Any]:
+    top_k = int(variant.get("top_k", 20))
+    saved = (retriever.rrf_k, retriever.consolidate)
+    retriever.rrf_k = int(variant.get("rrf_k", retriever.rrf_k))
+    retriever.consolidate = bool(variant.get("consolidate", retriever.consolidate))
+    metrics: Dict[str, List[float]] = {"recall": [], "mrr": [], "ndcg": []}
+    stages: Dict[str, List[float]] = {s: [] for s in STAGES}
+    counts: Dict[str, List[float]] = {c: [] for c in COUNTS}
+    try:
+        for g in golden:
+            trace: Dict[str, Any] = {}
+            t0 = time.perf_counter()
+            items = retriever.retrieve(
+                query=g["query"],
+                tenant_id=g.get("tenant_id", "default"),
+                user_roles=g.get("user_roles", ["employee"]),
+                spaces=variant.get("spaces") or g.get("spaces"),
+                tags=g.get("tags"),
+                top_k=top_k,
+                per_source_k=int(variant.get("per_source_k", 50)),
+                use_cache=False,
+                rerank_depth=variant.get("rerank_depth"),
+                trace=trace,
+            )
+            trace["total_ms"] = (time.perf_counter() - t0) * 1000.0
+            for name, value in score_ranking(items, g, top_k).items():
+                metrics[name].append(value)
+            for s in STAGES:
+                stages[s].append(float(trace.get(s, 0.0)))
+            for c in COUNTS:
+                counts[c].append(float(trace.get("candidates", {}).get(c, 0)))
+    finally:
+        retriever.rrf_k, retriever.consolidate = saved
+    n = max(1, len(golden))
+    return {
+        "name": variant.get("name", "variant"),
+        "config": variant,
+        "queries": len(golden),
+        f"recall@{top_k}": round(sum(metrics["recall"]) / n, 4),
+        "mrr": round(sum(metrics["mrr"]) / n, 4),
+        f"ndcg@{top_k}": round(sum(metrics["ndcg"]) / n, 4),
+        "latency_ms": {s: {"p50": round(_percentile(v, 50), 2), "p95": round(_percentile(v, 95), 2)} for s, v in stages.items()},
+        "candidates_mean": {c: round(sum(v) / n, 1) for c, v in counts.items()},
+    }
+
+
+def evaluate(golden: List[Dict], variants: List[Dict], retriever: HybridRetriever | None = None) -> List[Dict]:
+    retriever = retriever or HybridRetriever()
+    return [run_variant(retriever, golden, v) for v in (variants or [{"name": "baseline"}])]
+
+
+def _print_report(report: List[Dict]) -> None:
+    for r in report:
+        quality = {k: v for k, v in r.items() if k.startswith(("recall@", "ndcg@")) or k == "mrr"}
+        lat = r["latency_ms"]
+        print(f"== {r['name']} ({r['queries']} queries)")
+        print("   " + "  ".join(f"{k}={v}" for k, v in quality.items()))
+        print("   " + "  ".join(f"{s}: p50={lat[s]['p50']} p95={lat[s]['p95']}" for s in STAGES))
+        print("   candidates: " + "  ".join(f"{c}={v}" for c, v in r["candidates_mean"].items()))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Evaluate HybridRetriever quality and latency on a golden set")
+    ap.add_argument("--golden", required=True, help="JSONL golden query set")
+    ap.add_argument("--variants", help="JSON list of config variants (default: baseline only)")
+    ap.add_argument("--out", help="write the full report as JSON")
+    args = ap.parse_args()
+    golden = load_jsonl(args.golden)
+    variants = json.load(open(args.variants, "r", encoding="utf-8")) if args.variants else []
+    report = evaluate(golden, variants)
+    _print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
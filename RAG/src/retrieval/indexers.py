@@ -1,16 +1,15 @@
 import os
 import uuid
-import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable
 
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qmodels
-from opensearchpy import OpenSearch
 
 from src.ingestion.parser import extract_text_from_file
 from src.utils.acl import infer_acl_from_text, build_acl_metadata
+from src.retrieval.cache import ResultCacheSingleton
+from src.retrieval.vector_store import VectorStoreSingleton, VectorStore
+from src.retrieval.lexical_store import LexicalStoreSingleton, LexicalStore
 
 load_dotenv()
 
@@ -32,6 +31,7 @@ class EmbeddingSingleton:
 
 
 DEFAULT_SPACES = ["documents", "employees", "decisions", "memory", "projects"]
+EMBEDDING_DIM = int(_env("EMBEDDING_DIM", "1024"))
 
 
 def qdrant_collection_for(space: str) -> str:
@@ -44,24 +44,20 @@ def opensearch_index_for(space: str) -> str:
 
 class IndexCoordinator:
     def __init__(self) -> None:
-        self.qdrant = QdrantClient(url=_env("QDRANT_URL", "http://localhost:6333"), timeout=int(_env("QDRANT_TIMEOUT", "10")))
+        self.vectors: VectorStore = VectorStoreSingleton.get()
         # legacy single-collection name (kept for backward compat if used)
         self.collection = _env("QDRANT_COLLECTION", "rag_chunks")
-        self.os = OpenSearch(hosts=[_env("OPENSEARCH_URL", "http://localhost:9200")], http_compress=True)
+        self.lexical: LexicalStore = LexicalStoreSingleton.get()
         self.os_index = _env("OPENSEARCH_INDEX", "rag_docs")
+        # called with {space, project_id, subdb, filename, document_id} after each successful ingest
+        self.listeners: List[Callable[[Dict], None]] = []
+
+    def add_listener(self, fn: Callable[[Dict], None]) -> None:
+        self.listeners.append(fn)
 
     def ensure_ready(self) -> None:
-        # Wait for Qdrant to be ready and ensure collection exists
-        q_attempts = 15
-        for i in range(q_attempts):
-            try:
-                # lightweight call to check readiness
-                _ = self.qdrant.get_collections()
-                break
-            except Exception:
-                if i == q_attempts - 1:
-                    raise
-                time.sleep(2)
+        # Wait for the vector store to be ready and ensure collections exist
+        self.vectors.wait_ready()
 
         # Lazily ensure default spaces, but don't fail startup if any one fails
         for sp in DEFAULT_SPACES:
@@ -70,71 +66,16 @@ class IndexCoordinator:
             except Exception as e:
                 print(f"[Startup][WARN] ensure_space_ready failed for space={sp}: {e}")
 
-        # Wait for OpenSearch and ensure index exists
-        os_attempts = 30
-        for i in range(os_attempts):
-            try:
-                if self.os.ping():
-                    break
-            except Exception:
-                pass
-            time.sleep(1)
-
-        # Ensure legacy index exists for backward compat (optional)
-        if not self.os.indices.exists(index=self.os_index):
-            self._create_os_index(self.os_index)
-
-    def _create_os_index(self, index_name: str) -> None:
-        self.os.indices.create(
-            index=index_name,
-            body={
-                "settings": {"number_of_shards": 1, "number_of_replicas": 0},
-                "mappings": {
-                    "properties": {
-                        "document_id": {"type": "keyword"},
-                        "tenant_id": {"type": "keyword"},
-                        "uploader_id": {"type": "keyword"},
-                        "roles": {"type": "keyword"},
-                        "text": {"type": "text"},
-                        "mime": {"type": "keyword"},
-                        "chunk_id": {"type": "keyword"},
-                        "chunk_index": {"type": "integer"},
-                        "filename": {"type": "keyword"},
-                        "space": {"type": "keyword"},
-                        "tags": {"type": "keyword"},
-                        "project_id": {"type": "keyword"},
-                        "subdb": {"type": "keyword"}
-                    }
-                },
-            },
-        )
+        # Wait for the BM25 store and ensure legacy index exists for backward compat (optional)
+        self.lexical.wait_ready()
+        self.lexical.ensure_index(self.os_index)
 
     def ensure_space_ready(self, space: str) -> None:
-        # Qdrant collection for space
-        col = qdrant_collection_for(space)
-        try:
-            self.qdrant.get_collection(col)
-        except Exception:
-            r_attempts = 10
-            last_err = None
-            for _ in range(r_attempts):
-                try:
-                    self.qdrant.recreate_collection(
-                        collection_name=col,
-                        vectors_config=qmodels.VectorParams(size=1024, distance=qmodels.Distance.COSINE),
-                    )
-                    last_err = None
-                    break
-                except Exception as e:
-                    last_err = e
-                    time.sleep(2)
-            if last_err:
-                raise last_err
+        # Vector collection for space
+        self.vectors.ensure_collection(qdrant_collection_for(space), EMBEDDING_DIM)
 
-        # OpenSearch index for space
-        idx = opensearch_index_for(space)
-        if not self.os.indices.exists(index=idx):
-            self._create_os_index(idx)
+        # BM25 index for space
+        self.lexical.ensure_index(opensearch_index_for(space))
 
     # ---------------- Projects (hierarchical) helpers ----------------
     @staticmethod
@@ -152,30 +93,10 @@ class IndexCoordinator:
     def ensure_project_ready(self, project_id: str, subdb: str) -> None:
         if not project_id or not self._valid_project_subdb(subdb):
             raise ValueError("Invalid project_id or subdb")
-        # Qdrant
-        pcol = self.qdrant_collection_for_project(project_id, subdb)
-        try:
-            self.qdrant.get_collection(pcol)
-        except Exception:
-            r_attempts = 10
-            last_err = None
-            for _ in range(r_attempts):
-                try:
-                    self.qdrant.recreate_collection(
-                        collection_name=pcol,
-                        vectors_config=qmodels.VectorParams(size=1024, distance=qmodels.Distance.COSINE),
-                    )
-                    last_err = None
-                    break
-                except Exception as e:
-                    last_err = e
-                    time.sleep(2)
-            if last_err:
-                raise last_err
-        # OpenSearch
-        pidx = self.opensearch_index_for_project(project_id, subdb)
-        if not self.os.indices.exists(index=pidx):
-            self._create_os_index(pidx)
+        # Vectors
+        self.vectors.ensure_collection(self.qdrant_collection_for_project(project_id, subdb), EMBEDDING_DIM)
+        # BM25
+        self.lexical.ensure_index(self.opensearch_index_for_project(project_id, subdb))
 
     def _chunk(self, text: str, max_tokens: int = 1000, overlap: int = 150) -> List[str]:
         # Simple character-based chunking as placeholder.
@@ -211,7 +132,7 @@ class IndexCoordinator:
             # 4) Embed
             embedder = EmbeddingSingleton.get()
             vectors = embedder.encode(chunks, normalize_embeddings=True).tolist()
-            # 5) Upsert to Qdrant
+            # 5) Upsert to the vector store
             points = []
             base_doc_id = str(uuid.uuid4())
             for i, (chunk, vec) in enumerate(zip(chunks, vectors)):
@@ -231,60 +152,47 @@ class IndexCoordinator:
                     "project_id": project_id,
                     "subdb": project_subdb,
                 }
-                points.append(qmodels.PointStruct(id=point_id, vector=vec, payload=payload))
+                points.append((point_id, vec, payload))
             if points:
                 if use_project_route:
-                    self.qdrant.upsert(collection_name=self.qdrant_collection_for_project(project_id, project_subdb), points=points)
+                    self.vectors.upsert(self.qdrant_collection_for_project(project_id, project_subdb), points)
                 else:
-                    self.qdrant.upsert(collection_name=qdrant_collection_for(space), points=points)
-                print(f"[Ingest] Upserted {len(points)} chunks to Qdrant")
-            # 6) Index chunks (and a full-doc record) into BM25 (OpenSearch)
-            # 6a) Full document record (helps recall for long queries)
+                    self.vectors.upsert(qdrant_collection_for(space), points)
+                print(f"[Ingest] Upserted {len(points)} chunks to vector store")
+            # 6) Index chunks (and a full-doc record) into BM25 in one bulk write
             target_index = self.opensearch_index_for_project(project_id, project_subdb) if use_project_route else opensearch_index_for(space)
-            self.os.index(
-                index=target_index,
-                body={
-                    "document_id": base_doc_id,
-                    "tenant_id": tenant_id,
-                    "uploader_id": uploader_id,
-                    "roles": acl_meta["roles"],
-                    "text": text,
-                    "mime": mime,
-                    "filename": filename,
-                    "chunk_id": None,
-                    "chunk_index": -1,
-                    "space": space,
-                    "tags": tags,
-                    "project_id": project_id,
-                    "subdb": project_subdb,
-                },
-            )
+            base = {
+                "document_id": base_doc_id,
+                "tenant_id": tenant_id,
+                "uploader_id": uploader_id,
+                "roles": acl_meta["roles"],
+                "mime": mime,
+                "filename": filename,
+                "space": space,
+                "tags": tags,
+                "project_id": project_id,
+                "subdb": project_subdb,
+            }
+            # 6a) Full document record (helps recall for long queries)
+            docs = [{**base, "text": text, "chunk_id": None, "chunk_index": -1}]
             # 6b) Per-chunk records
-            for i, chunk in enumerate(chunks):
-                pid = f"{base_doc_id}_{i}"
-                self.os.index(
-                    index=target_index,
-                    body={
-                        "document_id": base_doc_id,
-                        "tenant_id": tenant_id,
-                        "uploader_id": uploader_id,
-                        "roles": acl_meta["roles"],
-                        "text": chunk,
-                        "mime": mime,
-                        "filename": filename,
-                        "chunk_id": pid,
-                        "chunk_index": i,
-                        "space": space,
-                        "tags": tags,
-                        "project_id": project_id,
-                        "subdb": project_subdb,
-                    },
-                )
-            print(f"[Ingest] Indexed chunks into OpenSearch for {filename}")
+            docs += [{**base, "text": chunk, "chunk_id": f"{base_doc_id}_{i}", "chunk_index": i} for i, chunk in enumerate(chunks)]
+            self.lexical.bulk(target_index, docs)
+            print(f"[Ingest] Indexed {len(docs)} records into BM25 for {filename}")
             try:
-                self.os.indices.refresh(index=target_index)
+                self.lexical.refresh(target_index)
             except Exception as e:
-                print(f"[Ingest][WARN] OpenSearch refresh failed: {e}")
+                print(f"[Ingest][WARN] BM25 refresh failed: {e}")
+            # 7) Invalidate cached query results that searched this space
+            ResultCacheSingleton.get().generations.bump(space)
+            info = {"space": space, "project_id": project_id, "subdb": project_subdb, "filename": filename, "document_id": base_doc_id}
+            for fn in self.listeners:
+                try:
+                    fn(info)
+                except Exception as e:
+                    print(f"[Ingest][WARN] listener failed: {e}")
         except Exception as e:
             # Surface errors in server logs for debugging
             print(f"[Ingest][ERROR] {filename}: {e}")
+            # A partial write may already be searchable; don't keep serving old results
+            ResultCacheSingleton.get().generations.bump((space or "documents").lower())
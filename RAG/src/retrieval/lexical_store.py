@@ -0,0 +1,451 @@
+import os
+import re
+import gzip
+import json
+import math
+import uuid
+import time
+import zlib
+import threading
+from typing import List, Dict, Any, Iterable
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+# Same filter shape as the vector store: scalar -> term, list -> terms (any).
+Filters = Dict[str, Any]
+
+KEYWORD_FIELDS = ["document_id", "tenant_id", "uploader_id", "roles", "mime", "chunk_id", "filename", "space", "tags", "project_id", "subdb"]
+
+
+class LexicalStore:
+    """BM25 interface shared by IndexCoordinator (writes) and HybridRetriever (reads).
+    Hits use the OpenSearch shape: {"_id", "_score", "_source"}.
+    """
+
+    def wait_ready(self) -> None:
+        pass
+
+    def ensure_index(self, name: str) -> None:
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def bulk(self, name: str, docs: List[Dict]) -> None:
+        raise NotImplementedError
+
+    def refresh(self, name: str) -> None:
+        pass
+
+    def search(self, name: str, text: str | None, filters: Filters | None, size: int, fields: List[str] | None = None) -> List[Dict]:
+        """BM25 `match` on the text field (OR of terms); text=None matches all."""
+        raise NotImplementedError
+
+    def count(self, name: str, filters: Filters | None = None) -> int:
+        raise NotImplementedError
+
+    def msearch(self, requests: List[Dict]) -> List[List[Dict]]:
+        """Several searches in one call; each request has index, text, filters,
+        size and fields. A failed search (e.g. missing index) yields []."""
+        out = []
+        for r in requests:
+            try:
+                out.append(self.search(r["index"], r.get("text"), r.get("filters"), r.get("size", 10), r.get("fields")))
+            except Exception:
+                out.append([])
+        return out
+
+
+class OpenSearchLexicalStore(LexicalStore):
+    def __init__(self) -> None:
+        from opensearchpy import OpenSearch
+
+        self.client = OpenSearch(hosts=[_env("OPENSEARCH_URL", "http://localhost:9200")], http_compress=True)
+
+    @staticmethod
+    def _filter(filters: Filters | None) -> List[Dict]:
+        out = []
+        for key, value in (filters or {}).items():
+            if isinstance(value, (list, tuple, set)):
+                out.append({"terms": {key: list(value)}})
+            else:
+                out.append({"term": {key: value}})
+        return out
+
+    def wait_ready(self) -> None:
+        # Wait for OpenSearch
+        os_attempts = 30
+        for i in range(os_attempts):
+            try:
+                if self.client.ping():
+                    break
+            except Exception:
+                pass
+            time.sleep(1)
+
+    def exists(self, name: str) -> bool:
+        return bool(self.client.indices.exists(index=name))
+
+    def ensure_index(self, name: str) -> None:
+        if self.exists(name):
+            return
+        props = {f: {"type": "keyword"} for f in KEYWORD_FIELDS}
+        props["text"] = {"type": "text"}
+        props["chunk_index"] = {"type": "integer"}
+        self.client.indices.create(
+            index=name,
+            body={
+                "settings": {"number_of_shards": 1, "number_of_replicas": 0},
+                "mappings": {"properties": props},
+            },
+        )
+
+    def bulk(self, name: str, docs: List[Dict]) -> None:
+        from opensearchpy import helpers
+
+        helpers.bulk(self.client, ({"_index": name, "_source": d} for d in docs))
+
+    def refresh(self, name: str) -> None:
+        self.client.indices.refresh(index=name)
+
+    def search(self, name: str, text: str | None, filters: Filters | None, size: int, fields: List[str] | None = None) -> List[Dict]:
+        must = [{"match": {"text": text}}] if text else [{"match_all": {}}]
+        body: Dict[str, Any] = {"query": {"bool": {"must": must, "filter": self._filter(filters)}}, "size": size}
+        if fields is not None:
+            body["_source"] = fields
+        res = self.client.search(index=name, body=body)
+        return res.get("hits", {}).get("hits", [])
+
+    def count(self, name: str, filters: Filters | None = None) -> int:
+        res = self.client.count(index=name, body={"query": {"bool": {"filter": self._filter(filters)}}})
+        return int(res.get("count", 0))
+
+    def msearch(self, requests: List[Dict]) -> List[List[Dict]]:
+        if not requests:
+            return []
+        lines: List[Dict] = []
+        for r in requests:
+            must = [{"match": {"text": r["text"]}}] if r.get("text") else [{"match_all": {}}]
+            body: Dict[str, Any] = {"query": {"bool": {"must": must, "filter": self._filter(r.get("filters"))}}, "size": r.get("size", 10)}
+            if r.get("fields") is not None:
+                body["_source"] = r["fields"]
+            lines += [{"index": r["index"], "ignore_unavailable": True}, body]
+        res = self.client.msearch(body=lines)
+        return [[] if "error" in resp else resp.get("hits", {}).get("hits", []) for resp in res.get("responses", [])]
+
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t.lower() for t in _TOKEN.findall(text or "")]
+
+
+def _pack(values: np.ndarray, delta: bool) -> bytes:
+    arr = np.diff(values, prepend=0) if delta else values
+    return zlib.compress(arr.astype(np.uint32).tobytes(), 1)
+
+
+def _unpack(blob: bytes, delta: bool) -> np.ndarray:
+    arr = np.frombuffer(zlib.decompress(blob), dtype=np.uint32).astype(np.int64)
+    return np.cumsum(arr) if delta else arr
+
+
+_SEGMENT_FILES = (".npz", ".json", ".docs.jsonl.gz")
+
+
+class _Segment:
+    """Immutable, self-contained slice of an index.
+    Text postings are delta-encoded doc ids plus term frequencies, zlib-packed
+    per term; keyword fields keep packed doc-id lists per value.
+    """
+
+    def __init__(self, docs: List[Dict], ids: List[str], lengths: np.ndarray, postings: Dict[str, tuple], keywords: Dict[str, Dict[Any, bytes]]) -> None:
+        self.docs = docs
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings  # term -> (df, packed ids, packed tfs)
+        self.keywords = keywords  # field -> value -> packed ids
+
+    @property
+    def size(self) -> int:
+        return len(self.docs)
+
+    @classmethod
+    def build(cls, entries: List[tuple]) -> "_Segment":
+        ids, docs = [e[0] for e in entries], [e[1] for e in entries]
+        lengths = np.zeros(len(docs), dtype=np.float32)
+        tf_lists: Dict[str, tuple[list, list]] = {}
+        kw_lists: Dict[str, Dict[Any, list]] = {}
+        for i, doc in enumerate(docs):
+            terms = tokenize(doc.get("text", ""))
+            lengths[i] = len(terms)
+            counts: Dict[str, int] = {}
+            for t in terms:
+                counts[t] = counts.get(t, 0) + 1
+            for t, c in counts.items():
+                lst = tf_lists.setdefault(t, ([], []))
+                lst[0].append(i)
+                lst[1].append(c)
+            for field in KEYWORD_FIELDS:
+                value = doc.get(field)
+                if value is None:
+                    continue
+                for v in (value if isinstance(value, list) else [value]):
+                    kw_lists.setdefault(field, {}).setdefault(v, []).append(i)
+        postings = {
+            t: (len(d), _pack(np.asarray(d, dtype=np.int64), True), _pack(np.asarray(f, dtype=np.int64), False))
+            for t, (d, f) in tf_lists.items()
+        }
+        keywords = {
+            field: {v: _pack(np.asarray(rows, dtype=np.int64), True) for v, rows in vals.items()}
+            for field, vals in kw_lists.items()
+        }
+        return cls(docs, ids, lengths, postings, keywords)
+
+    def entries(self) -> List[tuple]:
+        return list(zip(self.ids, self.docs))
+
+    def save(self, base: str) -> None:
+        """Write base.npz (lengths, document frequencies and every packed
+        blob concatenated with offsets), base.json (terms and keyword values
+        in blob order) and base.docs.jsonl.gz (id and source per line)."""
+        terms = list(self.postings)
+        kw_keys = [(field, v) for field, vals in self.keywords.items() for v in vals]
+        blobs: List[bytes] = []
+        for t in terms:
+            blobs.extend(self.postings[t][1:])
+        blobs.extend(self.keywords[field][v] for field, v in kw_keys)
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(bl) for bl in blobs])
+        df = np.array([self.postings[t][0] for t in terms], dtype=np.int64)
+        with open(base + ".npz.tmp", "wb") as f:
+            np.savez(f, lengths=self.lengths, df=df, offsets=offsets, blob=np.frombuffer(b"".join(blobs), dtype=np.uint8))
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"terms": terms, "keywords": kw_keys}, f)
+        with gzip.open(base + ".docs.jsonl.gz.tmp", "wt", encoding="utf-8", compresslevel=1) as f:
+            for doc_id, doc in zip(self.ids, self.docs):
+                f.write(json.dumps({"id": doc_id, "doc": doc}) + "\n")
+        for ext in _SEGMENT_FILES:
+            os.replace(base + ext + ".tmp", base + ext)
+
+    @classmethod
+    def load(cls, base: str) -> "_Segment":
+        with np.load(base + ".npz", allow_pickle=False) as z:
+            lengths, df, offsets = z["lengths"], z["df"], z["offsets"]
+            raw = z["blob"].tobytes()
+        with open(base + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        blobs = [raw[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        terms = meta["terms"]
+        postings = {t: (int(df[i]), blobs[2 * i], blobs[2 * i + 1]) for i, t in enumerate(terms)}
+        keywords: Dict[str, Dict[Any, bytes]] = {}
+        for j, (field, v) in enumerate(meta["keywords"]):
+            keywords.setdefault(field, {})[v] = blobs[2 * len(terms) + j]
+        ids, docs = [], []
+        with gzip.open(base + ".docs.jsonl.gz", "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    ids.append(rec["id"])
+                    docs.append(rec["doc"])
+        return cls(docs, ids, lengths, postings, keywords)
+
+    def mask(self, filters: Filters | None) -> np.ndarray:
+        mask = np.ones(self.size, dtype=bool)
+        for field, value in (filters or {}).items():
+            allowed = np.zeros(self.size, dtype=bool)
+            for v in (value if isinstance(value, (list, tuple, set)) else [value]):
+                blob = self.keywords.get(field, {}).get(v)
+                if blob is not None:
+                    allowed[_unpack(blob, True)] = True
+            mask &= allowed
+        return mask
+
+
+class _EmbeddedIndex:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self.segments: List[tuple[str, _Segment]] = []
+        self.buffer: List[tuple] = []
+        self._seq = 0
+        os.makedirs(path, exist_ok=True)
+        manifest = os.path.join(path, "segments.json")
+        if os.path.exists(manifest):
+            with open(manifest, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self._seq = int(meta.get("seq", 0))
+            for name in meta.get("segments", []):
+                if name.endswith(".pkl"):
+                    # pickled segments from older builds are not loaded; reindex to restore them
+                    print(f"[LexicalStore][WARN] skipping legacy segment {name} in {path}")
+                    continue
+                self.segments.append((name, _Segment.load(os.path.join(path, name))))
+
+    def _write_segment(self, seg: _Segment) -> str:
+        self._seq += 1
+        name = f"seg_{self._seq:06d}"
+        seg.save(os.path.join(self.path, name))
+        return name
+
+    def _write_manifest(self) -> None:
+        tmp = os.path.join(self.path, "segments.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"seq": self._seq, "segments": [name for name, _ in self.segments]}, f)
+        os.replace(tmp, os.path.join(self.path, "segments.json"))
+
+    def add(self, docs: Iterable[Dict]) -> None:
+        with self.lock:
+            self.buffer.extend((uuid.uuid4().hex, dict(d)) for d in docs)
+            if len(self.buffer) >= int(_env("LEXICAL_BUFFER_DOCS", "5000")):
+                self.refresh()
+
+    def refresh(self) -> None:
+        """Seal buffered docs into a new on-disk segment, then merge if there are too many."""
+        with self.lock:
+            if not self.buffer:
+                return
+            seg = _Segment.build(self.buffer)
+            self.segments.append((self._write_segment(seg), seg))
+            self.buffer = []
+            if len(self.segments) > int(_env("LEXICAL_MAX_SEGMENTS", "8")):
+                self._merge()
+            self._write_manifest()
+
+    def _merge(self) -> None:
+        # Tiered-ish: fold the smaller half of the segments into one
+        ordered = sorted(self.segments, key=lambda s: s[1].size)
+        victims = ordered[: max(2, len(ordered) // 2)]
+        entries: List[tuple] = []
+        for _, seg in sorted(victims, key=lambda s: s[0]):
+            entries.extend(seg.entries())
+        merged = _Segment.build(entries)
+        name = self._write_segment(merged)
+        keep = [s for s in self.segments if s not in victims]
+        self.segments = keep + [(name, merged)]
+        self._write_manifest()
+        for name, _ in victims:
+            for ext in _SEGMENT_FILES:
+                try:
+                    os.remove(os.path.join(self.path, name + ext))
+                except OSError:
+                    pass
+
+    def search(self, text: str | None, filters: Filters | None, size: int, fields: List[str] | None, k1: float, b: float) -> List[Dict]:
+        with self.lock:
+            segments = [seg for _, seg in self.segments]
+        total = sum(s.size for s in segments)
+        if not total or size <= 0:
+            return []
+        terms = list(dict.fromkeys(tokenize(text))) if text else []
+        avgdl = float(sum(float(s.lengths.sum()) for s in segments)) / total or 1.0
+        idf = {}
+        for t in terms:
+            df = sum(s.postings[t][0] for s in segments if t in s.postings)
+            if df:
+                idf[t] = math.log(1.0 + (total - df + 0.5) / (df + 0.5))
+        candidates: List[tuple[float, _Segment, int]] = []
+        for seg in segments:
+            mask = seg.mask(filters)
+            if text is None:
+                rows = np.flatnonzero(mask)[:size]
+                candidates.extend((1.0, seg, int(r)) for r in rows)
+                continue
+            scores = np.zeros(seg.size, dtype=np.float32)
+            norm = k1 * (1.0 - b + b * seg.lengths / avgdl)
+            for t, w in idf.items():
+                post = seg.postings.get(t)
+                if post is None:
+                    continue
+                rows = _unpack(post[1], True)
+                tfs = _unpack(post[2], False).astype(np.float32)
+                scores[rows] += w * tfs * (k1 + 1.0) / (tfs + norm[rows])
+            scores[~mask] = 0.0
+            hits = np.flatnonzero(scores > 0)
+            if hits.size > size:
+                hits = hits[np.argpartition(-scores[hits], size - 1)[:size]]
+            candidates.extend((float(scores[r]), seg, int(r)) for r in hits)
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        out = []
+        for score, seg, row in candidates[:size]:
+            src = seg.docs[row]
+            if fields is not None:
+                src = {f: src.get(f) for f in fields if f in src}
+            out.append({"_id": seg.ids[row], "_score": score, "_source": src})
+        return out
+
+    def count(self, filters: Filters | None) -> int:
+        with self.lock:
+            return int(sum(int(seg.mask(filters).sum()) for _, seg in self.segments))
+
+
+class EmbeddedLexicalStore(LexicalStore):
+    """In-process BM25 (Lucene-style idf, k1/b) over compressed segment files
+    under LEXICAL_STORE_PATH. Writes buffer until refresh(), which seals a
+    segment to disk; segments are merged once there are more than
+    LEXICAL_MAX_SEGMENTS. Keyword fields support term/terms filters.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or _env("LEXICAL_STORE_PATH", "./data/lexical")
+        self.k1 = float(_env("BM25_K1", "1.2"))
+        self.b = float(_env("BM25_B", "0.75"))
+        os.makedirs(self.path, exist_ok=True)
+        self._indices: Dict[str, _EmbeddedIndex] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, create: bool = False) -> _EmbeddedIndex | None:
+        with self._lock:
+            idx = self._indices.get(name)
+            if idx is None:
+                ipath = os.path.join(self.path, name)
+                if not create and not os.path.isdir(ipath):
+                    return None
+                idx = _EmbeddedIndex(ipath)
+                self._indices[name] = idx
+            return idx
+
+    def exists(self, name: str) -> bool:
+        return self._get(name) is not None
+
+    def ensure_index(self, name: str) -> None:
+        self._get(name, create=True)
+
+    def bulk(self, name: str, docs: List[Dict]) -> None:
+        self._get(name, create=True).add(docs)
+
+    def refresh(self, name: str) -> None:
+        idx = self._get(name)
+        if idx is not None:
+            idx.refresh()
+
+    def search(self, name: str, text: str | None, filters: Filters | None, size: int, fields: List[str] | None = None) -> List[Dict]:
+        idx = self._get(name)
+        if idx is None:
+            raise KeyError(f"index {name} does not exist")
+        return idx.search(text, filters, size, fields, self.k1, self.b)
+
+    def count(self, name: str, filters: Filters | None = None) -> int:
+        idx = self._get(name)
+        return idx.count(filters) if idx is not None else 0
+
+
+class LexicalStoreSingleton:
+    _store = None
+
+    @classmethod
+    def get(cls) -> LexicalStore:
+        if cls._store is None:
+            backend = _env("LEXICAL_BACKEND", "opensearch").lower()
+            print(f"[LexicalStore] Using backend: {backend}")
+            cls._store = EmbeddedLexicalStore() if backend == "embedded" else OpenSearchLexicalStore()
+        return cls._store
@@ -0,0 +1,141 @@
+import os
+import re
+from typing import List, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(text: str) -> List[str]:
+    return [t.lower() for t in _WORD.findall(text)]
+
+
+def merge_overlapping(a: str, b: str, overlap: int) -> str:
+    """Join two consecutive chunks without repeating their shared span.
+    Chunks are cut as text[i*step : i*step+window], so the expected overlap is
+    known; fall back to a suffix/prefix search if the text was trimmed.
+    """
+    if overlap > 0 and len(a) >= overlap and a[-overlap:] == b[:overlap]:
+        return a + b[overlap:]
+    for k in range(min(len(a), len(b), max(overlap, 0) * 2), 0, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return a + "\n" + b
+
+
+def best_window(text: str, query: str, window: int, overlap: int) -> tuple[int, str]:
+    """Pick the chunk-aligned window of a full document that best covers the query.
+    Windows use the same geometry as ingestion chunking, so window i is chunk i.
+    """
+    step = max(1, window - overlap)
+    qterms = set(_terms(query))
+    best_i, best_score = 0, -1.0
+    for i, start in enumerate(range(0, max(len(text), 1), step)):
+        terms = _terms(text[start : start + window])
+        if not terms:
+            continue
+        covered = qterms.intersection(terms)
+        freq = sum(1 for t in terms if t in qterms)
+        # coverage dominates; raw frequency breaks ties between equally covering windows
+        score = len(covered) + freq / (len(terms) + 1.0)
+        if score > best_score:
+            best_i, best_score = i, score
+    start = best_i * step
+    return best_i, text[start : start + window]
+
+
+def consolidate_candidates(fused: List[Dict], query: str, max_per_doc: int | None = None, max_span: int | None = None) -> List[Dict]:
+    """Collapse fused hits so each rerank slot carries distinct evidence.
+
+    - chunk hits of the same document with consecutive indexes are merged
+      into one passage (up to max_span chunks), dropping the overlap;
+    - full-document BM25 records (chunk_index=-1) are folded into the
+      document's best passage, or replaced by its best matching window when
+      no chunk of that document was retrieved;
+    - at most max_per_doc passages are kept per document.
+    Scores keep RRF semantics: a passage takes the best score of its parts.
+    """
+    max_per_doc = int(_env("CONSOLIDATE_MAX_PER_DOC", "2")) if max_per_doc is None else max_per_doc
+    max_span = int(_env("CONSOLIDATE_MAX_SPAN", "3")) if max_span is None else max_span
+    window = int(_env("CHUNK_SIZE_TOKENS", "1000"))
+    overlap = int(_env("CHUNK_OVERLAP_TOKENS", "150"))
+
+    by_doc: Dict[str, Dict[str, list]] = {}
+    passthrough: List[Dict] = []
+    for it in fused:
+        doc = it.get("document_id")
+        if not doc:
+            passthrough.append(it)
+            continue
+        group = by_doc.setdefault(doc, {"chunks": [], "full": []})
+        idx = (it.get("source") or {}).get("chunk_index")
+        if idx is None or int(idx) < 0:
+            group["full"].append(it)
+        else:
+            group["chunks"].append(it)
+
+    out: List[Dict] = list(passthrough)
+    for doc, group in by_doc.items():
+        chunks = {}
+        for it in group["chunks"]:
+            idx = int(it["source"]["chunk_index"])
+            if idx not in chunks or it.get("rrf_score", 0.0) > chunks[idx].get("rrf_score", 0.0):
+                chunks[idx] = it
+        full_score = max((f.get("rrf_score", 0.0) for f in group["full"]), default=0.0)
+
+        passages: List[Dict] = []
+        run: List[Dict] = []
+        for idx in sorted(chunks):
+            if run and (idx != int(run[-1]["source"]["chunk_index"]) + 1 or len(run) >= max_span):
+                passages.append(_merge_run(run, overlap))
+                run = []
+            run.append(chunks[idx])
+        if run:
+            passages.append(_merge_run(run, overlap))
+
+        if not passages and group["full"]:
+            full = max(group["full"], key=lambda f: f.get("rrf_score", 0.0))
+            i, text = best_window(full.get("text", ""), query, window, overlap)
+            p = full.copy()
+            p["source"] = {**(full.get("source") or {}), "chunk_index": i}
+            p["id"] = f"{doc}_{i}"
+            p["text"] = text
+            p["merged_ids"] = [full.get("id")]
+            passages.append(p)
+        elif full_score:
+            # full-doc lexical evidence supports the document's strongest passage
+            top = max(passages, key=lambda p: p.get("rrf_score", 0.0))
+            top["rrf_score"] = top.get("rrf_score", 0.0) + full_score
+            top["merged_ids"] = top.get("merged_ids", [top["id"]]) + [f.get("id") for f in group["full"]]
+
+        passages.sort(key=lambda p: p.get("rrf_score", 0.0), reverse=True)
+        out.extend(passages[:max_per_doc])
+
+    out.sort(key=lambda p: p.get("rrf_score", 0.0), reverse=True)
+    return out
+
+
+def _merge_run(run: List[Dict], overlap: int) -> Dict:
+    best = max(run, key=lambda it: it.get("rrf_score", 0.0))
+    if len(run) == 1:
+        return best.copy()
+    text = run[0].get("text", "")
+    for it in run[1:]:
+        text = merge_overlapping(text, it.get("text", ""), overlap)
+    merged = best.copy()
+    merged["text"] = text
+    merged["source"] = {
+        **(best.get("source") or {}),
+        "chunk_index": int(run[0]["source"]["chunk_index"]),
+        "chunk_span": [int(run[0]["source"]["chunk_index"]), int(run[-1]["source"]["chunk_index"])],
+    }
+    merged["merged_ids"] = [it.get("id") for it in run]
+    return merged
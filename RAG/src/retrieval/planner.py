@@ -0,0 +1,97 @@
+import os
+import threading
+from dataclasses import dataclass, asdict, field
+from typing import List, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+@dataclass
+class RetrievalPlan:
+    top_k: int
+    spaces: List[str]
+    per_source_k: int
+    rerank_depth: int
+    tier: str
+    budget_ms: float | None = None
+    estimated_ms: float = 0.0
+    dropped_spaces: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+# per-source candidates and rerank depth as (multiplier of top_k, floor)
+TIERS: Dict[str, Dict[str, tuple[int, int]]] = {
+    "fast": {"per_source_k": (2, 10), "rerank_depth": (1, 10)},
+    "balanced": {"per_source_k": (4, 20), "rerank_depth": (2, 20)},
+    "best": {"per_source_k": (1, 50), "rerank_depth": (3, 50)},
+}
+
+
+class QueryPlanner:
+    """Sizes a retrieval to a quality tier or latency budget.
+
+    Stage costs start from env-configured priors and are updated with an
+    exponential moving average of what the retriever actually measures, so
+    plans track the hardware they run on. When the estimate exceeds the
+    budget the planner shrinks, in order: rerank depth, per-source k, the
+    number of spaces searched, and finally skips reranking.
+    """
+
+    def __init__(self, alpha: float = 0.2) -> None:
+        self.alpha = alpha
+        self.costs = {
+            "embed_ms": float(_env("PLAN_EMBED_MS", "15")),
+            "search_ms_per_space": float(_env("PLAN_SEARCH_MS_PER_SPACE", "12")),
+            "search_ms_per_hit": float(_env("PLAN_SEARCH_MS_PER_HIT", "0.05")),
+            "rerank_ms_per_pair": float(_env("PLAN_RERANK_MS_PER_PAIR", "4")),
+        }
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float) -> None:
+        if value <= 0:
+            return
+        with self._lock:
+            prev = self.costs.get(name, value)
+            self.costs[name] = (1 - self.alpha) * prev + self.alpha * value
+
+    def estimate(self, n_spaces: int, per_source_k: int, rerank_depth: int) -> float:
+        c = self.costs
+        search = n_spaces * (c["search_ms_per_space"] + 2 * per_source_k * c["search_ms_per_hit"])
+        return c["embed_ms"] + search + rerank_depth * c["rerank_ms_per_pair"]
+
+    def plan(self, top_k: int, spaces: List[str], latency_budget_ms: float | None = None, quality: str | None = None) -> RetrievalPlan:
+        tier = (quality or ("balanced" if latency_budget_ms else "best")).lower()
+        if tier not in TIERS:
+            tier = "balanced"
+        preset = TIERS[tier]
+        mult, floor = preset["per_source_k"]
+        per_source_k = max(top_k * mult, floor)
+        mult, floor = preset["rerank_depth"]
+        rerank_depth = max(top_k * mult, floor)
+        plan = RetrievalPlan(top_k=top_k, spaces=list(spaces), per_source_k=per_source_k, rerank_depth=rerank_depth, tier=tier, budget_ms=latency_budget_ms)
+        if latency_budget_ms:
+            self._fit(plan, latency_budget_ms)
+        plan.estimated_ms = round(self.estimate(len(plan.spaces), plan.per_source_k, plan.rerank_depth), 2)
+        return plan
+
+    def _fit(self, plan: RetrievalPlan, budget: float) -> None:
+        def over() -> bool:
+            return self.estimate(len(plan.spaces), plan.per_source_k, plan.rerank_depth) > budget
+
+        while over() and plan.rerank_depth > plan.top_k:
+            plan.rerank_depth = max(plan.top_k, plan.rerank_depth // 2)
+        while over() and plan.per_source_k > plan.top_k:
+            plan.per_source_k = max(plan.top_k, plan.per_source_k // 2)
+        # spaces are searched in caller order, so the first ones are kept
+        while over() and len(plan.spaces) > 1:
+            plan.dropped_spaces.insert(0, plan.spaces.pop())
+        if over():
+            plan.rerank_depth = 0
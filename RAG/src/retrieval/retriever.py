@@ -1,13 +1,21 @@
 import os
-from typing import List, Dict, Tuple
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Iterator
 
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer, CrossEncoder
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qmodels
-from opensearchpy import OpenSearch
 
 from src.retrieval.indexers import EmbeddingSingleton, qdrant_collection_for, opensearch_index_for
+from src.retrieval.cache import ResultCacheSingleton, QueryResultCache
+from src.retrieval.passages import consolidate_candidates
+from src.retrieval.planner import QueryPlanner
+from src.retrieval.budget import SpaceBudgetAllocator
+from src.retrieval.snippets import add_snippets
+from src.retrieval.vector_store import VectorStoreSingleton, VectorStore
+from src.retrieval.lexical_store import LexicalStoreSingleton, LexicalStore
 
 load_dotenv()
 
@@ -29,39 +37,59 @@ class RerankerSingleton:
 
 class HybridRetriever:
     def __init__(self) -> None:
-        self.qdrant = QdrantClient(url=_env("QDRANT_URL", "http://localhost:6333"), timeout=int(_env("QDRANT_TIMEOUT", "10")))
+        self.vectors: VectorStore = VectorStoreSingleton.get()
         # default legacy collection name retained for backward compat
         self.collection = _env("QDRANT_COLLECTION", "rag_chunks")
-        self.os = OpenSearch(hosts=[_env("OPENSEARCH_URL", "http://localhost:9200")], http_compress=True)
+        self.lexical: LexicalStore = LexicalStoreSingleton.get()
         # default legacy index retained for backward compat
         self.os_index = _env("OPENSEARCH_INDEX", "rag_docs")
         self.embedder: SentenceTransformer = EmbeddingSingleton.get()
         self.reranker: CrossEncoder = RerankerSingleton.get()
+        self.cache: QueryResultCache = ResultCacheSingleton.get()
+        self.planner = QueryPlanner()
+        self.budget = SpaceBudgetAllocator(
+            lambda sp, flt: self.vectors.count(qdrant_collection_for(sp), flt),
+            self.cache.generations.get,
+        )
+        self._pool = ThreadPoolExecutor(max_workers=int(_env("RETRIEVER_WORKERS", "8")), thread_name_prefix="retrieve")
+        # recent query vectors, so snippet extraction doesn't re-embed the query
+        self._qvecs: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._qvecs_lock = threading.Lock()
+        self.rrf_k = int(_env("RRF_K", "60"))
+        self.consolidate = _env("CONSOLIDATE_CANDIDATES", "true").lower() in ("1", "true", "yes")
+
+    def _query_vector(self, query: str) -> List[float]:
+        with self._qvecs_lock:
+            qvec = self._qvecs.get(query)
+        if qvec is None:
+            qvec = self.embedder.encode([query], normalize_embeddings=True)[0].tolist()
+            with self._qvecs_lock:
+                self._qvecs[query] = qvec
+                while len(self._qvecs) > 256:
+                    self._qvecs.popitem(last=False)
+        return qvec
+
+    def snippets(self, query: str, items: List[Dict], max_chars: int | None = None, qvec: List[float] | None = None) -> List[Dict]:
+        """Copies of `items` with query-focused `snippet`s, computed in one batched encode."""
+        if qvec is None:
+            with self._qvecs_lock:
+                qvec = self._qvecs.get(query)
+        items = [dict(it) for it in items]
+        return add_snippets(self.embedder, query, items, qvec=qvec, max_chars=max_chars, batch_size=int(_env("EMBED_BATCH_SIZE", "32")))
 
-    def _qdrant_search_space(self, space: str, query: str, top_k: int, tenant_id: str, user_roles: List[str], tags: List[str] | None) -> List[Dict]:
-        qvec = self.embedder.encode([query], normalize_embeddings=True)[0].tolist()
-        musts = [
-            qmodels.FieldCondition(key="tenant_id", match=qmodels.MatchValue(value=tenant_id)),
-            qmodels.FieldCondition(key="roles", match=qmodels.MatchAny(any=user_roles)),
-            qmodels.FieldCondition(key="space", match=qmodels.MatchValue(value=space)),
-        ]
+    def _vector_search_space(self, space: str, query: str, top_k: int, tenant_id: str, user_roles: List[str], tags: List[str] | None, qvec: List[float] | None = None) -> List[Dict]:
+        if qvec is None:
+            qvec = self.embedder.encode([query], normalize_embeddings=True)[0].tolist()
+        filters = {"tenant_id": tenant_id, "roles": user_roles, "space": space}
         if tags:
-            musts.append(qmodels.FieldCondition(key="tags", match=qmodels.MatchAny(any=tags)))
-        flt = qmodels.Filter(must=musts)
-        res = self.qdrant.search(
-            collection_name=qdrant_collection_for(space),
-            query_vector=qvec,
-            query_filter=flt,
-            with_payload=True,
-            limit=top_k,
-        )
+            filters["tags"] = tags
+        res = self.vectors.search(qdrant_collection_for(space), qvec, filters, top_k)
         items = []
-        for p in res:
-            payload = p.payload or {}
+        for score, payload in res:
             items.append({
                 "id": payload.get("chunk_id"),
                 "document_id": payload.get("document_id"),
-                "score": float(p.score),
+                "score": float(score),
                 "text": payload.get("text", ""),
                 "source": {
                     "filename": payload.get("filename"),
@@ -72,27 +100,12 @@ class HybridRetriever:
             })
         return items
 
-    def _opensearch_bm25_space(self, space: str, query: str, top_k: int, tenant_id: str, user_roles: List[str], tags: List[str] | None) -> List[Dict]:
-        must = [{"match": {"text": query}}]
-        filt = [
-            {"term": {"tenant_id": tenant_id}},
-            {"terms": {"roles": user_roles}},
-            {"term": {"space": space}},
-        ]
+    def _bm25_space(self, space: str, query: str, top_k: int, tenant_id: str, user_roles: List[str], tags: List[str] | None) -> List[Dict]:
+        filters = {"tenant_id": tenant_id, "roles": user_roles, "space": space}
         if tags:
-            filt.append({"terms": {"tags": tags}})
-        q = {
-            "query": {
-                "bool": {
-                    "must": must,
-                    "filter": filt,
-                }
-            },
-            "size": top_k,
-            "_source": ["document_id", "text", "filename", "chunk_id", "chunk_index", "mime"],
-        }
-        res = self.os.search(index=opensearch_index_for(space), body=q)
-        hits = res.get("hits", {}).get("hits", [])
+            filters["tags"] = tags
+        fields = ["document_id", "text", "filename", "chunk_id", "chunk_index", "mime"]
+        hits = self.lexical.search(opensearch_index_for(space), query, filters, top_k, fields)
         out = []
         for h in hits:
             src = h.get("_source", {})
@@ -110,7 +123,8 @@ class HybridRetriever:
             })
         return out
 
-    def _rrf(self, a: List[Dict], b: List[Dict], k: int = 60) -> List[Dict]:
+    def _rrf(self, a: List[Dict], b: List[Dict], k: int | None = None) -> List[Dict]:
+        k = self.rrf_k if k is None else k
         ranks: Dict[str, float] = {}
         def add(scores: List[Dict]):
             for rank, item in enumerate(scores, start=1):
@@ -135,25 +149,176 @@ class HybridRetriever:
                 result.append(e)
         return result
 
-    def retrieve(self, query: str, tenant_id: str, user_roles: List[str], spaces: List[str] | None = None, tags: List[str] | None = None, top_k: int = 20, per_source_k: int = 50) -> List[Dict]:
-        spaces = [s.lower() for s in (spaces or ["documents"])]
-        all_vec: List[Dict] = []
-        all_bm25: List[Dict] = []
-        for sp in spaces:
+    def _submit_searches(self, query: str, qvec: List[float], budgets: Dict[str, int], tenant_id: str, user_roles: List[str], tags: List[str] | None) -> Tuple[list, list]:
+        def safe(fn, *args, **kwargs) -> List[Dict]:
             try:
-                all_vec.extend(self._qdrant_search_space(sp, query, per_source_k, tenant_id, user_roles, tags))
-            except Exception as e:
+                return fn(*args, **kwargs)
+            except Exception:
                 # continue even if one space not available
-                pass
-            try:
-                all_bm25.extend(self._opensearch_bm25_space(sp, query, per_source_k, tenant_id, user_roles, tags))
-            except Exception as e:
-                pass
+                return []
+
+        searched = [(sp, k) for sp, k in budgets.items() if k > 0]
+        vec_futs = [(sp, self._pool.submit(safe, self._vector_search_space, sp, query, k, tenant_id, user_roles, tags, qvec=qvec)) for sp, k in searched]
+        bm25_futs = [(sp, self._pool.submit(safe, self._bm25_space, sp, query, k, tenant_id, user_roles, tags)) for sp, k in searched]
+        return vec_futs, bm25_futs
+
+    @staticmethod
+    def _collect(futs: Tuple[list, list]) -> Tuple[Dict[str, List[Dict]], Dict[str, List[Dict]]]:
+        return {sp: f.result() for sp, f in futs[0]}, {sp: f.result() for sp, f in futs[1]}
+
+    def _complete_search(self, query: str, qvec: List[float], futs: Tuple[list, list], budgets: Dict[str, int], per_source_k: int, needed: int, tenant_id: str, user_roles: List[str], tags: List[str] | None, trace: Dict) -> Tuple[List[Dict], List[Dict]]:
+        """Collect a first round and, if it came up short of `needed` candidates,
+        re-query the spaces that filled their budget with a larger k.
+        Results keep space order.
+        """
+        vec, bm25 = self._collect(futs)
+        returned = {sp: max(len(vec.get(sp, [])), len(bm25.get(sp, []))) for sp in budgets}
+        n_candidates = len({it["id"] for lst in (*vec.values(), *bm25.values()) for it in lst})
+        more = self.budget.second_round(budgets, returned, per_source_k, n_candidates, needed, tenant_id, user_roles)
+        if more:
+            vec2, bm252 = self._collect(self._submit_searches(query, qvec, more, tenant_id, user_roles, tags))
+            vec.update(vec2)
+            bm25.update(bm252)
+            budgets = {**budgets, **more}
+        trace["budgets"] = budgets
+        trace["budget_rounds"] = 2 if more else 1
+        all_vec = [it for sp in budgets for it in vec.get(sp, [])]
+        all_bm25 = [it for sp in budgets for it in bm25.get(sp, [])]
+        return all_vec, all_bm25
+
+    def _search_spaces(self, query: str, qvec: List[float], spaces: List[str], per_source_k: int, top_k: int, needed: int, tenant_id: str, user_roles: List[str], tags: List[str] | None, trace: Dict) -> Tuple[List[Dict], List[Dict]]:
+        """Run every (space, backend) search concurrently under the per-space budget."""
+        budgets = self.budget.allocate(spaces, per_source_k, top_k, tenant_id, user_roles)
+        futs = self._submit_searches(query, qvec, budgets, tenant_id, user_roles, tags)
+        return self._complete_search(query, qvec, futs, budgets, per_source_k, needed, tenant_id, user_roles, tags, trace)
+
+    def _fuse(self, query: str, all_vec: List[Dict], all_bm25: List[Dict], counts: Dict | None = None) -> List[Dict]:
+        """RRF then consolidation; `counts["fused"]` gets the pre-consolidation size."""
         fused = self._rrf(all_vec, all_bm25)
+        if counts is not None:
+            counts["fused"] = len(fused)
+        if self.consolidate:
+            # one slot per distinct passage: merge chunk runs, fold full-doc records
+            fused = consolidate_candidates(fused, query)
+        return fused
+
+    @staticmethod
+    def _apply_rerank(fused: List[Dict], scores: List[float], top_k: int) -> List[Dict]:
+        # the unreranked tail keeps RRF order behind the reranked head
+        head, tail = fused[: len(scores)], fused[len(scores):]
+        for it, sc in zip(head, scores):
+            it["rerank_score"] = float(sc)
+        head.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
+        return (head + tail)[:top_k]
+
+    def retrieve(self, query: str, tenant_id: str, user_roles: List[str], spaces: List[str] | None = None, tags: List[str] | None = None, top_k: int = 20, per_source_k: int = 50, use_cache: bool = True, rerank_depth: int | None = None, trace: Dict | None = None, qvec: List[float] | None = None) -> List[Dict]:
+        results: List[Dict] = []
+        for _stage, items in self.retrieve_stream(query, tenant_id, user_roles, spaces, tags, top_k, per_source_k, use_cache, rerank_depth, trace, qvec):
+            results = items
+        return results
+
+    def retrieve_stream(self, query: str, tenant_id: str, user_roles: List[str], spaces: List[str] | None = None, tags: List[str] | None = None, top_k: int = 20, per_source_k: int = 50, use_cache: bool = True, rerank_depth: int | None = None, trace: Dict | None = None, qvec: List[float] | None = None) -> Iterator[Tuple[str, List[Dict]]]:
+        """Yield ("provisional", fused) as soon as both backends answered, then
+        ("final", reranked). Cache hits yield only the final ranking. `qvec` is
+        the normalized query embedding when the caller already has it; results
+        computed from a caller's vector are not written to the result cache or
+        the query-vector memo, both of which are keyed by the query text only.
+        """
+        spaces = [s.lower() for s in (spaces or ["documents"])]
+        rerank_depth = max(top_k * 3, 50) if rerank_depth is None else rerank_depth
+        trace = trace if trace is not None else {}
+        cache_key = None
+        if use_cache:
+            cache_key = self.cache.make_key(query, tenant_id, user_roles, spaces, tags, top_k, per_source_k=per_source_k, rerank_depth=rerank_depth)
+            cached = self.cache.get(cache_key, spaces)
+            trace["cache"] = "hit" if cached is not None else "miss"
+            if cached is not None:
+                yield "final", cached
+                return
+            # snapshot before searching so ingestion racing with us invalidates the entry
+            gens = self.cache.generations.snapshot(spaces)
+        t0 = time.perf_counter()
+        supplied = qvec is not None
+        if not supplied:
+            qvec = self._query_vector(query)
+        t1 = time.perf_counter()
+        all_vec, all_bm25 = self._search_spaces(query, qvec, spaces, per_source_k, top_k, max(top_k, rerank_depth), tenant_id, user_roles, tags, trace)
+        t2 = time.perf_counter()
+        counts: Dict = {}
+        fused = self._fuse(query, all_vec, all_bm25, counts)
+        n_fused = counts["fused"]
+        t3 = time.perf_counter()
+        trace["fuse_ms"] = round((t3 - t2) * 1000.0, 2)
+        yield "provisional", [it.copy() for it in fused[:top_k]]
+        t3 = time.perf_counter()
         # Rerank top candidates using cross-encoder
-        pairs = [(query, it["text"]) for it in fused[: max(top_k * 3, 50)]]
+        pairs = [(query, it["text"]) for it in fused[:rerank_depth]]
         scores = self.reranker.predict(pairs).tolist() if pairs else []
-        for it, sc in zip(fused, scores):
-            it["rerank_score"] = float(sc)
-        fused.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
-        return fused[:top_k]
+        results = self._apply_rerank(fused, scores, top_k)
+        t4 = time.perf_counter()
+
+        trace.update({
+            "embed_ms": round((t1 - t0) * 1000.0, 2),
+            "search_ms": round((t2 - t1) * 1000.0, 2),
+            "rerank_ms": round((t4 - t3) * 1000.0, 2),
+            "candidates": {"vector": len(all_vec), "bm25": len(all_bm25), "fused": n_fused, "consolidated": len(fused), "reranked": len(pairs)},
+        })
+        self.planner.observe("embed_ms", (t1 - t0) * 1000.0)
+        searched = {sp: k for sp, k in trace["budgets"].items() if k > 0}
+        if searched:
+            avg_k = sum(searched.values()) / len(searched)
+            per_space = (t2 - t1) * 1000.0 / len(searched) - 2 * avg_k * self.planner.costs["search_ms_per_hit"]
+            self.planner.observe("search_ms_per_space", max(0.1, per_space))
+        self.budget.observe(list(searched), results)
+        if pairs:
+            self.planner.observe("rerank_ms_per_pair", (t4 - t3) * 1000.0 / len(pairs))
+        if cache_key is not None and not supplied:
+            self.cache.put(cache_key, spaces, results, gens)
+        yield "final", results
+
+    def retrieve_batch(self, requests: List[Dict]) -> List[List[Dict]]:
+        """Retrieve for many queries at once, each with its own ACL scope.
+
+        Misses are embedded in one encode call, all (query, space, backend)
+        searches share the thread pool, and every rerank pair goes through a
+        single cross-encoder predict. Results are returned in request order.
+        """
+        out: List[List[Dict] | None] = [None] * len(requests)
+        pending = []
+        for i, req in enumerate(requests):
+            spaces = [s.lower() for s in (req.get("spaces") or ["documents"])]
+            top_k = int(req.get("top_k", 20))
+            per_source_k = int(req.get("per_source_k", 50))
+            rerank_depth = req.get("rerank_depth")
+            rerank_depth = max(top_k * 3, 50) if rerank_depth is None else int(rerank_depth)
+            job = {**req, "spaces": spaces, "top_k": top_k, "per_source_k": per_source_k, "rerank_depth": rerank_depth, "index": i, "key": None}
+            if req.get("use_cache", True):
+                job["key"] = self.cache.make_key(req["query"], req["tenant_id"], req["user_roles"], spaces, req.get("tags"), top_k, per_source_k=per_source_k, rerank_depth=rerank_depth)
+                cached = self.cache.get(job["key"], spaces)
+                if cached is not None:
+                    out[i] = cached
+                    continue
+                job["gens"] = self.cache.generations.snapshot(spaces)
+            pending.append(job)
+
+        if pending:
+            qvecs = self.embedder.encode([j["query"] for j in pending], normalize_embeddings=True, batch_size=int(_env("EMBED_BATCH_SIZE", "32"))).tolist()
+            for j in pending:
+                j["budgets"] = self.budget.allocate(j["spaces"], j["per_source_k"], j["top_k"], j["tenant_id"], j["user_roles"])
+            futs = [self._submit_searches(j["query"], qv, j["budgets"], j["tenant_id"], j["user_roles"], j.get("tags")) for j, qv in zip(pending, qvecs)]
+            pairs: List[Tuple[str, str]] = []
+            for j, qv, f in zip(pending, qvecs, futs):
+                needed = max(j["top_k"], j["rerank_depth"])
+                all_vec, all_bm25 = self._complete_search(j["query"], qv, f, j["budgets"], j["per_source_k"], needed, j["tenant_id"], j["user_roles"], j.get("tags"), {})
+                j["fused"] = self._fuse(j["query"], all_vec, all_bm25)
+                j["pair_range"] = (len(pairs), len(pairs) + min(j["rerank_depth"], len(j["fused"])))
+                pairs.extend((j["query"], it["text"]) for it in j["fused"][: j["rerank_depth"]])
+            scores = self.reranker.predict(pairs, batch_size=int(_env("RERANK_BATCH_SIZE", "32"))).tolist() if pairs else []
+            for j in pending:
+                lo, hi = j["pair_range"]
+                results = self._apply_rerank(j["fused"], scores[lo:hi], j["top_k"])
+                self.budget.observe([sp for sp, k in j["budgets"].items() if k > 0], results)
+                if j["key"] is not None:
+                    self.cache.put(j["key"], j["spaces"], results, j["gens"])
+                out[j["index"]] = results
+        return [r or [] for r in out]
@@ -0,0 +1,139 @@
+import os
+import re
+import time
+import threading
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+# free text -> canonical skill when cosine similarity is at least this
+SKILL_MATCH_THRESHOLD = float(_env("SKILL_MATCH_THRESHOLD", "0.8"))
+# skill -> related skills for search expansion
+SKILL_RELATED_THRESHOLD = float(_env("SKILL_RELATED_THRESHOLD", "0.75"))
+SKILL_INDEX_TTL_S = float(_env("SKILL_INDEX_TTL_S", "60"))
+
+_NON_ALNUM = re.compile(r"[^0-9a-z+#]+")
+
+
+def normalize_skill(name: str) -> str:
+    """Alias key: lowercase with separators dropped, so "React.js", "ReactJS"
+    and "react js" collide. Keeps + and # (C++, C#)."""
+    return _NON_ALNUM.sub("", (name or "").lower())
+
+
+class SkillIndex:
+    """Canonical skills with aliases and an in-memory embedding matrix.
+
+    `load_fn()` returns ([(skill_id, name)], [(alias, skill_id)]). Every
+    surface form (canonical name and aliases) is embedded once; vectors are
+    kept per text so a reload only embeds new forms. Free text resolves by
+    exact alias key first, then by nearest neighbour over the forms. Related
+    skills come from per-skill centroids. Reloads happen at most every
+    SKILL_INDEX_TTL_S, or on `invalidate()`.
+    """
+
+    def __init__(self, embedder, load_fn: Callable[[], Tuple[List[Tuple[int, str]], List[Tuple[str, int]]]]):
+        self.embedder = embedder
+        self.load_fn = load_fn
+        self._lock = threading.Lock()
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._loaded_at = 0.0
+        self._sig: tuple | None = None
+        self.names: Dict[int, str] = {}
+        self._alias: Dict[str, int] = {}
+        self._form_ids = np.zeros(0, dtype=np.int64)
+        self._forms = np.zeros((0, 0), dtype=np.float32)
+        self._skill_ids = np.zeros(0, dtype=np.int64)
+        self._centroids = np.zeros((0, 0), dtype=np.float32)
+
+    def invalidate(self) -> None:
+        self._loaded_at = 0.0
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.embedder.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+    def _refresh(self) -> None:
+        if time.time() - self._loaded_at < SKILL_INDEX_TTL_S:
+            return
+        with self._lock:
+            if time.time() - self._loaded_at < SKILL_INDEX_TTL_S:
+                return
+            skills, aliases = self.load_fn()
+            sig = (tuple(skills), tuple(sorted(aliases)))
+            if sig != self._sig:
+                self._rebuild(skills, aliases)
+                self._sig = sig
+            self._loaded_at = time.time()
+
+    def _rebuild(self, skills: List[Tuple[int, str]], aliases: List[Tuple[str, int]]) -> None:
+        names = {int(sid): str(name) for sid, name in skills}
+        alias = {normalize_skill(name): sid for sid, name in names.items()}
+        forms: List[Tuple[str, int]] = [(name, sid) for sid, name in names.items()]
+        for text, sid in aliases:
+            key, sid = normalize_skill(text), int(sid)
+            if sid in names and key not in alias:
+                alias[key] = sid
+                forms.append((str(text), sid))
+        missing = list(dict.fromkeys(t for t, _ in forms if t not in self._vectors))
+        if missing:
+            for text, vec in zip(missing, self._encode(missing)):
+                self._vectors[text] = vec
+        form_ids = np.array([sid for _, sid in forms], dtype=np.int64)
+        mat = np.stack([self._vectors[t] for t, _ in forms]) if forms else np.zeros((0, 0), dtype=np.float32)
+        skill_ids = np.array(sorted(names), dtype=np.int64)
+        if len(skill_ids):
+            # centroid of each skill's forms, re-normalized
+            pos = np.searchsorted(skill_ids, form_ids)
+            cent = np.zeros((len(skill_ids), mat.shape[1]), dtype=np.float32)
+            np.add.at(cent, pos, mat)
+            cent /= np.maximum(np.linalg.norm(cent, axis=1, keepdims=True), 1e-12)
+        else:
+            cent = np.zeros((0, 0), dtype=np.float32)
+        self.names, self._alias = names, alias
+        self._form_ids, self._forms = form_ids, mat
+        self._skill_ids, self._centroids = skill_ids, cent
+
+    def resolve(self, text: str, k: int = 1, threshold: float | None = None) -> List[Tuple[int, float]]:
+        """Canonical (skill_id, similarity) for free text, best first."""
+        self._refresh()
+        threshold = SKILL_MATCH_THRESHOLD if threshold is None else threshold
+        exact = self._alias.get(normalize_skill(text))
+        out: List[Tuple[int, float]] = [(exact, 1.0)] if exact is not None else []
+        if len(out) >= k or not len(self._form_ids):
+            return out[:k]
+        sims = self._forms @ self._encode([text])[0]
+        best: Dict[int, float] = {}
+        for i in np.argsort(-sims):
+            sim = float(sims[i])
+            if sim < threshold:
+                break
+            sid = int(self._form_ids[i])
+            if sid not in best and sid != exact:
+                best[sid] = sim
+                if len(out) + len(best) >= k:
+                    break
+        return out + sorted(best.items(), key=lambda x: -x[1])
+
+    def related(self, skill_id: int, k: int = 5, threshold: float | None = None) -> List[Tuple[int, float]]:
+        """Other canonical skills closest to skill_id, best first."""
+        self._refresh()
+        threshold = SKILL_RELATED_THRESHOLD if threshold is None else threshold
+        pos = int(np.searchsorted(self._skill_ids, skill_id))
+        if pos >= len(self._skill_ids) or int(self._skill_ids[pos]) != skill_id:
+            return []
+        sims = self._centroids @ self._centroids[pos]
+        sims[pos] = -1.0
+        top = np.argsort(-sims)[:k]
+        return [(int(self._skill_ids[i]), float(sims[i])) for i in top if sims[i] >= threshold]
+
+    def info(self) -> Dict:
+        self._refresh()
+        return {"skills": len(self.names), "aliases": len(self._alias), "forms": int(len(self._form_ids)), "loaded_at": self._loaded_at}
@@ -0,0 +1,104 @@
+import os
+import re
+from typing import List, Dict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+SNIPPET_MAX_CHARS = int(_env("SNIPPET_MAX_CHARS", "600"))
+SNIPPET_WINDOW_SENTENCES = int(_env("SNIPPET_WINDOW_SENTENCES", "2"))
+SNIPPET_MAX_WINDOWS = int(_env("SNIPPET_MAX_WINDOWS", "2"))
+# extra windows must score within this margin of the best one
+SNIPPET_WINDOW_MARGIN = float(_env("SNIPPET_WINDOW_MARGIN", "0.1"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n\s*\n|\n(?=\s*[-*•\d])")
+
+
+def split_sentences(text: str, max_chars: int) -> List[str]:
+    """Sentence-ish units; anything longer than max_chars is cut on whitespace."""
+    out: List[str] = []
+    for part in _SENTENCE_END.split(text or ""):
+        part = part.strip()
+        while len(part) > max_chars:
+            cut = part.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            out.append(part[:cut].strip())
+            part = part[cut:].strip()
+        if part:
+            out.append(part)
+    return out
+
+
+def _windows(sentences: List[str], size: int, max_chars: int) -> List[tuple[int, int]]:
+    """(start, end) sentence ranges of up to `size` sentences that fit max_chars."""
+    spans = []
+    for i in range(len(sentences)):
+        end = i + 1
+        length = len(sentences[i])
+        while end < len(sentences) and end - i < size and length + 1 + len(sentences[end]) <= max_chars:
+            length += 1 + len(sentences[end])
+            end += 1
+        spans.append((i, end))
+    return spans
+
+
+def _pick(scores: np.ndarray, spans: List[tuple[int, int]], max_windows: int) -> List[tuple[int, int]]:
+    chosen: List[tuple[int, int]] = []
+    best = float(scores.max())
+    for idx in np.argsort(-scores):
+        if chosen and float(scores[idx]) < best - SNIPPET_WINDOW_MARGIN:
+            break
+        s, e = spans[int(idx)]
+        if any(s < ce and cs < e for cs, ce in chosen):
+            continue
+        chosen.append((s, e))
+        if len(chosen) >= max_windows:
+            break
+    return sorted(chosen)
+
+
+def add_snippets(embedder, query: str, items: List[Dict], qvec: List[float] | None = None, max_chars: int | None = None, max_windows: int | None = None, window_sentences: int | None = None, batch_size: int = 64) -> List[Dict]:
+    """Set `snippet` on each item: its best-matching sentence windows for `query`.
+
+    Every window of every item (and the query, unless `qvec` is given) goes
+    through the embedder in one batched encode. Items that already fit in
+    max_chars are returned whole. Windows are kept in document order and
+    joined with " … ". Mutates and returns `items`.
+    """
+    max_chars = max_chars or SNIPPET_MAX_CHARS
+    max_windows = max(1, max_windows or SNIPPET_MAX_WINDOWS)
+    size = max(1, window_sentences or SNIPPET_WINDOW_SENTENCES)
+    per_window = max(80, max_chars // max_windows)
+    jobs = []
+    texts: List[str] = []
+    for it in items:
+        text = it.get("text", "") or ""
+        if len(text) <= max_chars:
+            it["snippet"] = text
+            continue
+        sentences = split_sentences(text, per_window)
+        spans = _windows(sentences, size, per_window)
+        if len(spans) <= 1:
+            it["snippet"] = text[:max_chars]
+            continue
+        jobs.append((it, sentences, spans, len(texts)))
+        texts.extend(" ".join(sentences[s:e]) for s, e in spans)
+    if not jobs:
+        return items
+    if qvec is None:
+        texts.append(query)
+    vecs = embedder.encode(texts, normalize_embeddings=True, batch_size=batch_size)
+    q = np.asarray(qvec, dtype=np.float32) if qvec is not None else vecs[-1]
+    for it, sentences, spans, off in jobs:
+        scores = vecs[off : off + len(spans)] @ q
+        picked = _pick(scores, spans, max_windows)
+        it["snippet"] = " … ".join(" ".join(sentences[s:e]) for s, e in picked)[: max_chars]
+        it["snippet_score"] = float(scores.max())
+    return items
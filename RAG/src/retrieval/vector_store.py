@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import threading
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import hnswlib
+except Exception:  # optional; large embedded collections fall back to brute force
+    hnswlib = None  # type: ignore
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+# A filter maps a payload field to a value (must equal) or a list (must share
+# at least one element), e.g. {"tenant_id": "t1", "roles": ["hr", "employee"]}.
+Filters = Dict[str, Any]
+
+
+class VectorStore:
+    """Interface shared by IndexCoordinator (writes) and HybridRetriever (reads)."""
+
+    def wait_ready(self) -> None:
+        pass
+
+    def ensure_collection(self, name: str, dim: int) -> None:
+        raise NotImplementedError
+
+    def upsert(self, name: str, points: List[Tuple[str, List[float], Dict]]) -> None:
+        raise NotImplementedError
+
+    def search(self, name: str, vector: List[float], filters: Filters, limit: int) -> List[Tuple[float, Dict]]:
+        raise NotImplementedError
+
+    def count(self, name: str, filters: Filters | None = None) -> int:
+        raise NotImplementedError
+
+    def scroll(self, name: str, filters: Filters | None = None, limit: int = 10) -> List[Tuple[str, Dict]]:
+        raise NotImplementedError
+
+
+class QdrantVectorStore(VectorStore):
+    def __init__(self) -> None:
+        from qdrant_client import QdrantClient
+
+        self.client = QdrantClient(url=_env("QDRANT_URL", "http://localhost:6333"), timeout=int(_env("QDRANT_TIMEOUT", "10")))
+
+    @staticmethod
+    def _filter(filters: Filters | None):
+        from qdrant_client.http import models as qmodels
+
+        if not filters:
+            return None
+        musts = []
+        for key, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                musts.append(qmodels.FieldCondition(key=key, match=qmodels.MatchAny(any=list(value))))
+            else:
+                musts.append(qmodels.FieldCondition(key=key, match=qmodels.MatchValue(value=value)))
+        return qmodels.Filter(must=musts)
+
+    def wait_ready(self) -> None:
+        # Wait for Qdrant to be ready
+        q_attempts = 15
+        for i in range(q_attempts):
+            try:
+                # lightweight call to check readiness
+                _ = self.client.get_collections()
+                break
+            except Exception:
+                if i == q_attempts - 1:
+                    raise
+                time.sleep(2)
+
+    def ensure_collection(self, name: str, dim: int) -> None:
+        from qdrant_client.http import models as qmodels
+
+        try:
+            self.client.get_collection(name)
+        except Exception:
+            r_attempts = 10
+            last_err = None
+            for _ in range(r_attempts):
+                try:
+                    self.client.recreate_collection(
+                        collection_name=name,
+                        vectors_config=qmodels.VectorParams(size=dim, distance=qmodels.Distance.COSINE),
+                    )
+                    last_err = None
+                    break
+                except Exception as e:
+                    last_err = e
+                    time.sleep(2)
+            if last_err:
+                raise last_err
+
+    def upsert(self, name: str, points: List[Tuple[str, List[float], Dict]]) -> None:
+        from qdrant_client.http import models as qmodels
+
+        self.client.upsert(
+            collection_name=name,
+            points=[qmodels.PointStruct(id=pid, vector=vec, payload=payload) for pid, vec, payload in points],
+        )
+
+    def search(self, name: str, vector: List[float], filters: Filters, limit: int) -> List[Tuple[float, Dict]]:
+        res = self.client.search(
+            collection_name=name,
+            query_vector=vector,
+            query_filter=self._filter(filters),
+            with_payload=True,
+            limit=limit,
+        )
+        return [(float(p.score), p.payload or {}) for p in res]
+
+    def count(self, name: str, filters: Filters | None = None) -> int:
+        res = self.client.count(collection_name=name, count_filter=self._filter(filters), exact=True)
+        return int(res.count) if hasattr(res, "count") else 0
+
+    def scroll(self, name: str, filters: Filters | None = None, limit: int = 10) -> List[Tuple[str, Dict]]:
+        # res: (points, next_page_offset)
+        res = self.client.scroll(collection_name=name, scroll_filter=self._filter(filters), limit=limit, with_payload=True)
+        return [(str(p.id), p.payload or {}) for p in res[0]]
+
+
+class _EmbeddedCollection:
+    """One collection on disk: vectors.f32 (row-major float32, memory-mapped),
+    points.jsonl (id and payload per line, in row order) and, for large collections, an
+    HNSW graph in hnsw.bin. Re-upserting an id appends a new row and masks the old one.
+    """
+
+    def __init__(self, path: str, dim: int) -> None:
+        self.path = path
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.ids: List[str] = []
+        self.payloads: List[Dict] = []
+        self._alive = bytearray()
+        self.row_of: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[Any, List[int]]] = {}
+        self._posting_arrays: Dict[Tuple[str, Any], np.ndarray] = {}
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        self.hnsw = None
+        self._unsaved = 0
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def _vec_file(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    def _load(self) -> None:
+        meta = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta):
+            with open(meta, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim}, f)
+        else:
+            with open(meta, "r", encoding="utf-8") as f:
+                self.dim = int(json.load(f)["dim"])
+        points = os.path.join(self.path, "points.jsonl")
+        if os.path.exists(points):
+            with open(points, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        self._register(rec["id"], rec["payload"])
+        # drop vector rows written by an upsert that crashed before its points were recorded
+        expected = len(self.ids) * self.dim * 4
+        if os.path.exists(self._vec_file) and os.path.getsize(self._vec_file) > expected:
+            with open(self._vec_file, "r+b") as f:
+                f.truncate(expected)
+        self._remap()
+        hnsw_file = os.path.join(self.path, "hnsw.bin")
+        if hnswlib is not None and os.path.exists(hnsw_file):
+            try:
+                index = hnswlib.Index(space="ip", dim=self.dim)
+                index.load_index(hnsw_file, max_elements=max(len(self.ids), 1))
+                if index.get_current_count() == len(self.ids):
+                    index.set_ef(int(_env("VECTOR_HNSW_EF", "128")))
+                    self.hnsw = index
+            except Exception as e:
+                print(f"[VectorStore][WARN] HNSW index at {hnsw_file} unusable, will rebuild: {e}")
+        self._maybe_build_hnsw()
+
+    def _remap(self) -> None:
+        n = len(self.ids)
+        if n and os.path.exists(self._vec_file):
+            self.matrix = np.memmap(self._vec_file, dtype=np.float32, mode="r", shape=(n, self.dim))
+        else:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+
+    def _register(self, pid: str, payload: Dict) -> int:
+        row = len(self.ids)
+        prev = self.row_of.get(pid)
+        self.ids.append(pid)
+        self.payloads.append(payload)
+        self._alive.append(1)
+        if prev is not None:
+            self._alive[prev] = 0
+        self.row_of[pid] = row
+        for key, value in payload.items():
+            if key == "text" or value is None:
+                continue
+            values = value if isinstance(value, list) else [value]
+            for v in values:
+                if isinstance(v, (str, int, bool)):
+                    self.postings.setdefault(key, {}).setdefault(v, []).append(row)
+                    self._posting_arrays.pop((key, v), None)
+        return row
+
+    def upsert(self, points: List[Tuple[str, List[float], Dict]]) -> None:
+        if not points:
+            return
+        vecs = np.asarray([p[1] for p in points], dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = vecs / np.maximum(norms, 1e-12)
+        with self.lock:
+            start = len(self.ids)
+            with open(self._vec_file, "ab") as f:
+                f.write(vecs.tobytes())
+            with open(os.path.join(self.path, "points.jsonl"), "a", encoding="utf-8") as f:
+                for pid, _vec, payload in points:
+                    f.write(json.dumps({"id": str(pid), "payload": payload}) + "\n")
+                    self._register(str(pid), payload)
+            self._remap()
+            if self.hnsw is not None:
+                self.hnsw.resize_index(len(self.ids))
+                self.hnsw.add_items(vecs, np.arange(start, len(self.ids)))
+                self._unsaved += len(points)
+                if self._unsaved >= int(_env("VECTOR_HNSW_SAVE_EVERY", "1000")):
+                    self.flush()
+            else:
+                self._maybe_build_hnsw()
+
+    def _maybe_build_hnsw(self) -> None:
+        if hnswlib is None or self.hnsw is not None:
+            return
+        n = len(self.ids)
+        if n < int(_env("VECTOR_HNSW_THRESHOLD", "20000")):
+            return
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=n, ef_construction=int(_env("VECTOR_HNSW_EF_CONSTRUCTION", "200")), M=int(_env("VECTOR_HNSW_M", "16")))
+        index.add_items(np.asarray(self.matrix), np.arange(n))
+        index.set_ef(int(_env("VECTOR_HNSW_EF", "128")))
+        self.hnsw = index
+        self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.hnsw is not None:
+                self.hnsw.save_index(os.path.join(self.path, "hnsw.bin"))
+            self._unsaved = 0
+
+    def _rows_for(self, key: str, value: Any) -> np.ndarray:
+        arr = self._posting_arrays.get((key, value))
+        if arr is None:
+            arr = np.asarray(self.postings.get(key, {}).get(value, []), dtype=np.int64)
+            self._posting_arrays[(key, value)] = arr
+        return arr
+
+    def mask(self, filters: Filters | None) -> np.ndarray:
+        mask = np.frombuffer(bytes(self._alive), dtype=bool).copy()
+        for key, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            for v in values:
+                allowed[self._rows_for(key, v)] = True
+            mask &= allowed
+        return mask
+
+    def search(self, vector: List[float], filters: Filters, limit: int) -> List[Tuple[float, Dict]]:
+        q = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            mask = self.mask(filters)
+            rows = np.flatnonzero(mask)
+            if rows.size == 0 or limit <= 0:
+                return []
+            # selective filters are faster (and exact) by brute force over the allowed rows
+            if self.hnsw is not None and rows.size > int(_env("VECTOR_BRUTE_FORCE_MAX", "5000")):
+                try:
+                    labels, dists = self.hnsw.knn_query(q, k=min(limit, rows.size), filter=lambda label: bool(mask[label]))
+                    return [(float(1.0 - d), self.payloads[int(r)]) for r, d in zip(labels[0], dists[0])]
+                except RuntimeError:
+                    # hnswlib raises when the filtered graph walk can't fill k; brute force is exact
+                    pass
+            scores = np.asarray(self.matrix[rows]) @ q
+            k = min(limit, rows.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.payloads[int(rows[i])]) for i in top]
+
+
+class EmbeddedVectorStore(VectorStore):
+    """In-process vector index for single-node installs (no Qdrant server).
+    Brute-force NumPy search over a memory-mapped matrix for small collections,
+    HNSW (hnswlib) above VECTOR_HNSW_THRESHOLD points; same payload filters.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or _env("VECTOR_STORE_PATH", "./data/vectors")
+        os.makedirs(self.path, exist_ok=True)
+        self._collections: Dict[str, _EmbeddedCollection] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, dim: int | None = None) -> _EmbeddedCollection | None:
+        with self._lock:
+            col = self._collections.get(name)
+            if col is None:
+                cpath = os.path.join(self.path, name)
+                if dim is None and not os.path.exists(os.path.join(cpath, "meta.json")):
+                    return None
+                col = _EmbeddedCollection(cpath, dim or 0)
+                self._collections[name] = col
+            return col
+
+    def ensure_collection(self, name: str, dim: int) -> None:
+        self._get(name, dim)
+
+    def upsert(self, name: str, points: List[Tuple[str, List[float], Dict]]) -> None:
+        col = self._get(name)
+        if col is None:
+            raise KeyError(f"collection {name} does not exist")
+        col.upsert(points)
+
+    def search(self, name: str, vector: List[float], filters: Filters, limit: int) -> List[Tuple[float, Dict]]:
+        col = self._get(name)
+        if col is None:
+            raise KeyError(f"collection {name} does not exist")
+        return col.search(vector, filters, limit)
+
+    def count(self, name: str, filters: Filters | None = None) -> int:
+        col = self._get(name)
+        if col is None:
+            return 0
+        with col.lock:
+            return int(col.mask(filters).sum())
+
+    def scroll(self, name: str, filters: Filters | None = None, limit: int = 10) -> List[Tuple[str, Dict]]:
+        col = self._get(name)
+        if col is None:
+            return []
+        with col.lock:
+            rows = np.flatnonzero(col.mask(filters))[:limit]
+            return [(col.ids[int(r)], col.payloads[int(r)]) for r in rows]
+
+    def flush(self) -> None:
+        for col in list(self._collections.values()):
+            col.flush()
+
+
+class VectorStoreSingleton:
+    _store = None
+
+    @classmethod
+    def get(cls) -> VectorStore:
+        if cls._store is None:
+            backend = _env("VECTOR_BACKEND", "qdrant").lower()
+            print(f"[VectorStore] Using backend: {backend}")
+            cls._store = EmbeddedVectorStore() if backend == "embedded" else QdrantVectorStore()
+        return cls._store
@@ -0,0 +1,107 @@
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+# Each requirement keeps only its best (count + alternatives) x this many
+# eligible candidates before the matching; the rest can't change the optimum
+# unless more than that many candidates are contested between roles.
+PREFILTER_FACTOR = int(_env("TEAM_PREFILTER_FACTOR", "4"))
+MAX_ALLOCATION_PERCENT = int(_env("TEAM_MAX_ALLOCATION_PERCENT", "100"))
+_INELIGIBLE = -1e9
+
+
+def requirement_scores(prof: np.ndarray, skill_names: List[str], requirements: List[Dict]) -> np.ndarray:
+    """Employees x requirements score matrix: the share of each requirement's
+    skills met at min_level, x100. `prof` is employees x skill_names."""
+    col_of = {name: j for j, name in enumerate(skill_names)}
+    scores = np.zeros((prof.shape[0], len(requirements)), dtype=np.float32)
+    for r, req in enumerate(requirements):
+        reqs = req.get("skills") or []
+        if not reqs:
+            continue
+        cols = np.array([col_of[str(s.get("name"))] for s in reqs], dtype=np.intp)
+        mins = np.array([int(s.get("min_level", 0)) for s in reqs], dtype=np.int16)
+        scores[:, r] = (prof[:, cols] >= mins).sum(axis=1) * (100.0 / len(reqs))
+    return scores
+
+
+def solve(scores: np.ndarray, requirements: List[Dict], allocated: np.ndarray, alternatives: int = 3, max_allocation: int | None = None) -> Dict:
+    """Fill role slots as a maximum-weight bipartite matching.
+
+    Each requirement contributes `count` slots (default 1) needing
+    `allocation_percent` (default 100) of a person. A candidate is eligible
+    for a requirement if they meet at least one of its skills (any candidate
+    for a requirement without skills) and their current allocation plus the
+    slot's stays within max_allocation. Every candidate fills at most one
+    slot. The matching maximizes the number of filled slots first, then the
+    total score.
+
+    Returns assignments [{candidate, requirement, slot, score}] (candidate is a
+    row index into `scores`), unfilled [{requirement, missing}], and per
+    requirement the next best unassigned eligible candidates as alternatives.
+    """
+    t0 = time.perf_counter()
+    max_allocation = MAX_ALLOCATION_PERCENT if max_allocation is None else max_allocation
+    n, n_req = scores.shape
+    counts = np.array([max(0, int(req.get("count", 1) or 0)) for req in requirements], dtype=np.int64)
+    need = np.array([int(req.get("allocation_percent", 100) or 0) for req in requirements], dtype=np.int64)
+    has_skills = np.array([bool(req.get("skills")) for req in requirements], dtype=bool)
+
+    eligible = (scores > 0) | ~has_skills[None, :]
+    eligible &= (allocated.astype(np.int64)[:, None] + need[None, :]) <= max_allocation
+    masked = np.where(eligible, scores, _INELIGIBLE)
+
+    # Prefilter to the candidates that can matter for each requirement
+    keep = set()
+    for r in range(n_req):
+        k = min(n, int(counts[r] + alternatives) * PREFILTER_FACTOR)
+        if k <= 0:
+            continue
+        col = masked[:, r]
+        top = np.argpartition(-col, k - 1)[:k] if k < n else np.arange(n)
+        keep.update(int(i) for i in top if col[i] > _INELIGIBLE)
+    sub = np.array(sorted(keep), dtype=np.intp)
+
+    slot_req = np.repeat(np.arange(n_req), counts)
+    assignments: List[Dict] = []
+    if sub.size and slot_req.size:
+        weights = masked[sub][:, slot_req]
+        rows, cols = linear_sum_assignment(weights, maximize=True)
+        slot_no = {}
+        for i, j in sorted(zip(rows.tolist(), cols.tolist()), key=lambda x: x[1]):
+            if weights[i, j] <= _INELIGIBLE:
+                continue
+            r = int(slot_req[j])
+            slot_no[r] = slot_no.get(r, 0) + 1
+            assignments.append({"candidate": int(sub[i]), "requirement": r, "slot": slot_no[r], "score": float(scores[sub[i], r])})
+        assignments.sort(key=lambda a: (a["requirement"], -a["score"]))
+
+    filled = np.bincount([a["requirement"] for a in assignments], minlength=n_req) if assignments else np.zeros(n_req, dtype=np.int64)
+    unfilled = [{"requirement": r, "missing": int(counts[r] - filled[r])} for r in range(n_req) if counts[r] > filled[r]]
+
+    taken = {a["candidate"] for a in assignments}
+    alts: Dict[int, List[Dict]] = {}
+    for r in range(n_req):
+        order = sub[np.argsort(-masked[sub, r], kind="stable")] if sub.size else sub
+        alts[r] = [
+            {"candidate": int(i), "score": float(scores[i, r])}
+            for i in order
+            if int(i) not in taken and masked[i, r] > _INELIGIBLE
+        ][:alternatives]
+    return {
+        "assignments": assignments,
+        "unfilled": unfilled,
+        "alternatives": alts,
+        "solve_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+    }
@@ -0,0 +1,75 @@
+import os
+import threading
+from typing import Dict
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+# Pooled sync clients per outbound destination (httpx.Client is thread-safe),
+# shared by every request handler instead of a new connection per call.
+DESTINATIONS: Dict[str, Dict[str, float]] = {
+    "llm": {
+        "timeout": float(_env("LLM_TIMEOUT_S", "30")),
+        "connect": float(_env("LLM_CONNECT_TIMEOUT_S", "3")),
+        "max_connections": int(_env("LLM_MAX_CONNECTIONS", "20")),
+    },
+    "chat": {
+        "timeout": float(_env("CHAT_API_TIMEOUT_S", "10")),
+        "connect": float(_env("CHAT_API_CONNECT_TIMEOUT_S", "3")),
+        "max_connections": int(_env("CHAT_API_MAX_CONNECTIONS", "10")),
+    },
+}
+
+_clients: Dict[str, httpx.Client] = {}
+_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    if _env("HTTP2_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return False
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except Exception:
+        print("[HTTP][WARN] HTTP2_ENABLED but the h2 package is missing; using HTTP/1.1")
+        return False
+
+
+def http_client(name: str) -> httpx.Client:
+    with _lock:
+        client = _clients.get(name)
+        if client is None or client.is_closed:
+            cfg = DESTINATIONS.get(name, DESTINATIONS["llm"])
+            client = httpx.Client(
+                timeout=httpx.Timeout(cfg["timeout"], connect=cfg["connect"]),
+                limits=httpx.Limits(
+                    max_connections=int(cfg["max_connections"]),
+                    max_keepalive_connections=min(int(_env("HTTP_MAX_KEEPALIVE", "20")), int(cfg["max_connections"])),
+                    keepalive_expiry=float(_env("HTTP_KEEPALIVE_EXPIRY_S", "60")),
+                ),
+                http2=_http2_available(),
+            )
+            _clients[name] = client
+        return client
+
+
+def open_clients() -> None:
+    for name in DESTINATIONS:
+        http_client(name)
+
+
+def close_clients() -> None:
+    with _lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Dict, Any
+
+import httpx
+from dotenv import load_dotenv
+
+from src.utils.http import http_client
+
+load_dotenv()
+
+
+def _env(name: str, default: str | None = None) -> str:
+    return os.getenv(name, default) or (default or "")
+
+
+class LLMGateway:
+    """Single entry point for llama.cpp chat completions from the RAG app.
+
+    - Concurrency: at most LLM_SLOTS requests in flight (match the server's
+      --parallel). "batch" callers (onboarding, skills, ranking) are further
+      capped at LLM_BATCH_SLOTS so interactive calls always find a free slot.
+    - Coalescing: identical requests already in flight share one upstream call.
+    - Prompt reuse: sends cache_prompt, and with LLM_PIN_SLOTS pins each system
+      prompt to one slot (id_slot) so its KV cache is reused across calls.
+    - Retries: connection failures, 429 and 5xx retried LLM_RETRIES times with
+      exponential backoff and full jitter; read timeouts are not retried.
+    - Metrics: per-call-name counts, latency percentiles and token usage.
+    """
+
+    def __init__(self) -> None:
+        self.url = _env("LLM_URL", "http://127.0.0.1:8080").rstrip("/")
+        self.model = _env("LLM_MODEL", "local-llm")
+        self.slots = max(1, int(_env("LLM_SLOTS", "4")))
+        batch_slots = int(_env("LLM_BATCH_SLOTS", str(max(1, self.slots - 1))))
+        self._total = threading.BoundedSemaphore(self.slots)
+        self._limits = {
+            "interactive": threading.BoundedSemaphore(self.slots),
+            "batch": threading.BoundedSemaphore(max(1, min(batch_slots, self.slots))),
+        }
+        self.retries = int(_env("LLM_RETRIES", "2"))
+        self.backoff_s = float(_env("LLM_BACKOFF_S", "0.5"))
+        self.cache_prompt = _env("LLM_CACHE_PROMPT", "true").lower() in ("1", "true", "yes")
+        self.pin_slots = _env("LLM_PIN_SLOTS", "false").lower() in ("1", "true", "yes")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+
+    # ---------------- metrics ----------------
+    def _m(self, name: str) -> Dict[str, Any]:
+        m = self._metrics.get(name)
+        if m is None:
+            m = {"calls": 0, "errors": 0, "coalesced": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": deque(maxlen=500)}
+            self._metrics[name] = m
+        return m
+
+    def _record(self, name: str, **inc: float) -> None:
+        with self._lock:
+            m = self._m(name)
+            for k, v in inc.items():
+                if k == "latency_ms":
+                    m["latency_ms"].append(v)
+                else:
+                    m[k] += v
+
+    def metrics(self) -> Dict[str, Any]:
+        out = {}
+        with self._lock:
+            for name, m in self._metrics.items():
+                lat = sorted(m["latency_ms"])
+                pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else 0.0
+                out[name] = {**{k: v for k, v in m.items() if k != "latency_ms"}, "p50_ms": pct(0.5), "p95_ms": pct(0.95)}
+        return {"slots": self.slots, "inflight": len(self._inflight), "calls": out}
+
+    # ---------------- calls ----------------
+    def _body(self, messages: List[Dict], temperature: float, max_tokens: int | None, extra: Dict | None) -> Dict:
+        body: Dict[str, Any] = {"model": self.model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            body["max_tokens"] = max_tokens
+        if self.cache_prompt:
+            body["cache_prompt"] = True
+        if self.pin_slots:
+            system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+            body["id_slot"] = int(hashlib.sha1(system.encode("utf-8")).hexdigest(), 16) % self.slots
+        body.update(extra or {})
+        return body
+
+    def _post(self, body: Dict, timeout: float | None, name: str) -> Dict:
+        attempt = 0
+        while True:
+            try:
+                kwargs = {"timeout": timeout} if timeout else {}
+                resp = http_client("llm").post(f"{self.url}/v1/chat/completions", json=body, **kwargs)
+                resp.raise_for_status()
+                return resp.json()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                # connect-phase failures only: a read timeout means a slot is
+                # busy with this request, and resending it would add to the load
+                retryable = (
+                    isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                    or (isinstance(e, httpx.HTTPStatusError) and (e.response.status_code == 429 or e.response.status_code >= 500))
+                )
+                if not retryable or attempt >= self.retries:
+                    raise
+                attempt += 1
+                self._record(name, retries=1)
+                time.sleep(random.uniform(0, self.backoff_s * (2 ** attempt)))
+
+    def chat(self, messages: List[Dict], temperature: float = 0.1, max_tokens: int | None = None, priority: str = "interactive", timeout: float | None = None, name: str = "chat", extra: Dict | None = None) -> str:
+        """Return the completion text; raises after retries are exhausted."""
+        body = self._body(messages, temperature, max_tokens, extra)
+        key = hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self._inflight[key] = fut
+        if not owner:
+            self._record(name, coalesced=1)
+            return fut.result()
+        limit = self._limits.get(priority, self._limits["batch"])
+        t0 = time.perf_counter()
+        try:
+            with limit, self._total:
+                data = self._post(body, timeout, name)
+            content = data.get("choices", [{}])[0].get("message", {}).get("content", "") or ""
+            usage = data.get("usage") or {}
+            self._record(
+                name,
+                calls=1,
+                prompt_tokens=int(usage.get("prompt_tokens", 0) or 0),
+                completion_tokens=int(usage.get("completion_tokens", 0) or 0),
+                latency_ms=(time.perf_counter() - t0) * 1000.0,
+            )
+            fut.set_result(content)
+            return content
+        except Exception as e:
+            self._record(name, calls=1, errors=1, latency_ms=(time.perf_counter() - t0) * 1000.0)
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+class LLMGatewaySingleton:
+    _gateway = None
+
+    @classmethod
+    def get(cls) -> LLMGateway:
+        if cls._gateway is None:
+            cls._gateway = LLMGateway()
+        return cls._gateway
@@ -0,0 +1,47 @@
+import os
+import gzip
+import json
+from typing import Any
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson  # optional, much faster than json for large result lists
+except Exception:  # pragma: no cover
+    orjson = None
+
+try:
+    import zstandard  # optional
+except Exception:  # pragma: no cover
+    zstandard = None
+
+
+COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("RESPONSE_ZSTD_LEVEL", "3"))
+
+_zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard is not None else None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+def encoded_response(request: Request, obj: Any, status_code: int = 200) -> Response:
+    """JSON response compressed with zstd or gzip when the client accepts it.
+    Bodies under RESPONSE_COMPRESS_MIN_BYTES go out as-is.
+    """
+    body = dumps(obj)
+    headers = {"Vary": "Accept-Encoding"}
+    accepted = {p.split(";")[0].strip().lower() for p in request.headers.get("accept-encoding", "").split(",")}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        if _zstd is not None and "zstd" in accepted:
+            body = _zstd.compress(body)
+            headers["Content-Encoding"] = "zstd"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
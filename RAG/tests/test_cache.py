@@ -0,0 +1,100 @@
+from src.retrieval.cache import QueryResultCache, SpaceGenerations
+
+
+class FakeRedis:
+    """Just the commands the cache uses (get/set/incr), fakeredis-style."""
+
+    def __init__(self) -> None:
+        self.data: dict = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode("utf-8") if isinstance(value, str) else value
+        return True
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+
+ITEMS = [{"id": "c1", "text": "payroll runbook", "score": 1.0}]
+
+
+def _key(roles, **kw):
+    args = {"query": "Payroll  runbook", "tenant_id": "t1", "user_roles": roles, "spaces": ["documents"], "tags": None, "top_k": 5}
+    args.update(kw)
+    return QueryResultCache.make_key(**args)
+
+
+def test_role_sets_never_share_entries():
+    cache = QueryResultCache(max_entries=16, ttl_s=60)
+    cache.put(_key(["hr", "employee"]), ["documents"], ITEMS)
+
+    # same role set in another order and the same normalized query hit
+    assert cache.get(_key(["employee", "hr"], query="payroll runbook"), ["documents"]) == ITEMS
+    # a narrower, wider or different role set is a different key
+    for roles in (["employee"], ["employee", "hr", "finance"], ["finance"]):
+        assert _key(roles) != _key(["hr", "employee"])
+        assert cache.get(_key(roles), ["documents"]) is None
+    # and so is another tenant
+    assert cache.get(_key(["hr", "employee"], tenant_id="t2"), ["documents"]) is None
+
+
+def test_generation_bump_invalidates_only_that_space():
+    gens = SpaceGenerations()
+    cache = QueryResultCache(max_entries=16, ttl_s=60, generations=gens)
+    docs_key = _key(["employee"], spaces=["documents"])
+    mem_key = _key(["employee"], spaces=["memory"])
+    cache.put(docs_key, ["documents"], ITEMS)
+    cache.put(mem_key, ["memory"], ITEMS)
+
+    gens.bump("documents")
+
+    assert cache.get(docs_key, ["documents"]) is None
+    assert cache.get(mem_key, ["memory"]) == ITEMS
+    assert cache.stats["stale"] == 1
+
+
+def test_snapshot_taken_before_retrieval_makes_racing_ingest_stale():
+    cache = QueryResultCache(max_entries=16, ttl_s=60)
+    key = _key(["employee"])
+    before = cache.generations.snapshot(["documents"])
+    cache.generations.bump("documents")  # ingestion lands while the query runs
+    cache.put(key, ["documents"], ITEMS, before)
+    assert cache.get(key, ["documents"]) is None
+
+
+def test_redis_tier_shares_entries_and_generations_across_workers():
+    r = FakeRedis()
+    worker_a = QueryResultCache(redis_client=r, max_entries=16, ttl_s=60, generations=SpaceGenerations(r, refresh_s=0))
+    worker_b = QueryResultCache(redis_client=r, max_entries=16, ttl_s=60, generations=SpaceGenerations(r, refresh_s=0))
+    key = _key(["employee"])
+
+    worker_a.put(key, ["documents"], ITEMS)
+    assert worker_b.get(key, ["documents"]) == ITEMS
+    assert worker_b.stats["remote_hits"] == 1
+
+    # ingestion on worker A invalidates worker B's local copy through the shared counter
+    worker_a.generations.bump("documents")
+    assert worker_b.get(key, ["documents"]) is None
+
+
+def test_redis_failure_falls_back_to_local_tier():
+    class DownRedis:
+        def get(self, key):
+            raise ConnectionError("down")
+
+        def set(self, key, value, ex=None):
+            raise ConnectionError("down")
+
+        def incr(self, key):
+            raise ConnectionError("down")
+
+    cache = QueryResultCache(redis_client=DownRedis(), max_entries=16, ttl_s=60, generations=SpaceGenerations(DownRedis(), refresh_s=0))
+    key = _key(["employee"])
+    cache.put(key, ["documents"], ITEMS)
+    assert cache.get(key, ["documents"]) == ITEMS
+    cache.generations.bump("documents")
+    assert cache.get(key, ["documents"]) is None
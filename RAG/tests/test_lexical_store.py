@@ -0,0 +1,42 @@
+import os
+
+from src.retrieval.lexical_store import EmbeddedLexicalStore
+
+
+def _segment_files(path: str) -> list[str]:
+    return sorted(f for f in os.listdir(path) if f.startswith("seg_"))
+
+
+def test_segments_merge_and_reload(tmp_path, monkeypatch):
+    monkeypatch.setenv("LEXICAL_MAX_SEGMENTS", "2")
+    store = EmbeddedLexicalStore(str(tmp_path))
+    batches = [
+        [{"text": "kubernetes kubernetes cluster upgrade", "tenant_id": "t1", "roles": ["eng"], "document_id": "a"}],
+        [{"text": "kubernetes networking notes", "tenant_id": "t1", "roles": ["ops"], "document_id": "b"}],
+        [{"text": "react frontend guide", "tenant_id": "t2", "roles": ["eng"], "document_id": "c"}],
+        [{"text": "quarterly kubernetes budget review for the platform team", "tenant_id": "t1", "roles": ["eng", "ops"], "document_id": "d"}],
+    ]
+    for docs in batches:
+        store.bulk("idx", docs)
+        store.refresh("idx")
+
+    index_dir = os.path.join(str(tmp_path), "idx")
+    # four sealed segments with a cap of two: at least one merge happened and
+    # the merged-away segment files were removed
+    assert len([f for f in _segment_files(index_dir) if f.endswith(".npz")]) <= 3
+    assert not any(f.endswith(".pkl") for f in os.listdir(index_dir))
+
+    reloaded = EmbeddedLexicalStore(str(tmp_path))
+    assert reloaded.count("idx") == 4
+
+    hits = reloaded.search("idx", "kubernetes", None, 10)
+    ids = [h["_source"]["document_id"] for h in hits]
+    # higher tf in a short doc ranks first; the long doc with one mention ranks last
+    assert ids == ["a", "b", "d"]
+    assert hits[0]["_score"] > hits[1]["_score"] > hits[2]["_score"]
+
+    # keyword filters: scalar term and list (any-of)
+    assert [h["_source"]["document_id"] for h in reloaded.search("idx", "kubernetes", {"tenant_id": "t1", "roles": "ops"}, 10)] == ["b", "d"]
+    assert {h["_source"]["document_id"] for h in reloaded.search("idx", None, {"roles": ["ops", "nobody"]}, 10)} == {"b", "d"}
+    assert reloaded.search("idx", "react", {"tenant_id": "t1"}, 10) == []
+    assert reloaded.count("idx", {"tenant_id": "t2"}) == 1
@@ -13,6 +13,7 @@ from sqlalchemy import select
 from .db import engine, SessionLocal
 from .models import Base, Employee
 from .routers.smart_access import _reconcile_privileges_for_employee
+from . import http_clients
 
 load_dotenv()
 
@@ -39,13 +40,15 @@ app.include_router(smart_router.router, prefix="/smart", tags=["smart_access"])
 def _ensure_migrations():
     try:
         with engine.begin() as conn:
-            # candidates: phone_number, provisioned
+            # candidates: phone_number, provisioned, similarity
             try:
                 cols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info('candidates')").fetchall()}
                 if 'phone_number' not in cols:
                     conn.exec_driver_sql("ALTER TABLE candidates ADD COLUMN phone_number VARCHAR(64)")
                 if 'provisioned' not in cols:
                     conn.exec_driver_sql("ALTER TABLE candidates ADD COLUMN provisioned BOOLEAN NOT NULL DEFAULT 0")
+                if 'similarity' not in cols:
+                    conn.exec_driver_sql("ALTER TABLE candidates ADD COLUMN similarity FLOAT")
             except Exception:
                 pass
             # employees: phone_number
@@ -59,6 +62,16 @@ def _ensure_migrations():
         pass
 
 
+@app.on_event("startup")
+async def on_startup_http_clients():
+    await http_clients.startup()
+
+
+@app.on_event("shutdown")
+async def on_shutdown_http_clients():
+    await http_clients.shutdown()
+
+
 @app.on_event("startup")
 def on_startup():
     try:
@@ -0,0 +1,362 @@
+import os
+import re
+import json
+import time
+import math
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import http_clients
+from .db import SessionLocal
+from .llm_gateway import gateway as llm_gateway
+from .models import Job, Candidate, CandidateScore
+
+
+SCORE_CONCURRENCY = max(1, int(os.getenv("AUTO_FILTER_CONCURRENCY", "4")))
+# resumes packed into one prompt; 1 scores each resume on its own
+SCORE_BATCH_SIZE = max(1, int(os.getenv("AUTO_FILTER_BATCH_SIZE", "4")))
+SCORE_COMMIT_EVERY = max(1, int(os.getenv("AUTO_FILTER_COMMIT_EVERY", "20")))
+RESUME_MAX_CHARS = int(os.getenv("AUTO_FILTER_RESUME_MAX_CHARS", "4000"))
+# Embedding pre-screen: only the most similar resumes reach the LLM
+RAG_API_URL = os.getenv("RAG_API_URL", "http://localhost:8000")
+PRESCREEN_ENABLED = os.getenv("PRESCREEN_ENABLED", "true").lower() in ("1", "true", "yes")
+PRESCREEN_TOP_FRACTION = float(os.getenv("PRESCREEN_TOP_FRACTION", "0.15"))
+PRESCREEN_MIN_KEEP = int(os.getenv("PRESCREEN_MIN_KEEP", "20"))  # smaller pools skip the pre-screen
+PRESCREEN_SIM_FLOOR = float(os.getenv("PRESCREEN_SIM_FLOOR", "0.75"))  # always kept at or above this
+PRESCREEN_EMBED_BATCH = max(1, int(os.getenv("PRESCREEN_EMBED_BATCH", "64")))
+PRESCREEN_RESUME_CHARS = int(os.getenv("PRESCREEN_RESUME_CHARS", "2000"))
+PRESCREEN_CACHE_JOBS = int(os.getenv("PRESCREEN_CACHE_JOBS", "32"))
+# bump when the prompts below change so cached scores stop matching
+SCORING_PROMPT_VERSION = "1"
+
+SYSTEM_PROMPT = (
+    "You are an expert technical recruiter. Given a job description and candidate resume, "
+    "return ONLY a floating point match score between 0 and 1 representing how well the candidate fits."
+)
+BATCH_SYSTEM_PROMPT = (
+    "You are an expert technical recruiter. Given a job description and several numbered candidate resumes, "
+    "score each candidate independently with a floating point match score between 0 and 1. "
+    'Return ONLY a JSON object mapping each candidate number to its score, e.g. {"1": 0.8, "2": 0.35}.'
+)
+
+
+@dataclass
+class JobSpec:
+    id: int
+    title: str
+    description: str
+    qualifications: Optional[str]
+    job_hash: str
+
+
+@dataclass
+class ResumeItem:
+    candidate_id: int
+    name: str
+    email: str
+    resume_text: Optional[str]
+    resume_hash: str
+
+
+def job_hash(job: Job) -> str:
+    """Hash of everything about the job that reaches the prompt, plus model and prompt version."""
+    raw = json.dumps([job.title, job.description, job.qualifications or "", llm_gateway.model, SCORING_PROMPT_VERSION])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def resume_hash(candidate: Candidate) -> str:
+    raw = json.dumps([candidate.name, candidate.email, candidate.resume_text or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _job_block(job: JobSpec) -> str:
+    return (
+        f"Job Title: {job.title}\n"
+        f"Job Description: {job.description}\n"
+        f"Qualifications: {job.qualifications or ''}\n\n"
+    )
+
+
+def _resume(item: ResumeItem) -> str:
+    return (item.resume_text or "(no resume text provided)")[:RESUME_MAX_CHARS]
+
+
+def _parse_score(value) -> Optional[float]:
+    try:
+        score = float(value)
+    except Exception:
+        return None
+    return score if 0.0 <= score <= 1.0 else None
+
+
+async def _score_one(job: JobSpec, item: ResumeItem) -> Optional[float]:
+    user = (
+        _job_block(job)
+        + f"Candidate: {item.name} <{item.email}>\n"
+        + f"Resume: {_resume(item)}\n\n"
+        + "Return only the score as a number between 0 and 1."
+    )
+    try:
+        content = await llm_gateway.chat(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user}],
+            temperature=0.0,
+            max_tokens=20,
+            priority="batch",
+            timeout=30.0,
+            name="score_candidate",
+        )
+    except Exception:
+        return None
+    return _parse_score(content.strip())
+
+
+async def _score_batch(job: JobSpec, items: List[ResumeItem]) -> Dict[str, Optional[float]]:
+    """Score several resumes in one prompt. Anything the model leaves out or
+    garbles is re-scored on its own."""
+    if len(items) == 1:
+        return {items[0].resume_hash: await _score_one(job, items[0])}
+    parts = [_job_block(job)]
+    for n, item in enumerate(items, start=1):
+        parts.append(f"Candidate {n}: {item.name} <{item.email}>\nResume: {_resume(item)}\n\n")
+    parts.append("Return only the JSON object.")
+    scores: Dict[str, Optional[float]] = {}
+    try:
+        content = await llm_gateway.chat(
+            [{"role": "system", "content": BATCH_SYSTEM_PROMPT}, {"role": "user", "content": "".join(parts)}],
+            temperature=0.0,
+            max_tokens=16 * len(items) + 16,
+            priority="batch",
+            timeout=60.0,
+            name="score_candidate_batch",
+        )
+        m = re.search(r"\{.*\}", content, re.S)
+        parsed = json.loads(m.group(0)) if m else {}
+        for n, item in enumerate(items, start=1):
+            scores[item.resume_hash] = _parse_score(parsed.get(str(n)))
+    except Exception:
+        pass
+    missing = [item for item in items if scores.get(item.resume_hash) is None]
+    if missing:
+        singles = await asyncio.gather(*(_score_one(job, item) for item in missing))
+        for item, score in zip(missing, singles):
+            scores[item.resume_hash] = score
+    return scores
+
+
+# ---------------- embedding pre-screen ----------------
+# job hash -> {resume hash: cosine similarity}, so re-runs skip the embedding pass
+_similarities: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+
+
+async def _embed(texts: List[str]) -> np.ndarray:
+    """Embed with RAG's retrieval model (vectors come back L2-normalized)."""
+    client = http_clients.get("rag")
+    url = f"{RAG_API_URL.rstrip('/')}/embed"
+    chunks = [texts[i:i + PRESCREEN_EMBED_BATCH] for i in range(0, len(texts), PRESCREEN_EMBED_BATCH)]
+
+    async def _one(chunk: List[str]) -> List[List[float]]:
+        r = await client.post(url, json={"texts": chunk})
+        r.raise_for_status()
+        return r.json().get("vectors", [])
+
+    vectors: List[List[float]] = []
+    for part in await asyncio.gather(*(_one(c) for c in chunks)):
+        vectors.extend(part)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+async def similarities(job: JobSpec, items: Dict[str, ResumeItem]) -> Dict[str, float]:
+    """Cosine similarity of every resume to the job, as one matrix-vector product."""
+    known = _similarities.get(job.job_hash, {})
+    missing = [item for rh, item in items.items() if rh not in known]
+    if missing:
+        texts = [f"{job.title}\n{job.description}\n{job.qualifications or ''}"]
+        texts += [f"{item.name}\n{(item.resume_text or '')[:PRESCREEN_RESUME_CHARS]}" for item in missing]
+        mat = await _embed(texts)
+        sims = mat[1:] @ mat[0]
+        known = {**known, **{item.resume_hash: float(sim) for item, sim in zip(missing, sims)}}
+    _similarities[job.job_hash] = known
+    _similarities.move_to_end(job.job_hash)
+    while len(_similarities) > PRESCREEN_CACHE_JOBS:
+        _similarities.popitem(last=False)
+    return {rh: known[rh] for rh in items}
+
+
+def shortlist(sims: Dict[str, float]) -> set:
+    """Top PRESCREEN_TOP_FRACTION of resumes (at least PRESCREEN_MIN_KEEP), plus
+    any at or above PRESCREEN_SIM_FLOOR."""
+    if len(sims) <= PRESCREEN_MIN_KEEP:
+        return set(sims)
+    hashes = list(sims)
+    values = np.fromiter((sims[h] for h in hashes), dtype=np.float32, count=len(hashes))
+    keep_n = max(PRESCREEN_MIN_KEEP, math.ceil(PRESCREEN_TOP_FRACTION * len(hashes)))
+    top = np.argpartition(-values, keep_n - 1)[:keep_n]
+    keep = {hashes[i] for i in top}
+    keep.update(hashes[i] for i in np.nonzero(values >= PRESCREEN_SIM_FLOOR)[0])
+    return keep
+
+
+def _commit_similarities(sims: Dict[str, float], by_hash: Dict[str, List[int]]) -> None:
+    with SessionLocal() as db:
+        for rh, sim in sims.items():
+            for cid in by_hash.get(rh, []):
+                c = db.get(Candidate, cid)
+                if c is not None:
+                    c.similarity = sim
+        db.commit()
+
+
+# Per-job progress of the last/current autofilter run (process-local)
+progress: Dict[int, dict] = {}
+
+
+def _cached_scores(jh: str, hashes: List[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    with SessionLocal() as db:
+        # chunked to stay under SQLite's bound-parameter limit
+        for i in range(0, len(hashes), 500):
+            rows = db.execute(
+                select(CandidateScore.resume_hash, CandidateScore.score).where(
+                    CandidateScore.job_hash == jh, CandidateScore.resume_hash.in_(hashes[i:i + 500])
+                )
+            ).all()
+            out.update({h: s for h, s in rows})
+    return out
+
+
+def _upsert_scores(db, jh: str, ok: Dict[str, float]) -> None:
+    """INSERT ... ON CONFLICT (job_hash, resume_hash) DO UPDATE, so concurrent
+    autofilter runs on the same job don't collide on uix_job_resume_score."""
+    insert = {"sqlite": sqlite_insert, "postgresql": pg_insert}.get(db.get_bind().dialect.name)
+    if insert is None:
+        # other backends: merge by hand (racy, but no upsert construct to use)
+        existing = {
+            row.resume_hash: row
+            for row in db.execute(
+                select(CandidateScore).where(CandidateScore.job_hash == jh, CandidateScore.resume_hash.in_(list(ok)))
+            ).scalars()
+        }
+        for rh, score in ok.items():
+            if rh in existing:
+                existing[rh].score = score
+            else:
+                db.add(CandidateScore(job_hash=jh, resume_hash=rh, score=score))
+        return
+    rows = [{"job_hash": jh, "resume_hash": rh, "score": score} for rh, score in ok.items()]
+    # chunked to stay under SQLite's bound-parameter limit
+    for i in range(0, len(rows), 200):
+        stmt = insert(CandidateScore).values(rows[i:i + 200])
+        db.execute(stmt.on_conflict_do_update(index_elements=["job_hash", "resume_hash"], set_={"score": stmt.excluded.score}))
+
+
+def _commit_scores(jh: str, scored: List[Tuple[str, Optional[float]]], by_hash: Dict[str, List[int]]) -> None:
+    """Write a chunk of results: cache successful scores and set them on the
+    candidates. Failed scores (None) are not cached, so the next run retries them."""
+    with SessionLocal() as db:
+        ok = {rh: score for rh, score in scored if score is not None}
+        if ok:
+            _upsert_scores(db, jh, ok)
+        for rh, score in scored:
+            for cid in by_hash.get(rh, []):
+                c = db.get(Candidate, cid)
+                if c is not None:
+                    c.match_score = score if score is not None else 0.0
+        db.commit()
+
+
+def snapshot(job: Job, candidates: List[Candidate]) -> Tuple[JobSpec, Dict[str, ResumeItem], Dict[str, List[int]]]:
+    """Copy what scoring needs out of ORM objects so the caller can release its
+    session before any LLM call. Candidates with identical resumes share one score."""
+    spec = JobSpec(job.id, job.title, job.description, job.qualifications, job_hash(job))
+    items: Dict[str, ResumeItem] = {}
+    by_hash: Dict[str, List[int]] = {}
+    for c in candidates:
+        rh = resume_hash(c)
+        by_hash.setdefault(rh, []).append(c.id)
+        items.setdefault(rh, ResumeItem(c.id, c.name, c.email, c.resume_text, rh))
+    return spec, items, by_hash
+
+
+async def score_job(job: JobSpec, items: Dict[str, ResumeItem], by_hash: Dict[str, List[int]]) -> Tuple[Dict[int, float], Dict[int, float]]:
+    """Score the candidates of a job. Returns ({candidate_id: LLM score} for
+    the candidates that were LLM-scored, {candidate_id: similarity} for all
+    candidates when the pre-screen ran).
+
+    Resumes are first pre-screened by embedding similarity to the job; only
+    the shortlist (and resumes with a cached score) are LLM-scored. Cached
+    scores are reused; the rest are packed SCORE_BATCH_SIZE resumes per
+    prompt and sent with SCORE_CONCURRENCY prompts in flight (the LLM gateway
+    caps batch traffic further). Results are committed every
+    SCORE_COMMIT_EVERY resumes through short-lived sessions, so an interrupted
+    run resumes where it stopped.
+    """
+    jh = job.job_hash
+    state = progress[job.id] = {
+        "status": "running",
+        "total": len(items),
+        "prescreened_out": 0,
+        "cached": 0,
+        "scored": 0,
+        "failed": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+    }
+    cached = _cached_scores(jh, list(items))
+    sims: Dict[str, float] = {}
+    keep = set(items)
+    if PRESCREEN_ENABLED and len(items) > PRESCREEN_MIN_KEEP:
+        try:
+            sims = await similarities(job, items)
+            keep = shortlist(sims) | set(cached)
+            _commit_similarities(sims, by_hash)
+        except Exception as e:
+            print(f"[Autofilter][WARN] pre-screen failed for job {job.id}, scoring all candidates: {e}")
+            sims, keep = {}, set(items)
+    state["prescreened_out"] = len(items) - len(keep)
+    state["cached"] = len(cached)
+    todo = [item for rh, item in items.items() if rh in keep and rh not in cached]
+    results: Dict[str, Optional[float]] = dict(cached)
+    sem = asyncio.Semaphore(SCORE_CONCURRENCY)
+
+    async def _run(batch: List[ResumeItem]) -> Dict[str, Optional[float]]:
+        async with sem:
+            return await _score_batch(job, batch)
+
+    batches = [todo[i:i + SCORE_BATCH_SIZE] for i in range(0, len(todo), SCORE_BATCH_SIZE)]
+    pending: List[Tuple[str, Optional[float]]] = []
+    try:
+        for fut in asyncio.as_completed([_run(b) for b in batches]):
+            for rh, score in (await fut).items():
+                results[rh] = score
+                pending.append((rh, score))
+                state["scored" if score is not None else "failed"] += 1
+            if len(pending) >= SCORE_COMMIT_EVERY:
+                _commit_scores(jh, pending, by_hash)
+                pending = []
+        if pending:
+            _commit_scores(jh, pending, by_hash)
+    except Exception:
+        state["status"] = "failed"
+        state["finished_at"] = time.time()
+        raise
+    state["status"] = "done"
+    state["finished_at"] = time.time()
+
+    scores: Dict[int, float] = {}
+    similarity: Dict[int, float] = {}
+    for rh, cids in by_hash.items():
+        for cid in cids:
+            if rh in keep:
+                score = results.get(rh)
+                scores[cid] = score if score is not None else 0.0
+            if rh in sims:
+                similarity[cid] = sims[rh]
+    return scores, similarity
@@ -0,0 +1,170 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, func
+
+from .db import SessionLocal
+from .llm_gateway import gateway as llm_gateway
+from .models import ChatSession, ChatTurn
+from .prompt_builder import token_counter
+
+
+# Recent turns sent verbatim; anything older lives only in the rolling summary
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "8"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1024"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "256"))
+SUMMARY_MAX_TURNS = int(os.getenv("SUMMARY_MAX_TURNS", "16"))  # turns folded in per summarization pass
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an enterprise assistant. "
+    "Update the summary with the new turns. Keep facts, names, decisions, open questions and the user's goals; "
+    "drop pleasantries. Reply with the updated summary only, in at most a few short paragraphs."
+)
+
+_summarizing: set = set()
+# strong references: the event loop only keeps weak ones to running tasks
+_summary_tasks: set = set()
+
+
+def create_session() -> str:
+    sid = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(ChatSession(id=sid))
+        db.commit()
+    return sid
+
+
+def load_history(session_id: str) -> Optional[Tuple[Optional[str], List[dict]]]:
+    """(summary, recent turns oldest-first) or None if the session doesn't exist.
+    Reads at most HISTORY_MAX_TURNS rows whatever the conversation length."""
+    with SessionLocal() as db:
+        sess = db.get(ChatSession, session_id)
+        if sess is None:
+            return None
+        rows = db.execute(
+            select(ChatTurn.role, ChatTurn.content)
+            .where(ChatTurn.session_id == session_id, ChatTurn.id > sess.summarized_through)
+            .order_by(ChatTurn.id.desc())
+            .limit(HISTORY_MAX_TURNS)
+        ).all()
+        return sess.summary, [{"role": r, "content": c} for r, c in reversed(rows)]
+
+
+async def history_messages(summary: Optional[str], turns: List[dict]) -> List[dict]:
+    """Summary plus the newest turns that fit HISTORY_TOKEN_BUDGET, as chat messages."""
+    out: List[dict] = []
+    used = 0
+    if summary:
+        msg = {"role": "system", "content": f"Summary of the conversation so far:\n{summary}"}
+        used = (await token_counter.count([msg["content"]]))[0]
+        out.append(msg)
+    counts = await token_counter.count([t["content"] for t in turns]) if turns else []
+    recent: List[dict] = []
+    for turn, n in zip(reversed(turns), reversed(counts)):
+        if used + n > HISTORY_TOKEN_BUDGET:
+            break
+        recent.append({"role": turn["role"], "content": turn["content"]})
+        used += n
+    return out + list(reversed(recent))
+
+
+def append_turns(session_id: str, user: str, assistant: str) -> None:
+    with SessionLocal() as db:
+        db.add(ChatTurn(session_id=session_id, role="user", content=user))
+        db.add(ChatTurn(session_id=session_id, role="assistant", content=assistant))
+        sess = db.get(ChatSession, session_id)
+        if sess is not None:
+            sess.updated_at = datetime.utcnow()
+        db.commit()
+    schedule_summary(session_id)
+
+
+def schedule_summary(session_id: str) -> None:
+    """Fold turns that dropped out of the recent window into the summary,
+    in the background and at most one pass per session at a time."""
+    if session_id in _summarizing:
+        return
+    _summarizing.add(session_id)
+    task = asyncio.get_running_loop().create_task(_summarize(session_id))
+    _summary_tasks.add(task)
+
+    def _done(t: asyncio.Task) -> None:
+        _summary_tasks.discard(t)
+        _summarizing.discard(session_id)
+
+    task.add_done_callback(_done)
+
+
+async def _summarize(session_id: str) -> None:
+    with SessionLocal() as db:
+        sess = db.get(ChatSession, session_id)
+        if sess is None:
+            return
+        pending = db.execute(
+            select(func.count(ChatTurn.id)).where(ChatTurn.session_id == session_id, ChatTurn.id > sess.summarized_through)
+        ).scalar_one()
+        overflow = min(pending - HISTORY_MAX_TURNS, SUMMARY_MAX_TURNS)
+        if overflow <= 0:
+            return
+        rows = db.execute(
+            select(ChatTurn.id, ChatTurn.role, ChatTurn.content)
+            .where(ChatTurn.session_id == session_id, ChatTurn.id > sess.summarized_through)
+            .order_by(ChatTurn.id.asc())
+            .limit(overflow)
+        ).all()
+        previous, through = sess.summary, sess.summarized_through
+    transcript = "\n".join(f"{role}: {content}" for _id, role, content in rows)
+    user = f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"
+    try:
+        summary = await llm_gateway.chat(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": user}],
+            temperature=0.0,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            priority="batch",
+            name="chat_summary",
+        )
+    except Exception as e:
+        # turns stay in the unsummarized window; the next turn retries
+        print(f"[ChatSessions][WARN] summary update failed for {session_id}: {e}")
+        return
+    with SessionLocal() as db:
+        sess = db.get(ChatSession, session_id)
+        # skip if someone else advanced the summary meanwhile (e.g. another worker)
+        if sess is None or sess.summarized_through != through or not summary.strip():
+            return
+        sess.summary = summary.strip()
+        sess.summarized_through = rows[-1][0]
+        db.commit()
+
+
+def get_session(session_id: str) -> Optional[dict]:
+    with SessionLocal() as db:
+        sess = db.get(ChatSession, session_id)
+        if sess is None:
+            return None
+        turns = db.execute(
+            select(ChatTurn.id, ChatTurn.role, ChatTurn.content, ChatTurn.created_at)
+            .where(ChatTurn.session_id == session_id)
+            .order_by(ChatTurn.id.asc())
+        ).all()
+        return {
+            "session_id": sess.id,
+            "summary": sess.summary,
+            "summarized_through": sess.summarized_through,
+            "created_at": sess.created_at,
+            "updated_at": sess.updated_at,
+            "turns": [{"id": i, "role": r, "content": c, "created_at": t} for i, r, c, t in turns],
+        }
+
+
+def delete_session(session_id: str) -> bool:
+    with SessionLocal() as db:
+        sess = db.get(ChatSession, session_id)
+        if sess is None:
+            return False
+        db.delete(sess)
+        db.commit()
+        return True
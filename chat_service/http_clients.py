@@ -0,0 +1,72 @@
+import os
+from typing import Dict
+
+import httpx
+
+
+# One pooled AsyncClient per outbound destination, shared by all routers.
+# Created on app startup, closed on shutdown; get() lazily creates one if a
+# helper runs outside the app lifecycle (scripts, tests).
+DESTINATIONS: Dict[str, Dict[str, float]] = {
+    "rag": {
+        "timeout": float(os.getenv("RAG_TIMEOUT_S", "20")),
+        "connect": float(os.getenv("RAG_CONNECT_TIMEOUT_S", "3")),
+        "max_connections": int(os.getenv("RAG_MAX_CONNECTIONS", "50")),
+    },
+    "llm": {
+        "timeout": float(os.getenv("LLM_TIMEOUT_S", "40")),
+        "connect": float(os.getenv("LLM_CONNECT_TIMEOUT_S", "3")),
+        "max_connections": int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+    },
+}
+KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY_S = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_S", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except Exception:
+        print("[HTTP][WARN] HTTP2_ENABLED but the h2 package is missing; using HTTP/1.1")
+        return False
+
+
+def _build(name: str) -> httpx.AsyncClient:
+    cfg = DESTINATIONS.get(name, DESTINATIONS["rag"])
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(cfg["timeout"], connect=cfg["connect"]),
+        limits=httpx.Limits(
+            max_connections=int(cfg["max_connections"]),
+            max_keepalive_connections=min(KEEPALIVE_CONNECTIONS, int(cfg["max_connections"])),
+            keepalive_expiry=KEEPALIVE_EXPIRY_S,
+        ),
+        http2=_http2_available(),
+    )
+
+
+def get(name: str) -> httpx.AsyncClient:
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build(name)
+        _clients[name] = client
+    return client
+
+
+async def startup() -> None:
+    for name in DESTINATIONS:
+        get(name)
+
+
+async def shutdown() -> None:
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+        _clients.pop(name, None)
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+from collections import deque
+from typing import List, Dict, Any, AsyncIterator, Optional
+
+import httpx
+
+from . import http_clients
+
+
+class LLMGateway:
+    """Async entry point for llama.cpp chat completions from chat_service.
+
+    Mirrors the RAG app's gateway: LLM_SLOTS bounds requests in flight, "batch"
+    callers (candidate scoring) are capped at LLM_BATCH_SLOTS so chat keeps a
+    free slot, identical in-flight requests are coalesced, cache_prompt (and
+    optional id_slot pinning per system prompt) lets llama.cpp reuse KV cache,
+    and connection failures / 429 / 5xx are retried with jittered backoff.
+    """
+
+    def __init__(self) -> None:
+        self.url = os.getenv("LLM_URL", "http://127.0.0.1:8085").rstrip("/")
+        self.model = os.getenv("LLM_MODEL", "local-llm")
+        self.slots = max(1, int(os.getenv("LLM_SLOTS", "4")))
+        self.batch_slots = max(1, min(int(os.getenv("LLM_BATCH_SLOTS", str(max(1, self.slots - 1)))), self.slots))
+        self.retries = int(os.getenv("LLM_RETRIES", "2"))
+        self.backoff_s = float(os.getenv("LLM_BACKOFF_S", "0.5"))
+        self.cache_prompt = os.getenv("LLM_CACHE_PROMPT", "true").lower() in ("1", "true", "yes")
+        self.pin_slots = os.getenv("LLM_PIN_SLOTS", "false").lower() in ("1", "true", "yes")
+        # semaphores are created lazily so they bind to the running event loop
+        self._total: Optional[asyncio.Semaphore] = None
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, list] = {}
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+
+    def _sems(self, priority: str) -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        if self._total is None:
+            self._total = asyncio.Semaphore(self.slots)
+            self._limits = {
+                "interactive": asyncio.Semaphore(self.slots),
+                "batch": asyncio.Semaphore(self.batch_slots),
+            }
+        return self._limits.get(priority, self._limits["batch"]), self._total
+
+    # ---------------- metrics ----------------
+    def _record(self, name: str, **inc: float) -> None:
+        m = self._metrics.get(name)
+        if m is None:
+            m = {"calls": 0, "errors": 0, "coalesced": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": deque(maxlen=500)}
+            self._metrics[name] = m
+        for k, v in inc.items():
+            if k == "latency_ms":
+                m["latency_ms"].append(v)
+            else:
+                m[k] += v
+
+    def metrics(self) -> Dict[str, Any]:
+        out = {}
+        for name, m in self._metrics.items():
+            lat = sorted(m["latency_ms"])
+            pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else 0.0
+            out[name] = {**{k: v for k, v in m.items() if k != "latency_ms"}, "p50_ms": pct(0.5), "p95_ms": pct(0.95)}
+        return {"slots": self.slots, "batch_slots": self.batch_slots, "inflight": len(self._inflight), "calls": out}
+
+    # ---------------- calls ----------------
+    def _body(self, messages: List[dict], temperature: float, max_tokens: Optional[int], extra: Optional[dict]) -> dict:
+        body: Dict[str, Any] = {"model": self.model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            body["max_tokens"] = max_tokens
+        if self.cache_prompt:
+            body["cache_prompt"] = True
+        if self.pin_slots:
+            system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+            body["id_slot"] = int(hashlib.sha1(system.encode("utf-8")).hexdigest(), 16) % self.slots
+        body.update(extra or {})
+        return body
+
+    async def _backoff(self, name: str, attempt: int) -> None:
+        self._record(name, retries=1)
+        await asyncio.sleep(random.uniform(0, self.backoff_s * (2 ** attempt)))
+
+    @staticmethod
+    def _retryable(e: Exception) -> bool:
+        # only failures before the request reached the server; a read timeout
+        # means a slot is busy with it, and resending would add to the load
+        if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        return isinstance(e, httpx.HTTPStatusError) and (e.response.status_code == 429 or e.response.status_code >= 500)
+
+    async def _post(self, body: dict, timeout: Optional[float], name: str) -> dict:
+        attempt = 0
+        while True:
+            try:
+                kwargs = {"timeout": timeout} if timeout else {}
+                r = await http_clients.get("llm").post(f"{self.url}/v1/chat/completions", json=body, **kwargs)
+                r.raise_for_status()
+                return r.json()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if not self._retryable(e) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                await self._backoff(name, attempt)
+
+    async def _call(self, body: dict, priority: str, timeout: Optional[float], name: str) -> str:
+        limit, total = self._sems(priority)
+        t0 = time.perf_counter()
+        try:
+            async with limit, total:
+                data = await self._post(body, timeout, name)
+        except Exception:
+            self._record(name, calls=1, errors=1, latency_ms=(time.perf_counter() - t0) * 1000.0)
+            raise
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "") or ""
+        usage = data.get("usage") or {}
+        self._record(
+            name,
+            calls=1,
+            prompt_tokens=int(usage.get("prompt_tokens", 0) or 0),
+            completion_tokens=int(usage.get("completion_tokens", 0) or 0),
+            latency_ms=(time.perf_counter() - t0) * 1000.0,
+        )
+        return content
+
+    def _finish(self, key: str, entry: list) -> None:
+        if self._inflight.get(key) is entry:
+            self._inflight.pop(key, None)
+        task = entry[0]
+        if not task.cancelled():
+            task.exception()  # retrieved: waiters re-raise it, don't warn when there were none
+
+    async def chat(self, messages: List[dict], temperature: float = 0.2, max_tokens: Optional[int] = None, priority: str = "interactive", timeout: Optional[float] = None, name: str = "chat", extra: Optional[dict] = None) -> str:
+        """Return the completion text; raises after retries are exhausted.
+
+        The request runs in its own task shared by every identical caller, so
+        one caller being cancelled (client disconnect) doesn't fail the others;
+        the task is cancelled only once nobody is waiting for it.
+        """
+        body = self._body(messages, temperature, max_tokens, extra)
+        key = hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+        entry = self._inflight.get(key)  # [task, waiters]
+        if entry is None:
+            entry = [asyncio.get_running_loop().create_task(self._call(body, priority, timeout, name)), 0]
+            self._inflight[key] = entry
+            entry[0].add_done_callback(lambda _t, e=entry: self._finish(key, e))
+        else:
+            self._record(name, coalesced=1)
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    async def stream(self, messages: List[dict], temperature: float = 0.2, max_tokens: Optional[int] = None, priority: str = "interactive", name: str = "chat_stream") -> AsyncIterator[str]:
+        """Yield content deltas of a `stream: true` completion. Not coalesced;
+        only connection failures before the first byte are retried.
+        """
+        body = self._body(messages, temperature, max_tokens, {"stream": True, "stream_options": {"include_usage": True}})
+        limit, total = self._sems(priority)
+        t0 = time.perf_counter()
+        attempt = 0
+        usage: dict = {}
+        async with limit, total:
+            while True:
+                try:
+                    async with http_clients.get("llm").stream("POST", f"{self.url}/v1/chat/completions", json=body) as r:
+                        r.raise_for_status()
+                        async for line in r.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            try:
+                                chunk = json.loads(data)
+                            except Exception:
+                                continue
+                            usage = chunk.get("usage") or usage
+                            delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                            if delta:
+                                attempt = self.retries  # output started: never replay
+                                yield delta
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if not self._retryable(e) or attempt >= self.retries:
+                        self._record(name, calls=1, errors=1, latency_ms=(time.perf_counter() - t0) * 1000.0)
+                        raise
+                    attempt += 1
+                    await self._backoff(name, attempt)
+        self._record(
+            name,
+            calls=1,
+            prompt_tokens=int(usage.get("prompt_tokens", 0) or 0),
+            completion_tokens=int(usage.get("completion_tokens", 0) or 0),
+            latency_ms=(time.perf_counter() - t0) * 1000.0,
+        )
+
+
+gateway = LLMGateway()
@@ -65,12 +65,49 @@ class Candidate(Base):
     match_score: Mapped[Optional[float]] = Column(Float, nullable=True)
     filtered_out: Mapped[bool] = Column(Boolean, default=False, nullable=False)
     rank: Mapped[Optional[int]] = Column(Integer, nullable=True)
+    similarity: Mapped[Optional[float]] = Column(Float, nullable=True)  # embedding pre-screen, job vs resume
     provisioned: Mapped[bool] = Column(Boolean, default=False, nullable=False)
 
     job = relationship("Job", back_populates="candidates")
     meetings = relationship("Meeting", back_populates="candidate", cascade="all, delete-orphan")
 
 
+class CandidateScore(Base):
+    """LLM match score cache keyed by (job hash, resume hash), so re-running
+    autofilter only scores new or changed resumes."""
+    __tablename__ = "candidate_scores"
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    job_hash: Mapped[str] = Column(String(64), nullable=False, index=True)
+    resume_hash: Mapped[str] = Column(String(64), nullable=False)
+    score: Mapped[float] = Column(Float, nullable=False)
+    created_at: Mapped[datetime] = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (UniqueConstraint("job_hash", "resume_hash", name="uix_job_resume_score"),)
+
+
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+    id: Mapped[str] = Column(String(36), primary_key=True)
+    summary: Mapped[Optional[str]] = Column(Text, nullable=True)
+    # id of the last turn folded into `summary`
+    summarized_through: Mapped[int] = Column(Integer, default=0, nullable=False)
+    created_at: Mapped[datetime] = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    turns = relationship("ChatTurn", back_populates="session", cascade="all, delete-orphan")
+
+
+class ChatTurn(Base):
+    __tablename__ = "chat_turns"
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    session_id: Mapped[str] = Column(String(36), ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True)
+    role: Mapped[str] = Column(String(16), nullable=False)  # user | assistant
+    content: Mapped[str] = Column(Text, nullable=False)
+    created_at: Mapped[datetime] = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    session = relationship("ChatSession", back_populates="turns")
+
+
 class Meeting(Base):
     __tablename__ = "meetings"
     id: Mapped[int] = Column(Integer, primary_key=True)
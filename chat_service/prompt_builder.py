@@ -0,0 +1,189 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from . import http_clients
+from .llm_gateway import gateway as llm_gateway
+
+
+# Model context window and the share of it the retrieved context may take
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "4096"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))  # 0 = whatever the window leaves free
+PROMPT_RESERVE_TOKENS = int(os.getenv("PROMPT_RESERVE_TOKENS", "64"))  # chat template / role markers
+MIN_PASSAGE_TOKENS = int(os.getenv("MIN_PASSAGE_TOKENS", "48"))  # don't add a passage truncated below this
+OVERLAP_MIN_CHARS = int(os.getenv("OVERLAP_MIN_CHARS", "40"))
+TOKENIZE_TIMEOUT_S = float(os.getenv("TOKENIZE_TIMEOUT_S", "2"))
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))  # estimate when /tokenize is unavailable
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+
+@dataclass
+class Passage:
+    index: int  # position in the source list, used for the [S#] marker
+    text: str
+    score: float
+    document_id: Optional[str] = None
+    chunk_index: Optional[int] = None
+
+
+class TokenCounter:
+    """Token counts from the llama.cpp server's own tokenizer (POST /tokenize),
+    memoized by text hash. Falls back to a chars/token estimate when the
+    endpoint is unreachable, and stops asking for a while after a failure.
+    """
+
+    def __init__(self) -> None:
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._down_until = 0.0
+        self.stats = {"hits": 0, "tokenized": 0, "estimated": 0}
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        return max(1, int(len(text) / CHARS_PER_TOKEN + 0.5)) if text else 0
+
+    async def _tokenize(self, text: str) -> int:
+        r = await http_clients.get("llm").post(f"{llm_gateway.url}/tokenize", json={"content": text}, timeout=TOKENIZE_TIMEOUT_S)
+        r.raise_for_status()
+        return len(r.json().get("tokens", []))
+
+    async def count(self, texts: List[str]) -> List[int]:
+        loop = asyncio.get_running_loop()
+        keys = [hashlib.sha1(t.encode("utf-8")).hexdigest() for t in texts]
+        out: List[Optional[int]] = []
+        for k in keys:
+            n = self._cache.get(k)
+            if n is not None:
+                self._cache.move_to_end(k)
+                self.stats["hits"] += 1
+            out.append(n)
+        missing = [i for i, n in enumerate(out) if n is None]
+        if missing and loop.time() >= self._down_until:
+            results = await asyncio.gather(*(self._tokenize(texts[i]) for i in missing), return_exceptions=True)
+            for i, res in zip(missing, results):
+                if isinstance(res, Exception):
+                    self._down_until = loop.time() + 30.0
+                    continue
+                out[i] = res
+                self._cache[keys[i]] = res
+                self.stats["tokenized"] += 1
+            while len(self._cache) > TOKEN_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        for i, n in enumerate(out):
+            if n is None:
+                out[i] = self.estimate(texts[i])
+                self.stats["estimated"] += 1
+        return out  # type: ignore[return-value]
+
+
+token_counter = TokenCounter()
+
+
+def _strip_overlap(text: str, other: str) -> str:
+    """Remove from `text` whatever it shares with `other` at the seams:
+    a prefix equal to a suffix of `other` (the next chunk of a document
+    repeats the end of the previous one) and a suffix equal to a prefix of
+    `other`. Returns "" if `text` is wholly contained in `other`.
+    """
+    if not text or not other:
+        return text
+    if text in other:
+        return ""
+    # text's head repeats other's tail
+    head = text[:OVERLAP_MIN_CHARS]
+    if len(head) == OVERLAP_MIN_CHARS:
+        pos = other.find(head, max(0, len(other) - len(text)))
+        while pos != -1:
+            if text.startswith(other[pos:]):
+                text = text[len(other) - pos:].lstrip()
+                break
+            pos = other.find(head, pos + 1)
+    # text's tail repeats other's head
+    tail_probe = other[:OVERLAP_MIN_CHARS]
+    if len(tail_probe) == OVERLAP_MIN_CHARS:
+        pos = text.find(tail_probe)
+        while pos != -1:
+            if other.startswith(text[pos:]):
+                text = text[:pos].rstrip()
+                break
+            pos = text.find(tail_probe, pos + 1)
+    return text
+
+
+def _dedupe(passage: Passage, selected: List[Passage]) -> str:
+    text = passage.text
+    for other in selected:
+        if passage.document_id is None or other.document_id != passage.document_id:
+            continue
+        # only neighbouring chunks share overlap (-1 is a whole-document record)
+        a, b = passage.chunk_index, other.chunk_index
+        if a is not None and b is not None and a >= 0 and b >= 0 and abs(a - b) > 1:
+            continue
+        text = _strip_overlap(text, other.text)
+        if not text:
+            break
+    return text
+
+
+def _truncate(text: str, tokens: int, budget: int) -> str:
+    """Cut text to roughly `budget` tokens at a sentence or word boundary."""
+    # a little under the proportional length, since token density varies along the text
+    cut = text[: max(0, int(len(text) * 0.95 * budget / max(1, tokens)))]
+    for sep in (". ", "\n", " "):
+        i = cut.rfind(sep)
+        if i > len(cut) // 2:
+            return cut[: i + 1].rstrip()
+    return cut
+
+
+async def build_context(passages: List[Passage], budget: int) -> Tuple[str, Dict[str, int]]:
+    """Greedy context packing by rerank score under a token budget.
+
+    Passages are taken best-first; text that repeats an already selected
+    passage of the same document (chunk overlap) is cut before counting.
+    The last passage that does not fit is truncated if at least
+    MIN_PASSAGE_TOKENS remain. Selected passages keep their [S#] marker and
+    appear in score order. Returns the context and packing stats.
+    """
+    ordered = sorted(passages, key=lambda p: p.score, reverse=True)
+    cleaned: List[Passage] = []
+    dropped_chars = 0
+    for p in ordered:
+        text = _dedupe(p, cleaned)
+        dropped_chars += len(p.text) - len(text)
+        if text:
+            cleaned.append(Passage(p.index, text, p.score, p.document_id, p.chunk_index))
+    segments = [f"[S{p.index + 1}] {p.text}" for p in cleaned]
+    counts = await token_counter.count(segments) if segments else []
+    used = 0
+    out: List[str] = []
+    for seg, n in zip(segments, counts):
+        sep = 1 if out else 0  # "\n\n" is about one token
+        if used + sep + n <= budget:
+            out.append(seg)
+            used += sep + n
+            continue
+        room = budget - used - sep
+        if room >= MIN_PASSAGE_TOKENS:
+            out.append(_truncate(seg, n, room))
+            used += sep + room
+            break
+        # too little room to be worth truncating; a shorter passage further down may still fit
+    stats = {
+        "budget_tokens": budget,
+        "context_tokens": used,
+        "passages": len(out),
+        "candidates": len(passages),
+        "overlap_chars_removed": dropped_chars,
+    }
+    return "\n\n".join(out), stats
+
+
+async def context_budget(fixed_texts: List[str], max_tokens: int) -> int:
+    """Tokens left for context after the fixed prompt parts and the answer."""
+    if CONTEXT_TOKEN_BUDGET > 0:
+        return CONTEXT_TOKEN_BUDGET
+    fixed = sum(await token_counter.count(fixed_texts))
+    return max(0, LLM_CONTEXT_TOKENS - max_tokens - fixed - PROMPT_RESERVE_TOKENS)
@@ -1,20 +1,27 @@
 import os
-from typing import List, Optional, Any, Tuple
-from fastapi import APIRouter, UploadFile, File, Form
+import json
+from typing import List, Optional, Any, Tuple, AsyncIterator
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import httpx
 from time import perf_counter
 
+from ..semantic_cache import answer_cache, CachedAnswer
+from .. import http_clients
+from ..llm_gateway import gateway as llm_gateway
+from ..prompt_builder import Passage, build_context, context_budget, token_counter
+from .. import chat_sessions
+
 router = APIRouter()
 
 RAG_API_URL = os.getenv("RAG_API_URL", "http://localhost:8000")
-LLM_URL = os.getenv("LLM_URL", "http://127.0.0.1:8085")
 LLM_MODEL = os.getenv("LLM_MODEL", "local-llm")
-SNIPPET_CHARS = int(os.getenv("SNIPPET_CHARS", "600"))  # per-snippet truncation
-MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "4000"))  # total concatenated context cap
+SNIPPET_CHARS = int(os.getenv("SNIPPET_CHARS", "600"))  # per-snippet size (query-focused, extracted by RAG)
 LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
 RAG_TIMEOUT_S = float(os.getenv("RAG_TIMEOUT_S", "20"))
+RAG_LATENCY_BUDGET_MS = float(os.getenv("RAG_LATENCY_BUDGET_MS", "0")) or None  # let RAG size retrieval to this budget
 LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "40"))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
 
 
 class ChatRequest(BaseModel):
@@ -24,6 +31,9 @@ class ChatRequest(BaseModel):
     spaces: Optional[List[str]] = None
     tags: Optional[List[str]] = None
     top_k: int = 6
+    bypass_cache: bool = False
+    # server-side conversation (POST /chat/sessions); send only the new message
+    session_id: Optional[str] = None
 
 
 class SourceItem(BaseModel):
@@ -46,18 +56,28 @@ class LlmMeta(BaseModel):
     model: Optional[str] = None
 
 
+class CacheMeta(BaseModel):
+    hit: bool
+    similarity: Optional[float] = None
+    time_ms: float = 0.0
+    error: Optional[str] = None
+
+
 class ChatMeta(BaseModel):
     rag: Optional[RagMeta] = None
     llm: Optional[LlmMeta] = None
+    cache: Optional[CacheMeta] = None
+    context: Optional[dict] = None  # prompt packing: budget/context tokens, passages, overlap removed
 
 
 class ChatResponse(BaseModel):
     answer: str
     sources: List[SourceItem] = []
     meta: Optional[ChatMeta] = None
+    session_id: Optional[str] = None
 
 
-async def _rag_search(query: str, tenant_id: str, user_roles: List[str], spaces: Optional[List[str]], tags: Optional[List[str]], top_k: int) -> List[dict]:
+async def _rag_search(query: str, tenant_id: str, user_roles: List[str], spaces: Optional[List[str]], tags: Optional[List[str]], top_k: int, query_vector: Optional[List[float]] = None) -> List[dict]:
     url = f"{RAG_API_URL.rstrip('/')}/query"
     payload = {
         "query": query,
@@ -65,71 +85,127 @@ async def _rag_search(query: str, tenant_id: str, user_roles: List[str], spaces:
         "user_roles": user_roles,
         "spaces": spaces,
         "tags": tags,
+        "top_k": top_k,
+        "latency_budget_ms": RAG_LATENCY_BUDGET_MS,
+        "snippets": True,
+        "snippet_chars": SNIPPET_CHARS,
+        # only what the prompt and source list use; httpx negotiates gzip/zstd
+        "fields": "snippets",
     }
-    async with httpx.AsyncClient(timeout=RAG_TIMEOUT_S) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
-        data = r.json()
-        results = data.get("results", [])
-        return results[:top_k]
+    if query_vector is not None:
+        # already embedded for the answer-cache probe; RAG skips re-embedding
+        payload["query_vector"] = query_vector
+    client = http_clients.get("rag")
+    r = await client.post(url, json=payload)
+    r.raise_for_status()
+    data = r.json()
+    results = data.get("results", [])
+    return results[:top_k]
+
+
+async def _rag_embed(texts: List[str], spaces: Optional[List[str]]) -> Tuple[List[List[float]], dict]:
+    url = f"{RAG_API_URL.rstrip('/')}/embed"
+    payload = {"texts": texts, "spaces": spaces}
+    client = http_clients.get("rag")
+    r = await client.post(url, json=payload)
+    r.raise_for_status()
+    data = r.json()
+    return data.get("vectors", []), data.get("generations", {})
+
 
+SYSTEM_PROMPT = (
+    "You are an enterprise assistant. Answer the user's question using the given context. "
+    "If the answer is not in the context, say you are not certain and provide best effort guidance. "
+    "Keep answers concise and cite short source markers like [S1], [S2] where appropriate."
+)
 
-async def _llm_answer(query: str, snippets: List[str]) -> Tuple[str, Optional[str], float]:
-    endpoint = f"{LLM_URL.rstrip('/')}/v1/chat/completions"
-    system = (
-        "You are an enterprise assistant. Answer the user's question using the given context. "
-        "If the answer is not in the context, say you are not certain and provide best effort guidance. "
-        "Keep answers concise and cite short source markers like [S1], [S2] where appropriate."
+
+async def _llm_messages(query: str, passages: List[Passage], history: Optional[List[dict]] = None) -> Tuple[List[dict], dict]:
+    """Chat messages with the context packed to the model's token budget,
+    after the system prompt and any session history.
+    Returns (messages, packing stats)."""
+    history = history or []
+    question = f"Question: {query}\n\nContext:\n"
+    budget = await context_budget([SYSTEM_PROMPT, question] + [m["content"] for m in history], LLM_MAX_TOKENS)
+    context, stats = await build_context(passages, budget)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *history,
+        {"role": "user", "content": question + context},
+    ], stats
+
+
+def _llm_fallback(passages: List[Passage]) -> str:
+    # Fallback minimal answer if LLM is unavailable
+    preview = "\n\n".join(p.text for p in passages[:2]) if passages else "(no context available)"
+    return (
+        "I couldn't reach the local LLM right now. "
+        "Here are the top context snippets I found; you can try again in a moment or start the LLM service.\n\n"
+        f"{preview}"
     )
-    # Enforce overall context cap
-    joined: List[str] = []
-    total = 0
-    for i, s in enumerate(snippets):
-        tag = f"[S{i+1}] "
-        budget = MAX_CONTEXT_CHARS - total - len(tag)
-        if budget <= 0:
-            break
-        piece = (s[:budget]) if len(s) > budget else s
-        seg = f"{tag}{piece}"
-        joined.append(seg)
-        total += len(seg) + 2  # account for future separators
-        if total >= MAX_CONTEXT_CHARS:
-            break
-    context = "\n\n".join(joined)
-    user = f"Question: {query}\n\nContext:\n{context}"
+
+
+async def _llm_answer(query: str, passages: List[Passage], history: Optional[List[dict]] = None) -> Tuple[str, Optional[str], float, dict]:
     start = perf_counter()
+    messages, stats = await _llm_messages(query, passages, history)
     try:
-        async with httpx.AsyncClient(timeout=LLM_TIMEOUT_S) as client:
-            r = await client.post(
-                endpoint,
-                json={
-                    "model": LLM_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    "temperature": 0.2,
-                    "max_tokens": LLM_MAX_TOKENS,
-                },
-            )
-            r.raise_for_status()
-            data = r.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            return (content or "(no response)", None, (perf_counter() - start) * 1000.0)
-    except Exception as e:
-        # Fallback minimal answer if LLM is unavailable
-        preview = "\n\n".join(snippets[:2]) if snippets else "(no context available)"
-        ans = (
-            "I couldn't reach the local LLM right now. "
-            "Here are the top context snippets I found; you can try again in a moment or start the LLM service.\n\n"
-            f"{preview}"
+        content = await llm_gateway.chat(
+            messages,
+            temperature=0.2,
+            max_tokens=LLM_MAX_TOKENS,
+            priority="interactive",
+            name="chat",
         )
-        return (ans, str(e), (perf_counter() - start) * 1000.0)
+        return (content or "(no response)", None, (perf_counter() - start) * 1000.0, stats)
+    except Exception as e:
+        return (_llm_fallback(passages), str(e), (perf_counter() - start) * 1000.0, stats)
 
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(payload: ChatRequest):
-    # 1) Retrieve context from RAG
+async def _llm_stream(query: str, passages: List[Passage], stats_out: dict, history: Optional[List[dict]] = None) -> AsyncIterator[str]:
+    """Content deltas from an OpenAI-compatible `stream: true` completion.
+    Context packing stats are written into `stats_out`."""
+    messages, stats = await _llm_messages(query, passages, history)
+    stats_out.update(stats)
+    async for delta in llm_gateway.stream(messages, temperature=0.2, max_tokens=LLM_MAX_TOKENS, priority="interactive", name="chat_stream"):
+        yield delta
+
+
+async def _session_history(payload: ChatRequest) -> List[dict]:
+    """Summary + recent turns of the request's session ([] when stateless)."""
+    if not payload.session_id:
+        return []
+    loaded = chat_sessions.load_history(payload.session_id)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    summary, turns = loaded
+    return await chat_sessions.history_messages(summary, turns)
+
+
+async def _cache_lookup(payload: ChatRequest, history: List[dict]) -> Tuple[tuple, Optional[List[float]], dict, Optional[CacheMeta], Optional[tuple]]:
+    """Semantic answer-cache probe. Returns (scope, qvec, gens, cache_meta, found).
+    Skipped mid-conversation: the answer depends on the history, not just the message."""
+    cache_meta: Optional[CacheMeta] = None
+    scope = answer_cache.scope_key(payload.tenant_id, payload.user_roles, payload.spaces, payload.tags, payload.top_k)
+    qvec: Optional[List[float]] = None
+    gens: dict = {}
+    found = None
+    if SEMANTIC_CACHE_ENABLED and payload.bypass_cache:
+        answer_cache.stats["bypassed"] += 1
+    elif SEMANTIC_CACHE_ENABLED and not history:
+        cache_t0 = perf_counter()
+        try:
+            vectors, gens = await _rag_embed([payload.message], list(scope[2]))
+            qvec = vectors[0] if vectors else None
+            found = answer_cache.lookup(scope, qvec, gens) if qvec else None
+            cache_ms = (perf_counter() - cache_t0) * 1000.0
+            cache_meta = CacheMeta(hit=bool(found), similarity=found[1] if found else None, time_ms=cache_ms)
+        except Exception as e:
+            qvec = None
+            cache_meta = CacheMeta(hit=False, time_ms=(perf_counter() - cache_t0) * 1000.0, error=str(e))
+    return scope, qvec, gens, cache_meta, found
+
+
+async def _retrieve_context(payload: ChatRequest, qvec: Optional[List[float]] = None) -> Tuple[List[Passage], List[SourceItem], RagMeta]:
     rag_t0 = perf_counter()
     rag_err: Optional[str] = None
     try:
@@ -140,17 +216,29 @@ async def chat(payload: ChatRequest):
             spaces=payload.spaces,
             tags=payload.tags,
             top_k=payload.top_k,
+            query_vector=qvec,
         )
     except Exception as e:
         results = []
         rag_err = str(e)
     rag_ms = (perf_counter() - rag_t0) * 1000.0
-    snippets = []
+    passages: List[Passage] = []
     sources: List[SourceItem] = []
     for r in results:
-        text = r.get("text", "")[:1800]
+        # prefer RAG's query-focused snippet; fall back to a prefix for older RAG builds
+        text = r.get("snippet") or (r.get("text") or "")[:SNIPPET_CHARS]
         if text:
-            snippets.append(text)
+            score = r.get("rerank_score")
+            passages.append(
+                Passage(
+                    index=len(passages),
+                    text=text,
+                    # RAG returns results best-first; rank stands in when there is no rerank score
+                    score=float(score) if score is not None else -float(len(passages)),
+                    document_id=r.get("document_id"),
+                    chunk_index=(r.get("source") or {}).get("chunk_index"),
+                )
+            )
             sources.append(
                 SourceItem(
                     id=str(r.get("id")) if r.get("id") is not None else None,
@@ -160,14 +248,156 @@ async def chat(payload: ChatRequest):
                     document_id=r.get("document_id"),
                 )
             )
+    return passages, sources, RagMeta(count=len(passages), time_ms=rag_ms, error=rag_err)
+
+
+def _cache_answer(scope: tuple, qvec: Optional[List[float]], gens: dict, answer: str, sources: List[SourceItem]) -> None:
+    answer_cache.store(
+        scope,
+        qvec,
+        CachedAnswer(
+            answer=answer,
+            sources=[s.model_dump() for s in sources],
+            generations=gens,
+        ),
+    )
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(payload: ChatRequest):
+    # 0) Serve a semantically equivalent prior answer if its sources are unchanged
+    history = await _session_history(payload)
+    scope, qvec, gens, cache_meta, found = await _cache_lookup(payload, history)
+    if found:
+        entry, _sim = found
+        if payload.session_id:
+            chat_sessions.append_turns(payload.session_id, payload.message, entry.answer)
+        return ChatResponse(
+            answer=entry.answer,
+            sources=[SourceItem(**s) for s in entry.sources],
+            meta=ChatMeta(cache=cache_meta),
+            session_id=payload.session_id,
+        )
+    # 1) Retrieve context from RAG
+    passages, sources, rag_meta = await _retrieve_context(payload, qvec)
     # 2) Ask local LLM with context
-    answer, llm_err, llm_ms = await _llm_answer(payload.message, snippets)
+    answer, llm_err, llm_ms, context_stats = await _llm_answer(payload.message, passages, history)
     # Always return 200 with fallback answer to avoid frontend fetch errors
     meta = ChatMeta(
-        rag=RagMeta(count=len(snippets), time_ms=rag_ms, error=rag_err),
+        rag=rag_meta,
         llm=LlmMeta(time_ms=llm_ms, error=llm_err, model=LLM_MODEL),
+        cache=cache_meta,
+        context=context_stats,
     )
-    return ChatResponse(answer=answer, sources=sources, meta=meta)
+    # Only cache real answers; fallbacks should be retried next time
+    if qvec is not None and llm_err is None and rag_meta.error is None:
+        _cache_answer(scope, qvec, gens, answer, sources)
+    if payload.session_id and llm_err is None:
+        chat_sessions.append_turns(payload.session_id, payload.message, answer)
+    return ChatResponse(answer=answer, sources=sources, meta=meta, session_id=payload.session_id)
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(payload: ChatRequest):
+    """Server-sent events variant of /chat.
+    Events: `sources` (list of SourceItem), any number of `token` ({"delta"}),
+    then `done` with ChatMeta plus ttft_ms/total_ms. A cache hit sends the whole
+    answer as one token; an unreachable LLM sends the fallback text the same way.
+    """
+    t0 = perf_counter()
+    history = await _session_history(payload)
+
+    async def _events():
+        scope, qvec, gens, cache_meta, found = await _cache_lookup(payload, history)
+        if found:
+            entry, _sim = found
+            yield _sse("sources", entry.sources)
+            yield _sse("token", {"delta": entry.answer})
+            if payload.session_id:
+                chat_sessions.append_turns(payload.session_id, payload.message, entry.answer)
+            meta = ChatMeta(cache=cache_meta).model_dump()
+            yield _sse("done", {**meta, "session_id": payload.session_id, "ttft_ms": (perf_counter() - t0) * 1000.0, "total_ms": (perf_counter() - t0) * 1000.0})
+            return
+        passages, sources, rag_meta = await _retrieve_context(payload, qvec)
+        yield _sse("sources", [s.model_dump() for s in sources])
+        context_stats: dict = {}
+        llm_t0 = perf_counter()
+        ttft_ms: Optional[float] = None
+        parts: List[str] = []
+        llm_err: Optional[str] = None
+        try:
+            async for delta in _llm_stream(payload.message, passages, context_stats, history):
+                if ttft_ms is None:
+                    ttft_ms = (perf_counter() - t0) * 1000.0
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+        except Exception as e:
+            llm_err = str(e)
+            if not parts:
+                fallback = _llm_fallback(passages)
+                ttft_ms = (perf_counter() - t0) * 1000.0
+                yield _sse("token", {"delta": fallback})
+        answer = "".join(parts)
+        if not answer and llm_err is None:
+            answer = "(no response)"
+            yield _sse("token", {"delta": answer})
+        meta = ChatMeta(
+            rag=rag_meta,
+            llm=LlmMeta(time_ms=(perf_counter() - llm_t0) * 1000.0, error=llm_err, model=LLM_MODEL),
+            cache=cache_meta,
+            context=context_stats or None,
+        )
+        if qvec is not None and llm_err is None and rag_meta.error is None:
+            _cache_answer(scope, qvec, gens, answer, sources)
+        if payload.session_id and llm_err is None:
+            chat_sessions.append_turns(payload.session_id, payload.message, answer)
+        yield _sse("done", {**meta.model_dump(), "session_id": payload.session_id, "ttft_ms": ttft_ms, "total_ms": (perf_counter() - t0) * 1000.0})
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/chat/sessions")
+async def chat_session_create():
+    return {"session_id": chat_sessions.create_session()}
+
+
+@router.get("/chat/sessions/{session_id}")
+async def chat_session_get(session_id: str):
+    sess = chat_sessions.get_session(session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return sess
+
+
+@router.delete("/chat/sessions/{session_id}")
+async def chat_session_delete(session_id: str):
+    if not chat_sessions.delete_session(session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"ok": True}
+
+
+@router.get("/chat/cache/stats")
+async def chat_cache_stats():
+    return {"enabled": SEMANTIC_CACHE_ENABLED, **answer_cache.info()}
+
+
+@router.get("/chat/llm/stats")
+async def chat_llm_stats():
+    return {**llm_gateway.metrics(), "tokenizer": token_counter.stats}
+
+
+@router.post("/chat/cache/clear")
+async def chat_cache_clear():
+    answer_cache.clear()
+    return {"ok": True}
 
 
 @router.post("/rag_upload")
@@ -182,22 +412,22 @@ async def rag_upload(
 ):
     url = f"{RAG_API_URL.rstrip('/')}/upload_sync"
     try:
-        async with httpx.AsyncClient(timeout=RAG_TIMEOUT_S) as client:
-            data = {
-                "tenant_id": tenant_id,
-                "uploader_id": uploader_id,
-                "space": space,
-                "tags": tags,
-            }
-            if project_id:
-                data["project_id"] = project_id
-            if project_subdb:
-                data["project_subdb"] = project_subdb
-            files = {
-                "file": (file.filename, await file.read(), file.content_type or "application/octet-stream"),
-            }
-            r = await client.post(url, data=data, files=files)
-            r.raise_for_status()
-            return r.json()
+        client = http_clients.get("rag")
+        data = {
+            "tenant_id": tenant_id,
+            "uploader_id": uploader_id,
+            "space": space,
+            "tags": tags,
+        }
+        if project_id:
+            data["project_id"] = project_id
+        if project_subdb:
+            data["project_subdb"] = project_subdb
+        files = {
+            "file": (file.filename, await file.read(), file.content_type or "application/octet-stream"),
+        }
+        r = await client.post(url, data=data, files=files)
+        r.raise_for_status()
+        return r.json()
     except Exception as e:
         return {"error": str(e)}
@@ -6,9 +6,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from sqlalchemy import select
-import httpx
 
 from ..db import get_db
+from .. import candidate_scoring
 from ..rag_client import upsert_employee_with_text_privileges, offboard_employee
 from ..models import (
     Base,
@@ -28,8 +28,6 @@ from ..models import (
 
 router = APIRouter()
 
-LLM_URL = os.getenv("LLM_URL", "http://127.0.0.1:8085")
-LLM_MODEL = os.getenv("LLM_MODEL", "local-llm")
 MEETING_MINUTES = int(os.getenv("MEETING_MINUTES", "30"))
 DEFAULT_SCORE_THRESHOLD = float(os.getenv("AUTO_FILTER_MIN_SCORE", "0.5"))
 
@@ -70,6 +68,7 @@ class CandidateDTO(BaseModel):
     approved: bool
     filtered_out: bool
     match_score: Optional[float]
+    similarity: Optional[float] = None
     rank: Optional[int]
     resume_text: Optional[str] = None
     resume_url: Optional[str] = None
@@ -92,48 +91,6 @@ class CandidateUpdateReq(BaseModel):
     approved: Optional[bool] = None
 
 
-async def _llm_score_candidate(job: Job, candidate: Candidate) -> Optional[float]:
-    # Build prompt
-    system = (
-        "You are an expert technical recruiter. Given a job description and candidate resume, "
-        "return ONLY a floating point match score between 0 and 1 representing how well the candidate fits."
-    )
-    user = (
-        f"Job Title: {job.title}\n"
-        f"Job Description: {job.description}\n"
-        f"Qualifications: {job.qualifications or ''}\n\n"
-        f"Candidate: {candidate.name} <{candidate.email}>\n"
-        f"Resume: {candidate.resume_text or '(no resume text provided)'}\n\n"
-        "Return only the score as a number between 0 and 1."
-    )
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            r = await client.post(
-                f"{LLM_URL.rstrip('/')}/v1/chat/completions",
-                json={
-                    "model": LLM_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    "temperature": 0.0,
-                    "max_tokens": 20,
-                },
-            )
-            r.raise_for_status()
-            data = r.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-            # Try to parse a float from response
-            try:
-                score = float(content)
-                if 0.0 <= score <= 1.0:
-                    return score
-            except Exception:
-                return None
-    except Exception:
-        return None
-
-
 @router.post("/jobs", response_model=JobDTO)
 async def create_job(payload: CreateJobReq, db: Session = Depends(get_db)):
     job = Job(
@@ -318,26 +275,48 @@ async def auto_filter(job_id: int, min_score: Optional[float] = None, db: Sessio
     cands = db.execute(select(Candidate).where(Candidate.job_id == job_id)).scalars().all()
     threshold = min_score if min_score is not None else DEFAULT_SCORE_THRESHOLD
 
+    # Scores are cached per (job, resume) and committed as they arrive; don't
+    # keep this session's transaction open across the LLM calls.
+    spec, items, by_hash = candidate_scoring.snapshot(job, cands)
+    db.rollback()
+    scores, sims = await candidate_scoring.score_job(spec, items, by_hash)
+
+    cands = db.execute(select(Candidate).where(Candidate.job_id == job_id)).scalars().all()
     scored: List[Candidate] = []
     for c in cands:
-        score = await _llm_score_candidate(job, c)
-        c.match_score = score if score is not None else 0.0
-        c.filtered_out = (c.match_score or 0.0) < threshold
+        if c.id in scores:
+            c.match_score = scores[c.id]
+            c.filtered_out = (c.match_score or 0.0) < threshold
+        else:
+            # dropped by the embedding pre-screen; never reached the LLM
+            c.match_score = None
+            c.filtered_out = True
+        c.similarity = sims.get(c.id, c.similarity)
         scored.append(c)
-    # Rank by descending score
-    scored.sort(key=lambda x: (x.match_score or 0.0), reverse=True)
+    # Rank LLM-scored candidates by descending score, then the pre-screened rest by similarity
+    scored.sort(key=lambda x: (x.id in scores, x.match_score or 0.0, x.similarity or 0.0), reverse=True)
     for idx, c in enumerate(scored, start=1):
         c.rank = idx
     db.commit()
     return {
         "ok": True,
+        "llm_scored": len(scores),
         "ranked": [
-            {"id": c.id, "name": c.name, "score": c.match_score, "filtered_out": c.filtered_out, "rank": c.rank}
+            {"id": c.id, "name": c.name, "score": c.match_score, "similarity": c.similarity, "filtered_out": c.filtered_out, "rank": c.rank}
             for c in scored
         ],
     }
 
 
+@router.get("/jobs/{job_id}/autofilter/progress", response_model=dict)
+async def auto_filter_progress(job_id: int):
+    state = candidate_scoring.progress.get(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No autofilter run for this job")
+    done = state["cached"] + state["scored"] + state["failed"] + state["prescreened_out"]
+    return {**state, "done": done, "percent": round(100.0 * done / max(1, state["total"]), 1)}
+
+
 def _gen_company_email(db: Session, name: str, fallback_email: Optional[str]) -> str:
     domain = os.getenv("COMPANY_EMAIL_DOMAIN", "company.local")
     base_local = "".join(ch for ch in name.lower().strip().replace(" ", ".") if ch.isalnum() or ch == ".") or "employee"
@@ -1,7 +1,8 @@
 import os
 from typing import Optional
 from fastapi import APIRouter, UploadFile, File, Form
-import httpx
+
+from .. import http_clients
 
 router = APIRouter()
 
@@ -34,7 +35,7 @@ async def rag_upload(
     if project_subdb:
         data["project_subdb"] = project_subdb
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        r = await client.post(url, data=data, files=files)
-        r.raise_for_status()
-        return r.json()
+    # uploads parse and embed synchronously on the RAG side; allow longer than queries
+    r = await http_clients.get("rag").post(url, data=data, files=files, timeout=60.0)
+    r.raise_for_status()
+    return r.json()
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[dict]
+    generations: Dict[str, int]
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    """Answers keyed by question embedding, partitioned by ACL scope.
+
+    A lookup only ever compares against entries stored under exactly the same
+    (tenant, roles, spaces, tags, top_k) scope, so an answer can't leak to a
+    caller who could not have retrieved its sources. Within a scope the best
+    cosine match above the threshold is served, provided the index
+    generations of the searched spaces are unchanged since it was stored.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, max_per_scope: Optional[int] = None, ttl_s: Optional[float] = None) -> None:
+        self.threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")) if threshold is None else threshold
+        self.max_per_scope = int(os.getenv("SEMANTIC_CACHE_MAX_PER_SCOPE", "256")) if max_per_scope is None else max_per_scope
+        self.ttl_s = float(os.getenv("SEMANTIC_CACHE_TTL_S", "3600")) if ttl_s is None else ttl_s
+        self._entries: Dict[Tuple, List[CachedAnswer]] = {}
+        self._matrices: Dict[Tuple, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "stores": 0, "bypassed": 0}
+
+    @staticmethod
+    def scope_key(tenant_id: str, user_roles: List[str], spaces: Optional[List[str]], tags: Optional[List[str]], top_k: int) -> Tuple:
+        return (
+            tenant_id,
+            tuple(sorted(set(user_roles))),
+            tuple(sorted({s.lower() for s in (spaces or ["documents"])})),
+            tuple(sorted(set(tags or []))),
+            int(top_k),
+        )
+
+    def lookup(self, scope: Tuple, vector: List[float], generations: Dict[str, int]) -> Optional[Tuple[CachedAnswer, float]]:
+        q = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            entries = self._entries.get(scope)
+            mat = self._matrices.get(scope)
+            if not entries or mat is None:
+                self.stats["misses"] += 1
+                return None
+            sims = mat @ q
+            order = np.argsort(-sims)
+            for i in order:
+                sim = float(sims[i])
+                if sim < self.threshold:
+                    break
+                entry = entries[int(i)]
+                if now - entry.created_at > self.ttl_s or entry.generations != generations:
+                    self.stats["stale"] += 1
+                    continue
+                entry.hits += 1
+                self.stats["hits"] += 1
+                return entry, sim
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, scope: Tuple, vector: List[float], entry: CachedAnswer) -> None:
+        now = time.time()
+        with self._lock:
+            entries = self._entries.setdefault(scope, [])
+            vectors = list(self._matrices[scope]) if scope in self._matrices else []
+            # Drop entries that can no longer be served before evicting live ones
+            keep = [i for i, e in enumerate(entries) if now - e.created_at <= self.ttl_s and e.generations == entry.generations]
+            entries = [entries[i] for i in keep]
+            vectors = [vectors[i] for i in keep]
+            entries.append(entry)
+            vectors.append(np.asarray(vector, dtype=np.float32))
+            if len(entries) > self.max_per_scope:
+                entries = entries[-self.max_per_scope:]
+                vectors = vectors[-self.max_per_scope:]
+            self._entries[scope] = entries
+            self._matrices[scope] = np.vstack(vectors)
+            self.stats["stores"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+    def info(self) -> dict:
+        with self._lock:
+            size = sum(len(v) for v in self._entries.values())
+            scopes = len(self._entries)
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": size,
+            "scopes": scopes,
+            "hit_rate": (self.stats["hits"] / lookups) if lookups else 0.0,
+            "threshold": self.threshold,
+        }
+
+
+answer_cache = SemanticAnswerCache()